@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Single-process microbenchmarks for the numerical kernels in nga_mpi_ml_example.py.
+
+  psa : response spectrum (PSA over a period grid) for one synthetic H1/H2 pair.
+        naive per-period Nigam-Jennings loop (pure Python, one period at a time)
+        vs the FFT engine, plus the max relative difference.
+  metrics : per-component peaks (max, min, argmax, argmin) on long records.
+        four separate NumPy reductions vs fused_peaks() per component (wall time and speedup only;
+        how many bytes actually come from DRAM is not measured).
+
+Example:
+  python3 benchmark_nga_kernels.py psa --npts 8000 --nper 21
+  python3 benchmark_nga_kernels.py metrics --npts 1000000 4000000
+"""
+
+from __future__ import annotations
+
+import argparse
+import importlib.util
+import math
+import sys
+import time
+from pathlib import Path
+from typing import Callable, List, Tuple
+
+import numpy as np
+
+
+def load_pipeline():
+    """Import nga_mpi_ml_example.py from this directory (main() is not run)."""
+    path = Path(__file__).resolve().with_name("nga_mpi_ml_example.py")
+    spec = importlib.util.spec_from_file_location("nga_mpi_ml_example", path)
+    mod = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = mod
+    spec.loader.exec_module(mod)  # type: ignore[union-attr]
+    return mod
+
+
+def synthetic_pair(npts: int, dt: float, seed: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """Band-limited noise with a build-up/decay envelope, ~0.3 g peak (two correlated components)."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(npts) * dt
+    env = (t / max(t[-1], dt)) ** 2 * np.exp(-8.0 * t / max(t[-1], dt))
+    env /= env.max() if env.max() > 0 else 1.0
+    k = np.ones(5) / 5.0
+    a1 = np.convolve(rng.normal(size=npts), k, mode="same") * env
+    a2 = 0.6 * a1 + 0.8 * np.convolve(rng.normal(size=npts), k, mode="same") * env
+    s = 0.3 / max(np.abs(a1).max(), 1e-12)
+    return a1 * s, a2 * s
+
+
+def timed(fn: Callable[[], object], repeat: int) -> Tuple[float, object]:
+    """Best-of-`repeat` wall time and the last result."""
+    best = math.inf
+    out = None
+    for _ in range(max(1, repeat)):
+        t0 = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - t0)
+    return best, out
+
+
+# ---------------------------
+# PSA
+# ---------------------------
+
+def nigam_jennings_coeffs(T: float, dt: float, damping: float) -> Tuple[Tuple[float, ...], Tuple[float, ...]]:
+    """
+    Closed-form Nigam & Jennings (1969) step coefficients for x'' + 2 z w x' + w^2 x = -a(t), a linear
+    over the step: x1 = a11 x + a12 v + b11 a0 + b12 a1, v1 = a21 x + a22 v + b21 a0 + b22 a1.
+    Written out independently of the pipeline's matrix-exponential form (_nj_step).
+    """
+    z = damping
+    w = 2.0 * math.pi / T
+    r = math.sqrt(1.0 - z * z)
+    wd = w * r
+    e = math.exp(-z * w * dt)
+    s, c = math.sin(wd * dt), math.cos(wd * dt)
+    a11 = e * (z / r * s + c)
+    a12 = e * s / wd
+    a21 = -w / r * e * s
+    a22 = e * (c - z / r * s)
+    k1 = (2.0 * z * z - 1.0) / (w * w * dt)
+    k2 = 2.0 * z / (w ** 3 * dt)
+    b11 = e * ((k1 + z / w) * s / wd + (k2 + 1.0 / (w * w)) * c) - k2
+    b12 = -e * (k1 * s / wd + k2 * c) - 1.0 / (w * w) + k2
+    cs = c - z / r * s
+    sc = wd * s + z * w * c
+    b21 = e * ((k1 + z / w) * cs - (k2 + 1.0 / (w * w)) * sc) + 1.0 / (w * w * dt)
+    b22 = -e * (k1 * cs - k2 * sc) - 1.0 / (w * w * dt)
+    return (a11, a12, a21, a22), (b11, b12, b21, b22)
+
+
+def naive_psa_loop(acc: np.ndarray, dt: float, periods: np.ndarray, damping: float) -> np.ndarray:
+    """Reference: one period at a time, scalar Nigam-Jennings recursion in pure Python."""
+    out = np.empty(len(periods))
+    a = acc.tolist()
+    for j, T in enumerate(periods):
+        (a11, a12, a21, a22), (b11, b12, b21, b22) = nigam_jennings_coeffs(float(T), dt, damping)
+        x = v = peak = 0.0
+        for i in range(len(a) - 1):
+            x, v = (a11 * x + a12 * v + b11 * a[i] + b12 * a[i + 1],
+                    a21 * x + a22 * v + b21 * a[i] + b22 * a[i + 1])
+            peak = max(peak, abs(x))
+        out[j] = (2.0 * math.pi / T) ** 2 * peak
+    return out
+
+
+def bench_psa(args: argparse.Namespace) -> None:
+    nga = load_pipeline()
+    periods = np.geomspace(0.01, 10.0, args.nper)
+    angles = np.arange(0.0, 180.0, args.angle_step)
+    a1, a2 = synthetic_pair(args.npts, args.dt, seed=args.seed)
+    print(f"PSA: npts={args.npts} dt={args.dt} periods={args.nper} damping={args.damping} "
+          f"angles={angles.size} (RotD50)")
+
+    # naive loop only covers H1 (and, if asked, a shorter record): it is slow by design
+    n_naive = min(args.npts, args.naive_npts) if args.naive_npts > 0 else args.npts
+    t_naive, ref = timed(lambda: naive_psa_loop(a1[:n_naive], args.dt, periods, args.damping), 1)
+    t_naive *= args.npts / n_naive
+    rows: List[Tuple[str, float, float]] = [("naive loop (H1 only)", t_naive, 0.0)]
+
+    w2 = (2.0 * np.pi / periods) ** 2
+    solve = nga.sdof_displacement_fft
+    t_h1, h1 = timed(lambda: w2 * np.abs(solve(a1[:n_naive], args.dt, periods, args.damping)).max(axis=-1)[:, 0],
+                     args.repeat)
+    t_h1 *= args.npts / n_naive
+    rel = float(np.max(np.abs(h1 - ref) / np.abs(ref)))
+    rows.append(("fft (H1 only)", t_h1, rel))
+    t_all, _ = timed(lambda: nga.compute_psa(a1, a2, args.dt, periods, angles, damping=args.damping), args.repeat)
+    rows.append(("fft (H1+H2+RotD50)", t_all, np.nan))
+
+    if n_naive < args.npts:
+        print(f"  (naive and 'H1 only' rows timed on {n_naive} samples, scaled to {args.npts})")
+    print(f"  {'kernel':<24s} {'time [s]':>10s} {'vs naive':>9s} {'max rel diff':>13s}")
+    for name, t, rel in rows:
+        print(f"  {name:<24s} {t:10.4f} {t_naive / t:8.1f}x {rel:13.2e}")
+
+
+# ---------------------------
+# Time-domain metrics
+# ---------------------------
+
+def separate_peaks(a: np.ndarray) -> Tuple[float, float, int, int]:
+    """Reference: the four reductions the metrics used to run, one full read each."""
+    return float(np.max(a)), float(np.min(a)), int(np.argmax(a)), int(np.argmin(a))
+
+
+def bench_metrics(args: argparse.Namespace) -> None:
+    nga = load_pipeline()
+    dtype = np.dtype(args.dtype)
+    block = args.block or nga.PEAK_BLOCK
+    print(f"metrics: dtype={dtype.name} block={block} samples ({block * dtype.itemsize / 1024:.0f} KiB)")
+    print(f"  {'npts':>9s} {'kernel':<22s} {'time [ms]':>10s} {'speedup':>8s}")
+    for npts in args.npts:
+        a1, a2 = (x.astype(dtype) for x in synthetic_pair(npts, 0.005, seed=args.seed))
+
+        t_sep, ref = timed(lambda: [separate_peaks(a1), separate_peaks(a2)], args.repeat)
+        t_fused, got = timed(lambda: [nga.fused_peaks(a1, block), nga.fused_peaks(a2, block)], args.repeat)
+        for j, r in enumerate(ref):
+            if tuple(got[j]) != r:
+                raise SystemExit(f"fused_peaks differs from np.max/np.argmax at npts={npts}")
+
+        for name, t in (("4 reductions (H1, H2)", t_sep), ("fused (H1, H2)", t_fused)):
+            print(f"  {npts:9d} {name:<22s} {1e3 * t:10.3f} {t_sep / t:7.2f}x")
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Microbenchmarks for nga_mpi_ml_example.py kernels")
+    sub = ap.add_subparsers(dest="kernel", required=True)
+
+    p = sub.add_parser("psa", help="response spectrum engine vs naive per-period loop")
+    p.add_argument("--npts", type=int, default=8000)
+    p.add_argument("--dt", type=float, default=0.005)
+    p.add_argument("--nper", type=int, default=21, help="log-spaced periods 0.01-10 s")
+    p.add_argument("--damping", type=float, default=0.05)
+    p.add_argument("--angle-step", type=float, default=1.0)
+    p.add_argument("--naive-npts", type=int, default=0,
+                   help="time the naive loop on only this many samples and scale up (default 0 = all)")
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--seed", type=int, default=0)
+    p.set_defaults(func=bench_psa)
+
+    p = sub.add_parser("metrics", help="fused peak kernel vs separate max/min/argmax/argmin")
+    p.add_argument("--npts", type=int, nargs="+", default=[100_000, 1_000_000, 4_000_000],
+                   help="record lengths to time (samples per component)")
+    p.add_argument("--dtype", choices=["float64", "float32"], default="float64")
+    p.add_argument("--block", type=int, default=None, help="time block (default: PEAK_BLOCK of the pipeline)")
+    p.add_argument("--repeat", type=int, default=5)
+    p.add_argument("--seed", type=int, default=0)
+    p.set_defaults(func=bench_metrics)
+
+    args = ap.parse_args()
+    args.func(args)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -18,10 +18,19 @@ from __future__ import annotations
 
 import argparse
 import csv
+import hashlib
+import heapq
 import math
 import os
-from dataclasses import dataclass
-from typing import Dict, List, Optional, Sequence, Tuple
+import queue
+import tempfile
+import threading
+import time
+import zipfile
+from collections import deque
+from collections.abc import Mapping, Sequence as SequenceABC
+from dataclasses import asdict, dataclass
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
 
 import numpy as np
 import h5py
@@ -93,11 +102,378 @@ class RotDRow:
 
 
 
+ROTD_MEM_MB_DEFAULT = 256.0   # scratch budget for the rotated (u, v) blocks
+_ROTD_BYTES_PER_CELL = 32     # u, v + two product temporaries, float64
+_ROTD_MIN_TIME_BLOCK = 1024   # below this, block the angles instead of shrinking time blocks
+_ROTD_BATCH_BLOCK_MB = 8.0    # records are stacked only up to this much scratch (stay cache-friendly)
+_ROTD_BATCH_MB = 64.0         # stacked (a1, a2) input held per RotDBatcher batch
+_ROTD_BATCH_MAX_NPTS = 32768  # longer float64 records gain nothing from stacking (scaled by itemsize)
+
+
+def _rotd_block_sizes(nang: int, npts: int, mem_budget_mb: float,
+                      cell_bytes: int = _ROTD_BYTES_PER_CELL) -> Tuple[int, int]:
+    """Return (angle_block, time_block) so one block of scratch fits in mem_budget_mb."""
+    budget = max(1.0, float(mem_budget_mb)) * 1024.0 * 1024.0
+    nt = int(budget // (max(1, nang) * cell_bytes))
+    if nt >= min(npts, _ROTD_MIN_TIME_BLOCK):
+        return nang, max(1, min(npts, nt))
+    nt = min(npts, _ROTD_MIN_TIME_BLOCK)
+    na = int(budget // (nt * cell_bytes))
+    return max(1, min(nang, na)), nt
+
+
+def _running_update(best: np.ndarray, ibest: np.ndarray, val: np.ndarray, ival: np.ndarray, larger: bool) -> None:
+    """
+    In-place running max (larger=True) or min update that keeps np.argmax/np.argmin
+    semantics across blocks: first occurrence wins and the first NaN sticks.
+    """
+    better = (val > best) if larger else (val < best)
+    better |= np.isnan(val) & ~np.isnan(best)
+    best[better] = val[better]
+    ibest[better] = ival[better]
+
+
+def _rotd_angle_stats_batch(
+    A1: np.ndarray,
+    A2: np.ndarray,
+    angles_deg: np.ndarray,
+    mem_budget_mb: float = ROTD_MEM_MB_DEFAULT,
+) -> Dict[str, np.ndarray]:
+    """
+    Per-angle max/min/argmax/argmin of the rotated pair for a stack of records
+      u =  cos(theta)*a1 + sin(theta)*a2
+      v = -sin(theta)*a1 + cos(theta)*a2
+    A1, A2: (nrec, npts). Evaluated in (record, angle, time) blocks so scratch memory stays
+    within mem_budget_mb instead of holding full (nrec, nang, npts) u and v arrays.
+    float32 inputs are rotated in float32 (half the scratch bandwidth); anything else in float64.
+
+    Returns arrays of shape (nrec, nang) keyed u_max, u_min, u_imax, u_imin, v_max, v_min, v_imax, v_imin.
+    """
+    work = np.result_type(A1.dtype, A2.dtype, np.float32)
+    theta = np.deg2rad(np.asarray(angles_deg, dtype=float))
+    c_all = np.cos(theta).astype(work)[None, :, None]   # (1,nang,1)
+    s_all = np.sin(theta).astype(work)[None, :, None]   # (1,nang,1)
+    nang = theta.size
+    nrec, n = A1.shape
+    cell_bytes = 4 * work.itemsize
+
+    budget = max(1.0, float(mem_budget_mb)) * 1024.0 * 1024.0
+    per_rec = max(1, nang * n * cell_bytes)
+    if per_rec <= budget:
+        stack = min(budget, _ROTD_BATCH_BLOCK_MB * 1024.0 * 1024.0)
+        nr_b, na_b, nt_b = max(1, int(stack // per_rec)), nang, n
+    else:
+        nr_b = 1
+        na_b, nt_b = _rotd_block_sizes(nang, n, mem_budget_mb, cell_bytes)
+
+    out: Dict[str, np.ndarray] = {}
+    for comp in ("u", "v"):
+        out[f"{comp}_max"] = np.full((nrec, nang), -np.inf)
+        out[f"{comp}_min"] = np.full((nrec, nang), np.inf)
+        out[f"{comp}_imax"] = np.zeros((nrec, nang), dtype=np.int64)
+        out[f"{comp}_imin"] = np.zeros((nrec, nang), dtype=np.int64)
+
+    for r0 in range(0, nrec, nr_b):
+        r1 = min(nrec, r0 + nr_b)
+        for k0 in range(0, nang, na_b):
+            k1 = min(nang, k0 + na_b)
+            c = c_all[:, k0:k1]
+            s = s_all[:, k0:k1]
+            sl = (slice(r0, r1), slice(k0, k1))
+            for t0 in range(0, n, nt_b):
+                t1 = min(n, t0 + nt_b)
+                x1 = A1[r0:r1, None, t0:t1]
+                x2 = A2[r0:r1, None, t0:t1]
+                for comp, blk in (("u", c * x1 + s * x2), ("v", -s * x1 + c * x2)):
+                    imax = np.argmax(blk, axis=2)
+                    imin = np.argmin(blk, axis=2)
+                    vmax = np.take_along_axis(blk, imax[:, :, None], axis=2)[:, :, 0]
+                    vmin = np.take_along_axis(blk, imin[:, :, None], axis=2)[:, :, 0]
+                    _running_update(out[f"{comp}_max"][sl], out[f"{comp}_imax"][sl], vmax, imax + t0, larger=True)
+                    _running_update(out[f"{comp}_min"][sl], out[f"{comp}_imin"][sl], vmin, imin + t0, larger=False)
+    return out
+
+
+def _rotd_angle_stats(
+    a1: np.ndarray,
+    a2: np.ndarray,
+    angles_deg: np.ndarray,
+    mem_budget_mb: float = ROTD_MEM_MB_DEFAULT,
+) -> Dict[str, np.ndarray]:
+    """Single-record _rotd_angle_stats_batch(); returns arrays of shape (nang,)."""
+    st = _rotd_angle_stats_batch(a1[None, :], a2[None, :], angles_deg, mem_budget_mb=mem_budget_mb)
+    return {k: v[0] for k, v in st.items()}
+
+
+ROTD_LEVELS = (("RotD0", 0.0), ("RotD50", 0.5), ("RotD100", 1.0))
+
+
+def _rotd_rows_from_stats_batch(
+    st: Dict[str, np.ndarray],
+    ns: Sequence[int],
+    dts: Sequence[float],
+    angles_deg: np.ndarray,
+) -> List[List[RotDRow]]:
+    """
+    Turn per-angle rotated-pair stats (arrays of shape (nrec, nang)) into RotD0/50/100 rows,
+    one list per record. Percentiles and picks are vectorized across records.
+    """
+    ns = np.asarray(ns, dtype=float)[:, None]
+    dts = np.asarray(dts, dtype=float)[:, None]
+
+    # Max-abs per angle for each component
+    u_maxabs = np.maximum(st["u_max"], -st["u_min"])
+    v_maxabs = np.maximum(st["v_max"], -st["v_min"])
+
+    # Governing scalar per angle (like PGA RotD concept)
+    pga_theta = np.maximum(u_maxabs, v_maxabs)
+
+    # For amp_range, compute range for governing component at each angle
+    # Governing component = u if u_maxabs >= v_maxabs else v
+    use_u = (u_maxabs >= v_maxabs)
+    amp_range_theta = np.where(use_u, st["u_max"] - st["u_min"], st["v_max"] - st["v_min"])
+
+    # Time-based metrics for governing component (NaN where dt is unknown)
+    has_dt = np.isfinite(dts) & (dts > 0)
+    imax = np.where(use_u, st["u_imax"], st["v_imax"])
+    imin = np.where(use_u, st["u_imin"], st["v_imin"])
+    tmax = imax.astype(float) * dts
+    tmin = imin.astype(float) * dts
+    dt_peaks_theta = np.where(has_dt, np.abs(tmax - tmin), np.nan)
+    duration = np.where(has_dt, (ns - 1) * dts, np.nan)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        dt_peaks_norm_theta = np.where(duration > 0, dt_peaks_theta / duration, np.nan)
+
+    # Percentiles over angles; representative angle = closest pga_theta to the percentile
+    qs = [q for _name, q in ROTD_LEVELS]
+    vals = np.quantile(pga_theta, qs, axis=1, method="linear")                 # (3, nrec)
+    ks = np.argmin(np.abs(pga_theta[None, :, :] - vals[:, :, None]), axis=2)   # (3, nrec)
+
+    out: List[List[RotDRow]] = []
+    for i in range(pga_theta.shape[0]):
+        rows = []
+        for j, (name, _q) in enumerate(ROTD_LEVELS):
+            k = int(ks[j, i])
+            rows.append(RotDRow(
+                rsn="",
+                rotd=name,
+                angle_deg=float(angles_deg[k]),
+                pga=float(pga_theta[i, k]),
+                amp_range=float(amp_range_theta[i, k]),
+                dt_peaks=float(dt_peaks_theta[i, k]),
+                dt_peaks_norm=float(dt_peaks_norm_theta[i, k]),
+                duration=float(duration[i, 0]),
+                n_angles=int(len(angles_deg)),
+                ok=1,
+                err="",
+            ))
+        out.append(rows)
+    return out
+
+
+def _rotd_rows_from_stats(
+    st: Dict[str, np.ndarray],
+    n: int,
+    dt: float,
+    angles_deg: np.ndarray,
+) -> List[RotDRow]:
+    """Turn per-angle rotated-pair stats (arrays of shape (nang,)) into the RotD0/50/100 rows."""
+    return _rotd_rows_from_stats_batch({k: v[None, :] for k, v in st.items()}, [n], [dt], angles_deg)[0]
+
+
+def _rotd_error_rows(angles_deg: np.ndarray, err: str) -> List[RotDRow]:
+    return [RotDRow(
+        rsn="",
+        rotd="RotD50",
+        angle_deg=np.nan,
+        pga=np.nan,
+        amp_range=np.nan,
+        dt_peaks=np.nan,
+        dt_peaks_norm=np.nan,
+        duration=np.nan,
+        n_angles=int(len(angles_deg)),
+        ok=0,
+        err=err,
+    )]
+
+
+# Hull fast path:
+# The rotated amplitude at each time step is a1*cos(theta) + a2*sin(theta), i.e. the projection of
+# the (a1, a2) trajectory on a direction. Its max (and min, and the same for v) over time is always
+# attained on the convex hull of the trajectory, so only samples on/near the hull need rotating.
+ROTD_METHODS = ("brute", "hull")
+_HULL_PREFILTER_DIRS = 32     # extreme points used for the Akl-Toussaint interior prefilter
+_HULL_REL_TOL = 1e-9          # keep samples within this (x max|a|) of the hull boundary
+
+
+def _cross(o: np.ndarray, a: np.ndarray, b: np.ndarray) -> float:
+    return float((a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0]))
+
+
+def _convex_hull_ccw(pts: np.ndarray) -> np.ndarray:
+    """Strict convex hull vertices (counter-clockwise) of 2-D points, Andrew's monotone chain."""
+    P = np.unique(pts, axis=0)   # lexicographic (x, y) sort + de-dup
+    if P.shape[0] <= 2:
+        return P
+    lower: List[np.ndarray] = []
+    for p in P:
+        while len(lower) >= 2 and _cross(lower[-2], lower[-1], p) <= 0:
+            lower.pop()
+        lower.append(p)
+    upper: List[np.ndarray] = []
+    for p in P[::-1]:
+        while len(upper) >= 2 and _cross(upper[-2], upper[-1], p) <= 0:
+            upper.pop()
+        upper.append(p)
+    return np.asarray(lower[:-1] + upper[:-1])
+
+
+def _dist_inside(poly: np.ndarray, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    """
+    For a CCW convex polygon, the smallest signed distance of each point to the edge lines
+    (> 0 strictly inside, <= 0 on or outside the boundary).
+    """
+    d = np.full(x.shape, np.inf)
+    nv = poly.shape[0]
+    for i in range(nv):
+        p0 = poly[i]
+        p1 = poly[(i + 1) % nv]
+        ex, ey = p1[0] - p0[0], p1[1] - p0[1]
+        norm = math.hypot(ex, ey)
+        if norm == 0.0:
+            continue
+        np.minimum(d, (ex * (y - p0[1]) - ey * (x - p0[0])) / norm, out=d)
+    return d
+
+
+def _hull_candidate_indices(a1: np.ndarray, a2: np.ndarray) -> np.ndarray:
+    """
+    Time indices (ascending) of samples on or within a small tolerance of the convex hull
+    of the (a1, a2) trajectory. Ties (duplicate or collinear boundary samples) are kept, so
+    argmax/argmin over the candidates picks the same first-occurrence sample as brute force.
+    Returns all indices if the record contains non-finite values.
+    """
+    n = a1.size
+    if not (np.all(np.isfinite(a1)) and np.all(np.isfinite(a2))):
+        return np.arange(n)
+    scale = max(float(np.max(np.abs(a1))), float(np.max(np.abs(a2))))
+    tol = _HULL_REL_TOL * scale
+    idx = np.arange(n)
+
+    # Akl-Toussaint: drop samples well inside the polygon of extreme points in K directions
+    phi = np.linspace(0.0, 2.0 * np.pi, _HULL_PREFILTER_DIRS, endpoint=False)
+    ext = [int(np.argmax(math.cos(f) * a1 + math.sin(f) * a2)) for f in phi]
+    poly = np.column_stack([a1[ext], a2[ext]])
+    keep_poly = np.ones(poly.shape[0], dtype=bool)
+    keep_poly[1:] = np.any(poly[1:] != poly[:-1], axis=1)
+    poly = poly[keep_poly]
+    if poly.shape[0] >= 3:
+        idx = idx[_dist_inside(poly, a1, a2) <= tol]
+
+    hull = _convex_hull_ccw(np.column_stack([a1[idx], a2[idx]]))
+    if hull.shape[0] >= 3:
+        idx = idx[_dist_inside(hull, a1[idx], a2[idx]) <= tol]
+    return idx
+
+
+def _rotd_angle_stats_hull(
+    a1: np.ndarray,
+    a2: np.ndarray,
+    angles_deg: np.ndarray,
+    mem_budget_mb: float = ROTD_MEM_MB_DEFAULT,
+) -> Dict[str, np.ndarray]:
+    """Same output as _rotd_angle_stats(), evaluated only over the hull candidate samples (float64)."""
+    a1 = np.asarray(a1, dtype=float)
+    a2 = np.asarray(a2, dtype=float)
+    idx = _hull_candidate_indices(a1, a2)
+    st = _rotd_angle_stats(a1[idx], a2[idx], angles_deg, mem_budget_mb=mem_budget_mb)
+    for k in ("u_imax", "u_imin", "v_imax", "v_imin"):
+        st[k] = idx[st[k]]
+    return st
+
+
+def compare_rotd_rows(a: List[RotDRow], b: List[RotDRow], rtol: float = 1e-12) -> List[str]:
+    """Return a list of 'RotDxx.field' entries that differ between two RotD row lists."""
+    diffs: List[str] = []
+    if len(a) != len(b):
+        return [f"n_rows:{len(a)}!={len(b)}"]
+    for ra, rb in zip(a, b):
+        for name in ("rotd", "ok", "n_angles"):
+            if getattr(ra, name) != getattr(rb, name):
+                diffs.append(f"{ra.rotd}.{name}")
+        for name in ("angle_deg", "pga", "amp_range", "dt_peaks", "dt_peaks_norm", "duration"):
+            va, vb = getattr(ra, name), getattr(rb, name)
+            if not np.allclose(va, vb, rtol=rtol, atol=0.0, equal_nan=True):
+                diffs.append(f"{ra.rotd}.{name}")
+    return diffs
+
+
+ROTD_VALUE_FIELDS = ("pga", "amp_range", "dt_peaks", "dt_peaks_norm")
+METRIC_VALUE_FIELDS = ("amax", "amin", "amp_range", "dt_peaks")
+_DTYPE_CHECK_COUNTS = ("records", "angle_changed", "components", "peak_moved")
+
+
+def new_dtype_check() -> Dict[str, Any]:
+    """Accumulator for --dtype-check (see record_rotd_dtype_diff / record_metrics_dtype_diff)."""
+    return {**{k: 0 for k in _DTYPE_CHECK_COUNTS},
+            **{f: 0.0 for f in ROTD_VALUE_FIELDS},
+            **{f"metric_{f}": 0.0 for f in METRIC_VALUE_FIELDS}}
+
+
+def _fold_rel_diff(acc: Dict[str, Any], key: str, x: float, y: float) -> None:
+    if np.isnan(x) and np.isnan(y):
+        return
+    rel = abs(x - y) / max(abs(x), np.finfo(float).tiny)
+    acc[key] = max(acc[key], rel if np.isfinite(rel) else np.inf)
+
+
+def record_rotd_dtype_diff(acc: Dict[str, Any], ref: List[RotDRow], got: List[RotDRow]) -> None:
+    """
+    Fold max relative differences of reduced-precision RotD rows vs float64 rows into acc.
+    Rows whose representative angle moved (near-tied angles flip under rounding) are counted in
+    acc["angle_changed"] instead: their values belong to a different angle and are not compared.
+    """
+    acc["records"] += 1
+    for ra, rb in zip(ref, got):
+        if ra.angle_deg != rb.angle_deg:
+            acc["angle_changed"] += 1
+            continue
+        for f in ROTD_VALUE_FIELDS:
+            _fold_rel_diff(acc, f, getattr(ra, f), getattr(rb, f))
+
+
+def record_metrics_dtype_diff(acc: Dict[str, Any], ref: "RecordMetrics", got: "RecordMetrics") -> None:
+    """
+    Same for one component's metrics. Peak values are always compared; dt_peaks only when both
+    peaks stayed on the same sample (otherwise counted in acc["peak_moved"]).
+    """
+    acc["components"] += 1
+    for f in ("amax", "amin", "amp_range"):
+        _fold_rel_diff(acc, f"metric_{f}", getattr(ref, f), getattr(got, f))
+    if ref.tmax == got.tmax and ref.tmin == got.tmin:
+        _fold_rel_diff(acc, "metric_dt_peaks", ref.dt_peaks, got.dt_peaks)
+    else:
+        acc["peak_moved"] += 1
+
+
+def merge_dtype_checks(accs: Sequence[Dict[str, Any]]) -> Dict[str, Any]:
+    out = new_dtype_check()
+    for a in accs:
+        for k in _DTYPE_CHECK_COUNTS:
+            out[k] += a[k]
+        for k in out:
+            if k not in _DTYPE_CHECK_COUNTS:
+                out[k] = max(out[k], a[k])
+    return out
+
+
 def compute_rotd_summaries(
     a1: np.ndarray,
     a2: np.ndarray,
     dt: float,
     angles_deg: np.ndarray,
+    mem_budget_mb: float = ROTD_MEM_MB_DEFAULT,
+    method: str = "brute",
 ) -> List[RotDRow]:
     """
     Compute RotD0/50/100 for a few time-domain scalars:
@@ -109,8 +485,16 @@ def compute_rotd_summaries(
     Notes:
       - dt may be NaN; in that case time-based metrics are NaN.
       - This is a time-domain RotD variant. It mirrors the RotD idea (min/median/max over rotations).
+      - Rotations are evaluated in blocks with running max/min/argmax/argmin, so scratch memory
+        is bounded by mem_budget_mb (MB) rather than growing with nang x npts. Results are
+        identical to rotating the whole record at once.
+      - method="hull" rotates only the samples on the convex hull of the (a1, a2) trajectory:
+        O(npts + nang*h) instead of O(nang*npts). Check it with compare_rotd_rows() against
+        method="brute" (--rotd-validate).
     """
     try:
+        if method not in ROTD_METHODS:
+            raise ValueError(f"Unknown RotD method: {method}")
         if a1.shape != a2.shape:
             raise ValueError(f"H1/H2 length mismatch: {a1.shape} vs {a2.shape}")
 
@@ -118,91 +502,122 @@ def compute_rotd_summaries(
         if n < 2:
             raise ValueError("Timeseries too short")
 
-        # Precompute trig
-        theta = np.deg2rad(angles_deg.astype(float))
-        c = np.cos(theta)[:, None]   # (nang,1)
-        s = np.sin(theta)[:, None]   # (nang,1)
-
-        # Rotate into orthogonal pair for each angle: u, v (nang, npts)
-        u = c * a1[None, :] + s * a2[None, :]
-        v = -s * a1[None, :] + c * a2[None, :]
-
-        # Max-abs per angle for each component
-        u_maxabs = np.max(np.abs(u), axis=1)
-        v_maxabs = np.max(np.abs(v), axis=1)
-
-        # Governing scalar per angle (like PGA RotD concept)
-        pga_theta = np.maximum(u_maxabs, v_maxabs)
-
-        # For amp_range, compute range for governing component at each angle
-        # Governing component = u if u_maxabs >= v_maxabs else v
-        use_u = (u_maxabs >= v_maxabs)
-        # Compute max/min for both then select
-        u_max = np.max(u, axis=1); u_min = np.min(u, axis=1)
-        v_max = np.max(v, axis=1); v_min = np.min(v, axis=1)
-        amp_range_theta = np.where(use_u, u_max - u_min, v_max - v_min)
-
-        # Time-based metrics for governing component
-        if np.isfinite(dt) and dt > 0:
-            # indices of max/min for u and v
-            u_imax = np.argmax(u, axis=1); u_imin = np.argmin(u, axis=1)
-            v_imax = np.argmax(v, axis=1); v_imin = np.argmin(v, axis=1)
-
-            imax = np.where(use_u, u_imax, v_imax)
-            imin = np.where(use_u, u_imin, v_imin)
-
-            tmax = imax.astype(float) * dt
-            tmin = imin.astype(float) * dt
-            dt_peaks_theta = np.abs(tmax - tmin)
-            duration = float((n - 1) * dt)
-            dt_peaks_norm_theta = dt_peaks_theta / duration if duration > 0 else np.nan
+        stats_fn = _rotd_angle_stats_hull if method == "hull" else _rotd_angle_stats
+        st = stats_fn(a1, a2, angles_deg, mem_budget_mb=mem_budget_mb)
+        return _rotd_rows_from_stats(st, n, dt, angles_deg)
+
+    except Exception as e:
+        return _rotd_error_rows(angles_deg, str(e))
+
+def compute_rotd_summaries_batch(
+    A1: np.ndarray,
+    A2: np.ndarray,
+    valid: np.ndarray,
+    dts: Sequence[float],
+    angles_deg: np.ndarray,
+    mem_budget_mb: float = ROTD_MEM_MB_DEFAULT,
+) -> List[List[RotDRow]]:
+    """
+    Batched compute_rotd_summaries() for a stack of records in one vectorized pass.
+
+    A1, A2 : (nrec, L) H1/H2 stacks, equal length or zero/any-padded at the end
+    valid  : (nrec, L) bool mask; each row's valid samples must come first (a prefix)
+    dts    : per-record dt
+
+    Padded samples are overwritten with the record's first sample, which cannot change the
+    max/min and never wins an argmax/argmin tie, so each record's rows are identical to
+    compute_rotd_summaries() on the unpadded arrays. Returns one row list per record.
+    """
+    work = np.result_type(np.asarray(A1).dtype, np.asarray(A2).dtype, np.float32)
+    A1 = np.array(A1, dtype=work, copy=True)
+    A2 = np.array(A2, dtype=work, copy=True)
+    valid = np.asarray(valid, dtype=bool)
+    lengths = valid.sum(axis=1)
+
+    out: List[List[RotDRow]] = [[] for _ in range(A1.shape[0])]
+    ok = np.zeros(A1.shape[0], dtype=bool)
+    for i, n in enumerate(lengths.tolist()):
+        if not np.all(valid[i, :n]):
+            out[i] = _rotd_error_rows(angles_deg, "validity mask is not a prefix")
+        elif n < 2:
+            out[i] = _rotd_error_rows(angles_deg, "Timeseries too short")
         else:
-            dt_peaks_theta = np.full_like(pga_theta, np.nan, dtype=float)
-            dt_peaks_norm_theta = np.full_like(pga_theta, np.nan, dtype=float)
-            duration = np.nan
-
-        # Percentiles over angles
-        def _pick_rotd(name: str, q: float) -> RotDRow:
-            # Compute percentile value
-            val = np.quantile(pga_theta, q, method="linear")
-
-            # Choose a representative angle (closest pga_theta to percentile)
-            k = int(np.argmin(np.abs(pga_theta - val)))
-            return RotDRow(
-                rsn="",
-                rotd=name,
-                angle_deg=float(angles_deg[k]),
-                pga=float(pga_theta[k]),
-                amp_range=float(amp_range_theta[k]),
-                dt_peaks=float(dt_peaks_theta[k]),
-                dt_peaks_norm=float(dt_peaks_norm_theta[k]),
-                duration=float(duration),
-                n_angles=int(len(angles_deg)),
-                ok=1,
-                err="",
-            )
+            ok[i] = True
+            A1[i, n:] = A1[i, 0]
+            A2[i, n:] = A2[i, 0]
+
+    rows_ok = np.flatnonzero(ok)
+    if rows_ok.size:
+        st = _rotd_angle_stats_batch(A1[rows_ok], A2[rows_ok], angles_deg, mem_budget_mb=mem_budget_mb)
+        rows = _rotd_rows_from_stats_batch(st, lengths[rows_ok], np.asarray(dts, dtype=float)[rows_ok], angles_deg)
+        for i, rr in zip(rows_ok.tolist(), rows):
+            out[i] = rr
+    return out
 
-        rows = [
-            _pick_rotd("RotD0", 0.0),
-            _pick_rotd("RotD50", 0.5),
-            _pick_rotd("RotD100", 1.0),
-        ]
-        return rows
 
-    except Exception as e:
-        return [RotDRow(
-            rsn="",
-            rotd="RotD50",
-            angle_deg=np.nan,
-            pga=np.nan,
-            amp_range=np.nan,
-            dt_peaks=np.nan,
-            dt_peaks_norm=np.nan,
-            duration=np.nan,
-            n_angles=int(len(angles_deg)),
-            ok=0,
-            err=str(e),
-        )]
+def _length_bucket(n: int) -> int:
+    """Length bucket with ~19% max padding (quarter-octave bins)."""
+    return int(math.ceil(4.0 * math.log2(max(2, int(n)))))
+
+
+class RotDBatcher:
+    """
+    Collects (rsn, a1, a2, dt) records and evaluates RotD for many of them at once with
+    compute_rotd_summaries_batch(), grouped by length bucket to limit padding. Stacking pays
+    off while NumPy call overhead is a visible share of a record (about 1.5x at 1-4k samples,
+    1.2x at 10-20k, nothing past ~30k at a 1 deg step, float64), so records longer than
+    _ROTD_BATCH_MAX_NPTS (twice that for float32, which moves half the bytes) are computed directly. A batch is flushed after `batch` records or
+    once its stacked input reaches _ROTD_BATCH_MB; the rotation scratch itself is blocked to
+    mem_budget_mb inside the batched kernel.
+    Finished rows (rsn filled in) are appended to `rows`; call flush() after the last add().
+    """
+
+    def __init__(self, rows: List[RotDRow], angles_deg: np.ndarray, *, batch: int,
+                 mem_budget_mb: float = ROTD_MEM_MB_DEFAULT):
+        self.rows = rows
+        self.angles_deg = angles_deg
+        self.batch = max(1, int(batch))
+        self.mem_budget_mb = mem_budget_mb
+        self.pending: List[Tuple[str, np.ndarray, np.ndarray, float]] = []
+        self.pending_bytes = 0
+
+    def add(self, rsn: str, a1: np.ndarray, a2: np.ndarray, dt: float) -> None:
+        max_npts = _ROTD_BATCH_MAX_NPTS * 8 // max(1, a1.itemsize)
+        if a1.shape != a2.shape or a1.size < 2 or a1.size > max_npts:
+            # long records gain nothing from stacking; mismatched/short ones get the usual error row
+            for row in compute_rotd_summaries(a1, a2, dt, self.angles_deg, mem_budget_mb=self.mem_budget_mb):
+                row.rsn = rsn
+                self.rows.append(row)
+            return
+        self.pending.append((rsn, a1, a2, dt))
+        self.pending_bytes += a1.nbytes + a2.nbytes
+        if len(self.pending) >= self.batch or self.pending_bytes >= _ROTD_BATCH_MB * 1024.0 * 1024.0:
+            self.flush()
+
+    def flush(self) -> None:
+        buckets: Dict[int, List[Tuple[str, np.ndarray, np.ndarray, float]]] = {}
+        for item in self.pending:
+            buckets.setdefault(_length_bucket(item[1].size), []).append(item)
+        self.pending = []
+        self.pending_bytes = 0
+
+        for items in buckets.values():
+            L = max(it[1].size for it in items)
+            work = np.result_type(*[it[1].dtype for it in items], np.float32)
+            A1 = np.zeros((len(items), L), dtype=work)
+            A2 = np.zeros((len(items), L), dtype=work)
+            valid = np.zeros((len(items), L), dtype=bool)
+            for i, (_rsn, a1, a2, _dt) in enumerate(items):
+                A1[i, :a1.size] = a1
+                A2[i, :a2.size] = a2
+                valid[i, :a1.size] = True
+            results = compute_rotd_summaries_batch(A1, A2, valid, [it[3] for it in items],
+                                                   self.angles_deg, mem_budget_mb=self.mem_budget_mb)
+            for (rsn, *_), rr in zip(items, results):
+                for row in rr:
+                    row.rsn = rsn
+                    self.rows.append(row)
+
 
 # 2) Add a CSV writer for RotD rows
 def write_rotd_csv(path: str, rows: List[RotDRow]) -> None:
@@ -214,6 +629,228 @@ def write_rotd_csv(path: str, rows: List[RotDRow]) -> None:
         for r in rows:
             w.writerow({k: getattr(r, k) for k in fieldnames})
 
+# ---------------------------
+# Response spectra (--compute-psa)
+# ---------------------------
+# Pseudo-spectral acceleration PSA(T) = w^2 * max|x(t)| of a damped linear SDOF oscillator
+#   x'' + 2*zeta*w*x' + w^2*x = -a(t),   w = 2*pi/T
+# for H1, H2 and RotD50 (median over rotation angles; the oscillator is linear, so the rotated
+# response is cos(theta)*x1 + sin(theta)*x2 and goes through the same rotation kernel as RotD).
+# Every period (and both components) is solved at once: the Nigam-Jennings step (exact for
+# piecewise-linear a(t)) is evaluated as a DFT filter. Its exact transfer function on the FFT grid
+# gives the periodic solution; subtracting the free vibration from that solution's t=0 state turns it
+# into the at-rest one. Same numbers as the time-stepped NJ recursion up to round-off, in O(N log N)
+# NumPy calls (a Python-level time loop is several times slower even with all periods in one vector).
+
+PSA_DAMPING_DEFAULT = 0.05
+DEFAULT_PSA_PERIODS = (0.01, 0.02, 0.03, 0.05, 0.075, 0.1, 0.15, 0.2, 0.25, 0.3, 0.4, 0.5, 0.75,
+                       1.0, 1.5, 2.0, 3.0, 4.0, 5.0, 7.5, 10.0)
+_PSA_BYTES_PER_CELL = 48      # real response + half-length complex spectra + temporaries, per period/sample
+
+
+@dataclass
+class PSARow:
+    rsn: str
+    component: str         # H1, H2, RotD50
+    period: float          # s (NaN on error rows)
+    damping: float
+    psa: float             # w^2 * max|x|, same units as the acceleration series
+    ok: int
+    err: str
+
+
+def parse_periods(text: str) -> np.ndarray:
+    """'0.1,0.2,1' -> sorted unique positive periods; empty -> DEFAULT_PSA_PERIODS."""
+    vals = [float(t) for t in text.replace(";", ",").split(",") if t.strip()] if text else list(DEFAULT_PSA_PERIODS)
+    out = np.unique(np.asarray(vals, dtype=float))
+    if out.size == 0 or not np.all(np.isfinite(out)) or np.any(out <= 0):
+        raise ValueError(f"periods must be positive numbers, got {text!r}")
+    return out
+
+
+def _nj_step(periods: np.ndarray, dt: float, damping: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Exact one-step map of the state s = (x, v) when a(t) varies linearly over the step:
+      s[i+1] = phi @ s[i] + g0 * a[i] + g1 * a[i+1]
+    Returns phi (nper, 2, 2), g0 (nper, 2), g1 (nper, 2). Needs 0 < damping < 1.
+    """
+    z = float(damping)
+    if not 0.0 < z < 1.0:
+        raise ValueError(f"damping must be in (0, 1), got {damping}")
+    w = 2.0 * np.pi / np.asarray(periods, dtype=float)
+    wd = w * math.sqrt(1.0 - z * z)
+    e = np.exp(-z * w * dt)
+    c, s = np.cos(wd * dt), np.sin(wd * dt)
+    phi = np.empty((w.size, 2, 2))
+    phi[:, 0, 0] = e * (c + z * w / wd * s)
+    phi[:, 0, 1] = e * s / wd
+    phi[:, 1, 0] = -e * w * w / wd * s
+    phi[:, 1, 1] = e * (c - z * w / wd * s)
+
+    # M = [[0, 1], [-w^2, -2 z w]];  J1 = int_0^dt e^{M s} ds,  J2 = int_0^dt e^{M (dt - t)} t dt
+    Minv = np.zeros((w.size, 2, 2))
+    Minv[:, 0, 0] = -2.0 * z / w
+    Minv[:, 0, 1] = -1.0 / (w * w)
+    Minv[:, 1, 0] = 1.0
+    J1 = Minv @ (phi - np.eye(2))
+    J2 = dt * J1 - dt * (Minv @ phi) + Minv @ J1
+    # the ground acceleration enters the velocity equation as -a(t)
+    g1 = -J2[:, :, 1] / dt
+    g0 = -J1[:, :, 1] - g1
+    return phi, g0, g1
+
+
+def _fft_size(n: int) -> int:
+    """Smallest 2^a * 3^b * 5^c >= n (fast pocketfft sizes)."""
+    best = 1 << max(0, int(n - 1).bit_length())
+    p5 = 1
+    while p5 < best:
+        p35 = p5
+        while p35 < best:
+            m = p35
+            while m < n:
+                m *= 2
+            best = min(best, m)
+            p35 *= 3
+        p5 *= 5
+    return max(1, best)
+
+
+def sdof_displacement_fft(acc: np.ndarray, dt: float, periods: np.ndarray,
+                          damping: float = PSA_DAMPING_DEFAULT) -> np.ndarray:
+    """Relative displacement (nper, m, n) for acc (m, n), at rest at t=0; the NJ step as one rfft/irfft per period."""
+    acc = np.atleast_2d(np.asarray(acc, dtype=float))
+    phi, g0, g1 = _nj_step(periods, dt, damping)
+    m, n = acc.shape
+    N = _fft_size(n)
+    A = np.fft.rfft(acc, n=N, axis=-1)[None, :, :]                      # (1, m, K)
+    zk = np.exp(2j * np.pi * np.arange(A.shape[-1]) / N)[None, :]        # (1, K)
+
+    p00, p01, p10, p11 = (phi[:, i, j, None] for i, j in ((0, 0), (0, 1), (1, 0), (1, 1)))
+    fx = g0[:, 0, None] + g1[:, 0, None] * zk
+    fv = g0[:, 1, None] + g1[:, 1, None] * zk
+    det = (zk - p00) * (zk - p11) - p01 * p10
+    Hx = ((zk - p11) * fx + p01 * fv) / det                              # (nper, K)
+    Hv = (p10 * fx + (zk - p00) * fv) / det
+
+    # periodic solution, and its state at t=0
+    x = np.fft.irfft(Hx[:, None, :] * A, n=N, axis=-1)[:, :, :n]
+    wk = np.full(A.shape[-1], 2.0)
+    wk[0] = 1.0
+    if N % 2 == 0:
+        wk[-1] = 1.0
+    v0 = ((Hv[:, None, :] * A).real * wk).sum(axis=-1) / N              # (nper, m)
+    x0 = x[:, :, 0].copy()
+
+    # at rest at t=0: remove the free vibration phi^i @ (x0, v0)
+    w = (2.0 * np.pi / np.asarray(periods, dtype=float))[:, None, None]
+    z = float(damping)
+    wd = w * math.sqrt(1.0 - z * z)
+    t = np.arange(n, dtype=float)[None, None, :] * dt
+    x -= np.exp(-z * w * t) * (x0[:, :, None] * np.cos(wd * t)
+                               + (v0[:, :, None] + z * w * x0[:, :, None]) / wd * np.sin(wd * t))
+    x[:, :, 0] = 0.0
+    return x
+
+
+def compute_psa(
+    a1: np.ndarray,
+    a2: np.ndarray,
+    dt: float,
+    periods: np.ndarray,
+    angles_deg: np.ndarray,
+    *,
+    damping: float = PSA_DAMPING_DEFAULT,
+    mem_budget_mb: float = ROTD_MEM_MB_DEFAULT,
+) -> Dict[str, np.ndarray]:
+    """
+    PSA over `periods` for H1, H2 and RotD50 -> {"H1": (nper,), "H2": (nper,), "RotD50": (nper,)}.
+    Periods are processed in blocks so the response histories stay within mem_budget_mb.
+    RotD50 needs equal-length components (NaN otherwise).
+    """
+    if not (np.isfinite(dt) and dt > 0):
+        raise ValueError("dt unknown")
+    periods = np.asarray(periods, dtype=float)
+    pairs = a1.shape == a2.shape
+    recs = [np.vstack([a1, a2])] if pairs else [np.atleast_2d(a1), np.atleast_2d(a2)]
+
+    # rotation pairs (theta, theta + 90 deg) come out of one pass as the u and v stats
+    angles_deg = np.asarray(angles_deg, dtype=float)
+    k = int(np.count_nonzero(angles_deg < 90.0))
+    half = (2 * k == angles_deg.size and np.allclose(angles_deg[k:], angles_deg[:k] + 90.0))
+    rot_angles = angles_deg[:k] if half else angles_deg
+
+    w2 = (2.0 * np.pi / periods) ** 2
+    out = {c: np.full(periods.size, np.nan) for c in ("H1", "H2", "RotD50")}
+    n = max(r.shape[1] for r in recs)
+    budget = max(1.0, float(mem_budget_mb)) * 1024.0 * 1024.0
+    blk = max(1, int(budget // (2 * _fft_size(n) * _PSA_BYTES_PER_CELL)))
+    for p0 in range(0, periods.size, blk):
+        sl = slice(p0, min(periods.size, p0 + blk))
+        X = [sdof_displacement_fft(r, dt, periods[sl], damping) for r in recs]
+        X1, X2 = (X[0][:, 0], X[0][:, 1]) if pairs else (X[0][:, 0], X[1][:, 0])
+        out["H1"][sl] = w2[sl] * np.max(np.abs(X1), axis=1)
+        out["H2"][sl] = w2[sl] * np.max(np.abs(X2), axis=1)
+        if pairs:
+            # peaks of the rotated response sit on the convex hull of the (x1, x2) orbit
+            for j in range(X1.shape[0]):
+                idx = _hull_candidate_indices(X1[j], X2[j])
+                st = _rotd_angle_stats(X1[j, idx], X2[j, idx], rot_angles, mem_budget_mb=mem_budget_mb)
+                peak = np.maximum(st["u_max"], -st["u_min"])
+                if half:
+                    peak = np.concatenate([peak, np.maximum(st["v_max"], -st["v_min"])])
+                out["RotD50"][p0 + j] = w2[p0 + j] * np.median(peak)
+    return out
+
+
+def compute_psa_rows(
+    a1: np.ndarray,
+    a2: np.ndarray,
+    dt: float,
+    periods: np.ndarray,
+    angles_deg: np.ndarray,
+    *,
+    damping: float = PSA_DAMPING_DEFAULT,
+    mem_budget_mb: float = ROTD_MEM_MB_DEFAULT,
+) -> List[PSARow]:
+    """compute_psa() as PSARow rows (rsn left empty); one error row per component on failure."""
+    try:
+        res = compute_psa(a1, a2, dt, periods, angles_deg, damping=damping, mem_budget_mb=mem_budget_mb)
+    except Exception as e:
+        return [PSARow(rsn="", component=c, period=np.nan, damping=float(damping), psa=np.nan, ok=0, err=str(e))
+                for c in ("H1", "H2", "RotD50")]
+    rows = []
+    for comp in ("H1", "H2", "RotD50"):
+        if comp == "RotD50" and a1.shape != a2.shape:
+            rows.append(PSARow(rsn="", component=comp, period=np.nan, damping=float(damping), psa=np.nan,
+                               ok=0, err=f"H1/H2 length mismatch: {a1.shape} vs {a2.shape}"))
+            continue
+        rows.extend(PSARow(rsn="", component=comp, period=float(T), damping=float(damping), psa=float(v), ok=1, err="")
+                    for T, v in zip(np.asarray(periods, dtype=float).tolist(), res[comp].tolist()))
+    return rows
+
+
+@dataclass
+class PSASettings:
+    """--compute-psa options as passed down to process_loaded_rsn()."""
+    periods: np.ndarray
+    angles_deg: np.ndarray
+    damping: float = PSA_DAMPING_DEFAULT
+    mem_budget_mb: float = ROTD_MEM_MB_DEFAULT
+
+    def rows(self, rsn: str, a1: np.ndarray, a2: np.ndarray, dt: float) -> List[PSARow]:
+        rows = compute_psa_rows(a1, a2, dt, self.periods, self.angles_deg, damping=self.damping,
+                                mem_budget_mb=self.mem_budget_mb)
+        for r in rows:
+            r.rsn = rsn
+        return rows
+
+    def signature(self) -> Dict[str, Any]:
+        """Everything that changes the PSA numbers (cache keys / checkpoint ledger)."""
+        return {"periods": [float(t) for t in self.periods], "damping": float(self.damping),
+                "angles": [float(a) for a in self.angles_deg]}
+
+
 # ---------------------------
 # Helpers
 # ---------------------------
@@ -326,6 +963,9 @@ FLATFILE_COLS['PGA'] = ["PGA (g)"]
 FLATFILE_COLS['PGV'] = ["PGV (cm/sec)"]
 FLATFILE_COLS['Tp'] = ["Tp"]
 
+# flatfile variables carried per record (RecordMetrics.flat)
+FLAT_VAR_KEYS = [k for k in FLATFILE_COLS.keys() if k != "RSN"]
+
 # for ML:
 FEATURE_KEYS = [k for k in FLATFILE_COLS.keys() if k != "RSN"]  # exclude RSN  # edit as you like
 USE_INTERCEPT = True
@@ -392,6 +1032,117 @@ def build_flat_metadata_map(flat_rows: List[Dict[str, str]]) -> Dict[str, Dict[s
 
 
 
+# ---------------------------
+# Flatfile columnar cache (--flatfile-cache)
+# ---------------------------
+# openpyxl needs many seconds for the full NGA-West2 flatfile while every other rank waits in
+# comm.bcast. The first run coalesces each FLATFILE_COLS entry to one column (first non-empty
+# candidate, exactly as _pick_col_value does per row), parses it (_to_float_nan999), and saves the
+# result as <outdir>/<xlsx name>.flatcache.npz (the input directory is left alone; it may be shared or
+# read-only). Later runs into the same outdir load the arrays if the stamp still matches: same xlsx
+# size + mtime, or, if only the mtime moved (copy, touch), the same sha256. The stamp also covers
+# the sheet name, FLATFILE_COLS and FLATFILE_CACHE_VERSION.
+
+FLATFILE_CACHE_VERSION = 1
+
+
+def flatfile_cache_path(xlsx_path: PathLike, where: str = "auto", outdir: Optional[PathLike] = None) -> Optional[Path]:
+    """'auto' -> <outdir>/<xlsx name>.flatcache.npz (off without an outdir); 'off' -> None; else the path."""
+    if where == "off" or (where in ("", "auto") and outdir is None):
+        return None
+    return Path(outdir) / (Path(xlsx_path).name + ".flatcache.npz") if where in ("", "auto") else Path(where)
+
+
+def _file_sha256(path: PathLike, chunk: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _flatfile_spec_hash(sheet: Optional[str]) -> str:
+    spec = {"version": FLATFILE_CACHE_VERSION, "sheet": sheet or "", "cols": FLATFILE_COLS}
+    return hashlib.sha256(json.dumps(spec, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def flatfile_columns(flat_rows: List[Dict[str, str]]) -> Dict[str, np.ndarray]:
+    """
+    Columnar, parsed form of the flatfile: 'rsn' (int64) + 'rsn_ok' (bool) and one float64 column
+    per FLAT_VAR_KEYS entry (sentinels -> NaN), in row order.
+    """
+    n = len(flat_rows)
+    rsn = np.zeros(n, dtype=np.int64)
+    rsn_ok = np.zeros(n, dtype=bool)
+    cols = {key: np.full(n, np.nan) for key in FLAT_VAR_KEYS}
+    for i, r in enumerate(flat_rows):
+        v = _pick_col_value(r, FLATFILE_COLS["RSN"], required=False)
+        if v is None:
+            continue
+        try:
+            rsn[i] = int(float(v))
+        except Exception:
+            continue
+        rsn_ok[i] = True
+        for key in FLAT_VAR_KEYS:
+            cols[key][i] = _to_float_nan999(_pick_col_value(r, FLATFILE_COLS[key], required=False))
+    return {"rsn": rsn, "rsn_ok": rsn_ok, **cols}
+
+
+def build_flat_metadata_map_columns(cols: Dict[str, np.ndarray]) -> Dict[str, Dict[str, float]]:
+    """build_flat_metadata_map() over flatfile_columns() arrays (later rows win on duplicate RSNs)."""
+    idx = np.flatnonzero(cols["rsn_ok"])
+    if idx.size == 0:
+        raise ValueError("No RSNs parsed from flatfile XLSX. Check RSN columns.")
+    keys = [str(r) for r in cols["rsn"][idx].tolist()]
+    vals = {key: cols[key][idx].tolist() for key in FLAT_VAR_KEYS}
+    return {rk: {key: vals[key][j] for key in FLAT_VAR_KEYS} for j, rk in enumerate(keys)}
+
+
+def load_flat_metadata(xlsx_path: str, sheet: Optional[str] = None, cache: str = "auto",
+                       outdir: Optional[PathLike] = None) -> Dict[str, Dict[str, float]]:
+    """
+    rsn -> flat_vars for the flatfile, through the columnar cache when it is valid (rank 0).
+    cache: 'auto' (<outdir>/<xlsx name>.flatcache.npz), 'off', or an explicit .npz path.
+    """
+    cpath = flatfile_cache_path(xlsx_path, cache, outdir)
+    st = os.stat(xlsx_path)
+    spec = _flatfile_spec_hash(sheet)
+
+    cols = None
+    sha = None
+    if cpath is not None and cpath.exists():
+        try:
+            with np.load(cpath, allow_pickle=False) as z:
+                if str(z["spec"]) == spec and int(z["size"]) == st.st_size:
+                    if int(z["mtime_ns"]) == st.st_mtime_ns:
+                        return build_flat_metadata_map_columns({k: z[k] for k in ["rsn", "rsn_ok", *FLAT_VAR_KEYS]})
+                    sha = _file_sha256(xlsx_path)
+                    if str(z["sha256"]) == sha:
+                        cols = {k: z[k] for k in ["rsn", "rsn_ok", *FLAT_VAR_KEYS]}  # re-stamp below
+        except (OSError, KeyError, ValueError, EOFError, zipfile.BadZipFile) as e:
+            print(f"[rank 0] WARNING: ignoring unreadable flatfile cache {cpath}: {e}")
+
+    if cols is None:
+        cols = flatfile_columns(load_flatfile_xlsx_rows(xlsx_path, sheet=sheet))
+    meta = build_flat_metadata_map_columns(cols)
+    if cpath is not None:
+        try:
+            fd, tmp = tempfile.mkstemp(prefix=cpath.name + ".", suffix=".tmp", dir=cpath.parent)
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    np.savez(f, spec=np.str_(spec), size=np.int64(st.st_size), mtime_ns=np.int64(st.st_mtime_ns),
+                             sha256=np.str_(sha or _file_sha256(xlsx_path)), **cols)
+                os.replace(tmp, cpath)
+            except BaseException:
+                os.unlink(tmp)
+                raise
+            print(f"[rank 0] wrote flatfile cache: {cpath}")
+        except OSError as e:
+            print(f"[rank 0] WARNING: could not write flatfile cache {cpath}: {e}")
+    return meta
+
+
 # ---------------------------
 # Filename-mapping CSV (H1/H2 only)
 # ---------------------------
@@ -442,6 +1193,201 @@ def load_rsn_to_h1h2_dataset_names(filename_csv: str) -> Dict[str, Tuple[str, st
     return out
 
 
+# ---------------------------
+# Compact metadata broadcast (NumPy buffers instead of pickled dicts)
+# ---------------------------
+# flat_meta becomes an (nrsn x nvar) float64 matrix + int64 RSN vector, rsn_to_h1h2 an int64 RSN
+# vector + (nrsn x 2) fixed-width bytes array. Each array is sent with one buffer Bcast (only its
+# shape/dtype go through pickle). The Mapping wrappers keep the dict interface the rest of the
+# script uses; lookups are a searchsorted on the sorted RSN vector.
+# With --meta-share node (default) the arrays are not copied per rank at all: NodeShared keeps one
+# read-only copy per node in an MPI shared-memory window and every rank maps it.
+
+def bcast_array(comm: MPI.Comm, arr: Optional[np.ndarray], root: int = 0) -> Optional[np.ndarray]:
+    """Broadcast a fixed-size-dtype NumPy array (numeric, bytes or structured) as a raw buffer."""
+    rank = comm.Get_rank()
+    if rank == root and arr is not None:
+        arr = np.ascontiguousarray(arr)
+        hdr = (arr.shape, arr.dtype)
+    else:
+        hdr = None
+    hdr = comm.bcast(hdr, root=root)
+    if hdr is None:
+        return None
+    if rank != root:
+        arr = np.empty(hdr[0], dtype=hdr[1])
+    if arr.nbytes:
+        comm.Bcast(arr.reshape(-1).view(np.uint8), root=root)
+    return arr
+
+
+class NodeShared:
+    """
+    One read-only copy per node of arrays broadcast from rank 0: the node leader owns an MPI
+    shared-memory window (Split_type(COMM_TYPE_SHARED) + Win.Allocate_shared), leaders receive
+    the data with one Bcast among themselves, and all ranks on the node view the leader's memory.
+    Call free() once the arrays are no longer used.
+    """
+
+    def __init__(self, comm: MPI.Comm):
+        self.comm = comm
+        self.node = comm.Split_type(MPI.COMM_TYPE_SHARED, key=comm.Get_rank())
+        is_leader = self.node.Get_rank() == 0
+        self.leaders = comm.Split(0 if is_leader else MPI.UNDEFINED, key=comm.Get_rank())
+        self._wins: List[MPI.Win] = []
+
+    def share(self, arr: Optional[np.ndarray]) -> Optional[np.ndarray]:
+        """Collective over comm; arr is only read on rank 0 (which is always a node leader)."""
+        root = self.comm.Get_rank() == 0
+        if root and arr is not None:
+            arr = np.ascontiguousarray(arr)
+            hdr = (arr.shape, arr.dtype)
+        else:
+            hdr = None
+        hdr = self.comm.bcast(hdr, root=0)
+        if hdr is None:
+            return None
+        shape, dtype = hdr
+        nbytes = int(np.prod(shape, dtype=np.int64)) * dtype.itemsize
+
+        win = MPI.Win.Allocate_shared(max(1, nbytes) if self.node.Get_rank() == 0 else 0, 1, comm=self.node)
+        self._wins.append(win)
+        buf, _ = win.Shared_query(0)
+        out = np.ndarray(shape, dtype=dtype, buffer=buf)
+        if root:
+            out[...] = arr
+        if self.leaders != MPI.COMM_NULL and nbytes:
+            self.leaders.Bcast(out.reshape(-1).view(np.uint8), root=0)
+        self.node.Barrier()
+        out.flags.writeable = False
+        return out
+
+    def free(self) -> None:
+        for win in self._wins:
+            win.Free()
+        self._wins = []
+        if self.leaders != MPI.COMM_NULL:
+            self.leaders.Free()
+        self.node.Free()
+
+
+def _rsn_ints(keys: Sequence[str]) -> np.ndarray:
+    return np.fromiter((int(k) for k in keys), dtype=np.int64, count=len(keys))
+
+
+class _SortedRSNMapping(Mapping):
+    """
+    Read-only Mapping keyed by RSN strings over a sorted int64 RSN vector. Already-sorted input
+    (everything from from_dict()) is used as is, so shared-memory arrays are never copied.
+    """
+
+    def __init__(self, rsn: np.ndarray):
+        rsn = np.asarray(rsn)
+        self._order: Optional[np.ndarray] = None
+        if rsn.size > 1 and np.any(rsn[1:] < rsn[:-1]):
+            self._order = np.argsort(rsn, kind="stable")
+            rsn = rsn[self._order]
+        self.rsn = rsn
+
+    def _sorted(self, a: np.ndarray) -> np.ndarray:
+        return a if self._order is None else a[self._order]
+
+    def _pos(self, rsn: str) -> int:
+        try:
+            key = int(rsn)
+        except (TypeError, ValueError):
+            return -1
+        i = int(np.searchsorted(self.rsn, key))
+        return i if i < self.rsn.size and self.rsn[i] == key else -1
+
+    def __contains__(self, rsn: object) -> bool:
+        return self._pos(rsn) >= 0  # type: ignore[arg-type]
+
+    def __iter__(self) -> Iterator[str]:
+        return (str(r) for r in self.rsn.tolist())
+
+    def __len__(self) -> int:
+        return int(self.rsn.size)
+
+
+class FlatMetaTable(_SortedRSNMapping):
+    """rsn -> {var: value} over a float64 matrix (rows = RSN, columns = var_keys)."""
+
+    def __init__(self, rsn: np.ndarray, values: np.ndarray, var_keys: Sequence[str] = tuple(FLAT_VAR_KEYS)):
+        super().__init__(rsn)
+        self.values = self._sorted(np.asarray(values, dtype=float).reshape(len(rsn), len(var_keys)))
+        self.var_keys = list(var_keys)
+
+    def __getitem__(self, rsn: str) -> Dict[str, float]:
+        i = self._pos(rsn)
+        if i < 0:
+            raise KeyError(rsn)
+        return dict(zip(self.var_keys, self.values[i].tolist()))
+
+    @classmethod
+    def from_dict(cls, meta: Dict[str, Dict[str, float]]) -> "FlatMetaTable":
+        keys = sorted(meta, key=int)
+        vals = np.array([[meta[k].get(v, np.nan) for v in FLAT_VAR_KEYS] for k in keys], dtype=float)
+        return cls(_rsn_ints(keys), vals)
+
+    @classmethod
+    def bcast(cls, comm: MPI.Comm, table: Optional["FlatMetaTable"], root: int = 0,
+              share: Optional[NodeShared] = None) -> "FlatMetaTable":
+        """Collective; with share, the arrays live in node-shared memory (root must be 0)."""
+        mine = table is not None and comm.Get_rank() == root
+        send = share.share if share is not None else (lambda a: bcast_array(comm, a, root))
+        rsn = send(table.rsn if mine else None)
+        values = send(table.values if mine else None)
+        return cls(rsn, values)
+
+
+class H1H2Table(_SortedRSNMapping):
+    """rsn -> (mapped_h1, mapped_h2) over a (nrsn x 2) fixed-width UTF-8 bytes array."""
+
+    def __init__(self, rsn: np.ndarray, names: np.ndarray):
+        super().__init__(rsn)
+        self.names = self._sorted(np.asarray(names).reshape(len(rsn), 2))
+
+    def __getitem__(self, rsn: str) -> Tuple[str, str]:
+        i = self._pos(rsn)
+        if i < 0:
+            raise KeyError(rsn)
+        h1, h2 = self.names[i]
+        return h1.decode("utf-8"), h2.decode("utf-8")
+
+    @classmethod
+    def from_dict(cls, mapping: Dict[str, Tuple[str, str]]) -> "H1H2Table":
+        keys = sorted(mapping, key=int)
+        enc = [(h1.encode("utf-8"), h2.encode("utf-8")) for h1, h2 in (mapping[k] for k in keys)]
+        width = max([1] + [len(x) for pair in enc for x in pair])
+        return cls(_rsn_ints(keys), np.array(enc, dtype=f"S{width}").reshape(len(keys), 2))
+
+    @classmethod
+    def bcast(cls, comm: MPI.Comm, table: Optional["H1H2Table"], root: int = 0,
+              share: Optional[NodeShared] = None) -> "H1H2Table":
+        """Collective; with share, the arrays live in node-shared memory (root must be 0)."""
+        mine = table is not None and comm.Get_rank() == root
+        send = share.share if share is not None else (lambda a: bcast_array(comm, a, root))
+        rsn = send(table.rsn if mine else None)
+        names = send(table.names if mine else None)
+        return cls(rsn, names)
+
+
+class RSNStrings(SequenceABC):
+    """The RSN work list as strings, backed by an int64 array (no per-rank list of str objects)."""
+
+    def __init__(self, rsn: np.ndarray):
+        self.rsn = rsn
+
+    def __getitem__(self, i):  # type: ignore[override]
+        if isinstance(i, slice):
+            return [str(r) for r in self.rsn[i].tolist()]
+        return str(int(self.rsn[i]))
+
+    def __len__(self) -> int:
+        return int(self.rsn.size)
+
+
 # ---------------------------
 # HDF5 lookup
 # ---------------------------
@@ -492,6 +1438,262 @@ def _find_dataset_path(h5: h5py.File, rsn_int_str: str, mapped_name: str) -> Opt
     return None
 
 
+# ---------------------------
+# RSN -> dataset index (--rsn-index / --build-rsn-index)
+# ---------------------------
+# _find_dataset_path() costs up to 4 link lookups per component per record; on a parallel filesystem
+# that metadata traffic is noticeable. The index resolves every mapped H1/H2 name once and stores
+# (RSN, mapped name, dataset path, npts, dt) per component, either in a sidecar
+# <hdf5>.rsnindex.npz (stamped with the HDF5 size/mtime; ignored if stale) or embedded in the HDF5
+# as /_rsn_index. Rank 0 loads it and broadcasts it; per-record lookups are a searchsorted. Entries
+# whose mapped name no longer matches the mapping CSV fall back to probing.
+# The embedded table cannot carry the file's size/mtime (writing it changes both), so it is verified
+# per record instead: an indexed path is used only if it still exists, and anything else is probed.
+# Embedding also changes the HDF5 identity that --cache-dir keys and --resume signatures are built
+# from, so build an embedded index before the first cached/checkpointed run, not between runs.
+
+RSN_INDEX_DATASET = "_rsn_index"
+
+
+def hdf5_file_identity(path: PathLike) -> Tuple[str, int, int]:
+    """(realpath, size, mtime_ns): cheap stand-in for a content checksum of the HDF5 file."""
+    st = os.stat(path)
+    return os.path.realpath(path), int(st.st_size), int(st.st_mtime_ns)
+
+
+def rsn_index_sidecar_path(hdf5_path: PathLike) -> Path:
+    return Path(str(hdf5_path) + ".rsnindex.npz")
+
+
+def build_rsn_index(h5: h5py.File, rsn_to_h1h2: Dict[str, Tuple[str, str]]) -> np.ndarray:
+    """Resolve every mapped H1/H2 name once. Unresolved components get path '' and npts 0."""
+    recs = []
+    for rsn in sorted(rsn_to_h1h2, key=lambda r: int(r)):
+        rec: List[Any] = [int(rsn)]
+        for mapped in rsn_to_h1h2[rsn]:
+            dspath = _find_dataset_path(h5, rsn, mapped)
+            if dspath is None:
+                rec += [mapped, "", 0, np.nan]
+            else:
+                ds = h5[dspath]
+                rec += [mapped, dspath, int(np.prod(ds.shape)), _get_dt_from_dataset(ds)]
+        recs.append(rec)
+
+    def width(j: int) -> int:
+        return max([1] + [len(str(r[j]).encode("utf-8")) for r in recs])
+
+    dtype = np.dtype([
+        ("rsn", np.int64),
+        ("mapped_h1", f"S{width(1)}"), ("path_h1", f"S{width(2)}"), ("npts_h1", np.int64), ("dt_h1", np.float64),
+        ("mapped_h2", f"S{width(5)}"), ("path_h2", f"S{width(6)}"), ("npts_h2", np.int64), ("dt_h2", np.float64),
+    ])
+    out = np.empty(len(recs), dtype=dtype)
+    for i, r in enumerate(recs):
+        out[i] = (r[0], r[1].encode("utf-8"), r[2].encode("utf-8"), r[3], r[4],
+                  r[5].encode("utf-8"), r[6].encode("utf-8"), r[7], r[8])
+    return out
+
+
+def write_rsn_index(table: np.ndarray, hdf5_path: PathLike, where: str) -> str:
+    """Write the index to the sidecar ('sidecar'/'auto' or an explicit .npz path) or into the HDF5 ('embedded')."""
+    if where == "embedded":
+        with h5py.File(hdf5_path, "a") as h5:
+            if RSN_INDEX_DATASET in h5:
+                del h5[RSN_INDEX_DATASET]
+            h5.create_dataset(RSN_INDEX_DATASET, data=table)
+        return f"{hdf5_path}:/{RSN_INDEX_DATASET}"
+
+    path = rsn_index_sidecar_path(hdf5_path) if where in ("", "auto") else Path(where)
+    _, size, mtime_ns = hdf5_file_identity(hdf5_path)
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        np.savez(f, index=table, hdf5_size=np.int64(size), hdf5_mtime_ns=np.int64(mtime_ns))
+    os.replace(tmp, path)
+    return str(path)
+
+
+def load_rsn_index(hdf5_path: PathLike, where: str) -> Optional[np.ndarray]:
+    """Read the index written by write_rsn_index(); None if missing or stale."""
+    if where == "embedded":
+        with h5py.File(hdf5_path, "r") as h5:
+            if RSN_INDEX_DATASET not in h5:
+                print(f"[rank 0] WARNING: no /{RSN_INDEX_DATASET} in {hdf5_path}; probing per record")
+                return None
+            return h5[RSN_INDEX_DATASET][()]
+
+    path = rsn_index_sidecar_path(hdf5_path) if where == "auto" else Path(where)
+    if not path.exists():
+        print(f"[rank 0] WARNING: RSN index {path} not found; probing per record")
+        return None
+    _, size, mtime_ns = hdf5_file_identity(hdf5_path)
+    with np.load(path, allow_pickle=False) as z:
+        if int(z["hdf5_size"]) != size or int(z["hdf5_mtime_ns"]) != mtime_ns:
+            print(f"[rank 0] WARNING: RSN index {path} is stale (HDF5 changed); probing per record")
+            return None
+        return z["index"]
+
+
+class RSNIndex:
+    """
+    Array-backed lookup over a build_rsn_index() table. verify=True (embedded index) makes
+    load_rsn_pair() check each indexed path with one link lookup and probe when it is gone.
+    """
+
+    def __init__(self, table: np.ndarray, *, verify: bool = False):
+        order = np.argsort(table["rsn"], kind="stable")
+        self.table = table[order]
+        self._rsn = self.table["rsn"]
+        self.verify = verify
+
+    def _row(self, rsn: str) -> Optional[np.void]:
+        try:
+            key = int(rsn)
+        except ValueError:
+            return None
+        i = int(np.searchsorted(self._rsn, key))
+        if i < self._rsn.size and self._rsn[i] == key:
+            return self.table[i]
+        return None
+
+    def resolve(self, rsn: str, comp: str, mapped_name: str) -> Tuple[bool, Optional[str], float]:
+        """
+        (known, dataset path or None, dt). known=False means the index cannot answer
+        (RSN absent or mapping changed) and the caller should probe the HDF5.
+        """
+        row = self._row(rsn)
+        c = comp.lower()
+        if row is None or row[f"mapped_{c}"].decode("utf-8") != mapped_name:
+            return False, None, np.nan
+        path = row[f"path_{c}"].decode("utf-8")
+        return True, (path or None), float(row[f"dt_{c}"])
+
+    def npts(self, rsn_list: Sequence[str], rsn_to_h1h2: Dict[str, Tuple[str, str]]) -> Optional[np.ndarray]:
+        """read_rsn_npts() from the index; None if any mapped RSN is not covered."""
+        out = np.zeros(len(rsn_list), dtype=np.int64)
+        for i, rsn in enumerate(rsn_list):
+            pair = rsn_to_h1h2.get(rsn)
+            if pair is None:
+                continue
+            n = []
+            for comp, mapped in zip(("H1", "H2"), pair):
+                known, path, _ = self.resolve(rsn, comp, mapped)
+                if not known:
+                    return None
+                n.append(int(self._row(rsn)[f"npts_{comp.lower()}"]) if path else -1)
+            if min(n) >= 0:
+                out[i] = max(n)
+        return out
+
+
+# ---------------------------
+# HDF5 I/O layer (--io-mode / --prefetch)
+# ---------------------------
+# default: plain h5py.File(path, "r") (original behaviour)
+# tuned  : larger raw-data chunk cache (rdcc) and, for files written with a paged file-space
+#          strategy (see OpsUtilsAdv h5_repack), a page buffer; falls back if the file is not paged
+# mpio   : tuned + the MPI-IO driver (needs an MPI-enabled h5py). The open/close and the superblock
+#          read are collective; per-record reads stay independent because every rank reads
+#          different records (collective metadata *reads* would deadlock under dynamic scheduling).
+# --prefetch N issues posix_fadvise(WILLNEED) for the byte ranges of the next N records' datasets
+# (sec2 driver only), so the kernel reads ahead while the current record is being computed.
+
+H5_IO_MODES = ("default", "tuned", "mpio")
+_RDCC_NSLOTS = 100003  # prime, per the HDF5 chunk-cache guidance
+
+
+def open_records_h5(
+    path: PathLike,
+    *,
+    io_mode: str = "default",
+    comm: Optional[MPI.Comm] = None,
+    rdcc_mb: float = 64.0,
+    page_buf_mb: float = 0.0,
+) -> h5py.File:
+    """Open the records HDF5 read-only with the --io-mode settings (collective for 'mpio')."""
+    if io_mode == "default":
+        return h5py.File(path, "r")
+
+    kw: Dict[str, Any] = {"rdcc_nbytes": int(rdcc_mb * 1024 * 1024), "rdcc_nslots": _RDCC_NSLOTS}
+    if io_mode == "mpio":
+        if _h5py_has_mpi():
+            kw.update(driver="mpio", comm=comm if comm is not None else MPI.COMM_WORLD)
+        elif comm is None or comm.Get_rank() == 0:
+            print("[rank 0] WARNING: --io-mode mpio needs an MPI-enabled h5py; using 'tuned'")
+
+    if page_buf_mb > 0:
+        try:
+            return h5py.File(path, "r", page_buf_size=int(page_buf_mb * 1024 * 1024), **kw)
+        except (OSError, ValueError) as e:
+            if comm is None or comm.Get_rank() == 0:
+                print(f"[rank 0] WARNING: page buffer not usable for {path} ({e}); opening without it")
+    return h5py.File(path, "r", **kw)
+
+
+def _dataset_byte_ranges(ds: h5py.Dataset) -> List[Tuple[int, int]]:
+    """File (offset, nbytes) extents of a dataset: one for contiguous, one per allocated chunk."""
+    dsid = ds.id
+    off = dsid.get_offset()
+    if off is not None:
+        return [(int(off), int(dsid.get_storage_size()))]
+    if ds.chunks is None:
+        return []  # compact or not yet allocated
+    out = []
+    for i in range(dsid.get_num_chunks()):
+        info = dsid.get_chunk_info(i)
+        out.append((int(info.byte_offset), int(info.size)))
+    return out
+
+
+class RecordPrefetcher:
+    """Readahead hints for upcoming records (no-op unless sec2 driver + posix_fadvise)."""
+
+    def __init__(self, h5: h5py.File, *, depth: int, rsn_index: Optional["RSNIndex"] = None):
+        self.h5 = h5
+        self.depth = int(depth)
+        self.rsn_index = rsn_index
+        self.fd: Optional[int] = None
+        self._seen: set = set()
+        if self.depth > 0 and hasattr(os, "posix_fadvise") and h5.driver == "sec2":
+            try:
+                self.fd = int(h5.id.get_vfd_handle())
+            except Exception:
+                self.fd = None
+
+    def advise(self, rsn: str, pair: Optional[Tuple[str, str]]) -> None:
+        if self.fd is None or pair is None or rsn in self._seen:
+            return
+        self._seen.add(rsn)
+        for comp, mapped in zip(("H1", "H2"), pair):
+            known, dspath = False, None
+            if self.rsn_index is not None:
+                known, dspath, _ = self.rsn_index.resolve(rsn, comp, mapped)
+            if not known:
+                dspath = _find_dataset_path(self.h5, rsn, mapped)
+            if dspath is None:
+                continue
+            try:
+                for off, n in _dataset_byte_ranges(self.h5[dspath]):
+                    os.posix_fadvise(self.fd, off, n, os.POSIX_FADV_WILLNEED)
+            except (OSError, KeyError, RuntimeError):
+                pass
+
+
+def iter_lookahead(work: Iterator[int], depth: int) -> Iterator[Tuple[int, List[int]]]:
+    """Yield (index, next <= depth indices) from a work iterator (pulls depth items early)."""
+    it = iter(work)
+    buf: deque = deque()
+    for x in it:
+        buf.append(x)
+        if len(buf) > depth:
+            break
+    while buf:
+        cur = buf.popleft()
+        for x in it:
+            buf.append(x)
+            break
+        yield cur, list(buf)
+
+
 # ---------------------------
 # Metrics + logging
 # ---------------------------
@@ -534,22 +1736,52 @@ class RecordLog:
     reason: str
 
 
-def _metrics_from_array(
+# Fused peak kernel:
+# np.max, np.min, np.argmax and np.argmin each stream the whole record, so four full reads per
+# component. fused_peaks() only runs argmax/argmin and looks the extrema up at those indices, and it
+# walks the record in cache-sized time blocks so argmin re-reads a block argmax just pulled into L2.
+# The gain depends on the machine (1.1x to 2x has been measured on 1M-sample records; see
+# benchmark_nga_kernels.py metrics).
+PEAK_BLOCK = 1 << 15   # samples per time block (256 KiB of float64)
+
+
+def fused_peaks(a: np.ndarray, block: int = PEAK_BLOCK) -> Tuple[float, float, int, int]:
+    """
+    (max, min, argmax, argmin) of a 1-D record with np.max/np.argmax semantics (first occurrence
+    wins, NaN propagates).
+    """
+    if a.size == 0:
+        raise ValueError("zero-size array to reduction operation maximum which has no identity")
+    block = max(1, int(block))
+    imax = imin = 0
+    vmax = vmin = a[0]
+    for s in range(0, a.size, block):
+        blk = a[s:s + block]
+        i = int(np.argmax(blk))
+        j = int(np.argmin(blk))
+        # strict compare keeps the first occurrence; the first NaN sticks
+        if blk[i] > vmax or (math.isnan(blk[i]) and not math.isnan(vmax)):
+            imax, vmax = s + i, blk[i]
+        if blk[j] < vmin or (math.isnan(blk[j]) and not math.isnan(vmin)):
+            imin, vmin = s + j, blk[j]
+    return float(vmax), float(vmin), imax, imin
+
+
+def _metrics_from_peaks(
     rsn: str,
     component: str,
     h5_ref: str,
-    a: np.ndarray,
+    npts: int,
     dt: float,
     flat_vars: Dict[str, float],
+    amax: float,
+    amin: float,
+    imax: int,
+    imin: int,
 ) -> RecordMetrics:
-    npts = int(a.size)
-    amax = float(np.max(a))
-    amin = float(np.min(a))
     amp_range = float(amax - amin)
 
     if np.isfinite(dt) and dt > 0:
-        imax = int(np.argmax(a))
-        imin = int(np.argmin(a))
         tmax = float(imax * dt)
         tmin = float(imin * dt)
         dt_peaks = float(abs(tmax - tmin))
@@ -578,6 +1810,18 @@ def _metrics_from_array(
     )
 
 
+def _metrics_from_array(
+    rsn: str,
+    component: str,
+    h5_ref: str,
+    a: np.ndarray,
+    dt: float,
+    flat_vars: Dict[str, float],
+) -> RecordMetrics:
+    amax, amin, imax, imin = fused_peaks(a)
+    return _metrics_from_peaks(rsn, component, h5_ref, int(a.size), dt, flat_vars, amax, amin, imax, imin)
+
+
 
 # ---------------------------
 # ML helpers + output
@@ -608,131 +1852,122 @@ class MLBuildInfo(NamedTuple):
     dropped_outlier: int
 
 
-def _max_abs_amp(m: RecordMetrics) -> float:
-    # robust abs-max based on already-computed extrema
-    if np.isfinite(m.amax) and np.isfinite(m.amin):
-        return float(max(abs(m.amax), abs(m.amin)))
-    return np.nan
+class FeatureMatrix(NamedTuple):
+    X: np.ndarray
+    y: np.ndarray
+    feature_names: List[str]
+    ids: np.ndarray          # rec_id per row of X (fixed-width UTF-8 bytes from the metrics table)
+    info: MLBuildInfo
 
 
-def make_features_with_ids(
-    metrics: List[RecordMetrics],
+def _feature_names(mode: str) -> List[str]:
+    names = ["bias"] if USE_INTERCEPT else []
+    names.extend(FEATURE_KEYS)
+    if mode == "impute":
+        names.extend(f"miss_{k}" for k in FEATURE_KEYS)
+    return names
+
+
+def _flat_feature_block(table: np.ndarray, rows: np.ndarray) -> np.ndarray:
+    """(len(rows) x len(FEATURE_KEYS)) float64 block in model space; non-finite / invalid log -> NaN."""
+    X0 = np.full((rows.size, len(FEATURE_KEYS)), np.nan, dtype=float)
+    names = set(table.dtype.names or ())
+    for j, k in enumerate(FEATURE_KEYS):
+        col = f"flat__{k}"
+        if col not in names:
+            continue
+        v = table[col][rows].astype(float, copy=False)
+        if k in LOG_KEYS:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                v = np.log(np.where(v > 0, v, np.nan))
+        X0[:, j] = v
+    X0[~np.isfinite(X0)] = np.nan
+    return X0
+
+
+def feature_medians(X0: np.ndarray) -> np.ndarray:
+    """Per-column median over non-NaN values; an all-missing column -> 0.0 (its indicator carries it)."""
+    counts = np.count_nonzero(~np.isnan(X0), axis=0)
+    med = np.zeros(X0.shape[1], dtype=float)
+    if np.any(counts):
+        med[counts > 0] = np.nanmedian(X0[:, counts > 0], axis=0)
+    return med
+
+
+def build_feature_matrix(
+    table: np.ndarray,
     *,
     mode: str = "drop",
-    max_abs_amp: float = 10.0,
-) -> Tuple[np.ndarray, np.ndarray, List[str], List[str], MLBuildInfo]:
+    max_abs_amp: Optional[float] = None,
+    medians: Callable[[np.ndarray], np.ndarray] = feature_medians,
+) -> FeatureMatrix:
     """
-    Build X,y for predicting amp_range from flatfile vars.
-    Returns:
-      X, y, feature_names, ids_used, info
-    Screening:
-      - ML skips outliers where max(|a|) > max_abs_amp (but metrics are still written).
+    Build X,y for predicting amp_range from a packed RecordMetrics table (see pack_rows), whose
+    flat__<key> columns are the flatfile matrix joined per record. Everything is column-wise.
+
+    mode:
+      - "drop": drop any row with any missing feature after transforms
+      - "impute": median-impute missing features + add missing-indicator columns
+    max_abs_amp: if set, ML skips outliers where max(|amax|, |amin|) > max_abs_amp
+    (metrics are still written).
+    medians: maps the raw feature block to the impute values (distributed_feature_medians()
+    when each rank only holds part of the table).
     """
     if mode not in {"drop", "impute"}:
         raise ValueError(f"Unknown mode: {mode}")
+    feature_names = _feature_names(mode)
 
-    # 1) candidate rows must have finite target AND pass outlier screen
-    rows_raw: List[Dict[str, float]] = []
-    y: List[float] = []
-    ids: List[str] = []
-
+    # 1) candidate rows must have finite target (and pass the outlier screen, if any)
+    y_all = table["amp_range"].astype(float, copy=False)
+    cand = (table["ok"] == 1) & np.isfinite(y_all)
     dropped_outlier = 0
-
-    for m in metrics:
-        if m.ok != 1 or not np.isfinite(m.amp_range):
-            continue
-
-        aa = _max_abs_amp(m)
-        if np.isfinite(aa) and aa > float(max_abs_amp):
-            dropped_outlier += 1
-            continue
-
-        rows_raw.append(dict(m.flat or {}))
-        y.append(float(m.amp_range))
-        ids.append(str(m.rec_id))
-
-    candidates = len(y)
-    if candidates == 0:
-        feature_names: List[str] = []
-        if USE_INTERCEPT:
-            feature_names.append("bias")
-        feature_names.extend(FEATURE_KEYS)
-        return (
-            np.zeros((0, len(feature_names))), np.zeros((0,)),
-            feature_names, [], MLBuildInfo(0, 0, 0, dropped_outlier)
-        )
-
-    yv = np.asarray(y, dtype=float)
-
-    # 2) build raw feature matrix in model-space (log keys -> ln)
-    F = len(FEATURE_KEYS)
-    X0 = np.full((candidates, F), np.nan, dtype=float)
-
-    for i, fv in enumerate(rows_raw):
-        for j, k in enumerate(FEATURE_KEYS):
-            v = fv.get(k, np.nan)
-            v = float(v) if v is not None else np.nan
-            if k in LOG_KEYS:
-                if np.isfinite(v) and v > 0:
-                    v = math.log(v)
-                else:
-                    v = np.nan
-            X0[i, j] = v
+    if max_abs_amp is not None:
+        amax = table["amax"].astype(float, copy=False)
+        amin = table["amin"].astype(float, copy=False)
+        with np.errstate(invalid="ignore"):
+            aa = np.maximum(np.abs(amax), np.abs(amin))
+            outlier = cand & np.isfinite(amax) & np.isfinite(amin) & (aa > float(max_abs_amp))
+        dropped_outlier = int(np.count_nonzero(outlier))
+        cand &= ~outlier
+    rows = np.flatnonzero(cand)
+    candidates = int(rows.size)
+
+    # 2) raw feature block in model space (log keys -> ln)
+    X0 = _flat_feature_block(table, rows)
+    miss = np.isnan(X0)
 
     # 3) missing handling
+    F = X0.shape[1]
     if mode == "drop":
-        keep = np.isfinite(X0).all(axis=1) & np.isfinite(yv)
-        Xkeep = X0[keep]
-        ykeep = yv[keep]
-        ids_keep = [ids[i] for i in range(candidates) if bool(keep[i])]
-
-        if USE_INTERCEPT:
-            X = np.column_stack([np.ones((Xkeep.shape[0], 1)), Xkeep])
-            feature_names = ["bias"] + list(FEATURE_KEYS)
-        else:
-            X = Xkeep
-            feature_names = list(FEATURE_KEYS)
-
-        dropped_missing = int(candidates - Xkeep.shape[0])
-        info = MLBuildInfo(candidates=candidates, used=int(X.shape[0]),
-                           dropped_missing=dropped_missing, dropped_outlier=dropped_outlier)
-        return X, ykeep, feature_names, ids_keep, info
-
-    # mode == "impute"
-    miss = ~np.isfinite(X0)
-
-    Ximp = X0.copy()
-    for j in range(F):
-        col = Ximp[:, j]
-        good = np.isfinite(col)
-        med = float(np.nanmedian(col[good])) if np.any(good) else 0.0
-        col[~good] = med
-        Ximp[:, j] = col
-
-    parts = []
-    feature_names = []
+        keep = ~miss.any(axis=1)
+        rows, X0 = rows[keep], X0[keep]
+    else:
+        X0 = np.where(miss, medians(X0), X0)
 
+    # [bias?] + features (+ missing indicators), filled in place
+    n = int(rows.size)
+    off = 1 if USE_INTERCEPT else 0
+    X = np.empty((n, len(feature_names)), dtype=float)
     if USE_INTERCEPT:
-        parts.append(np.ones((candidates, 1), dtype=float))
-        feature_names.append("bias")
+        X[:, 0] = 1.0
+    X[:, off:off + F] = X0
+    if mode == "impute":
+        X[:, off + F:] = miss
 
-    parts.append(Ximp)
-    feature_names.extend(list(FEATURE_KEYS))
+    info = MLBuildInfo(candidates=candidates, used=n,
+                       dropped_missing=candidates - n, dropped_outlier=dropped_outlier)
+    return FeatureMatrix(X, y_all[rows], feature_names, table["rec_id"][rows], info)
 
-    M = miss.astype(float)
-    parts.append(M)
-    feature_names.extend([f"miss_{k}" for k in FEATURE_KEYS])
 
-    X = np.column_stack(parts)
-    keep_y = np.isfinite(yv)
-    X = X[keep_y]
-    yv2 = yv[keep_y]
-    ids_keep = [ids[i] for i in range(candidates) if bool(keep_y[i])]
-
-    dropped_missing = int(candidates - X.shape[0])  # usually 0 here unless y had NaNs
-    info = MLBuildInfo(candidates=candidates, used=int(X.shape[0]),
-                       dropped_missing=dropped_missing, dropped_outlier=dropped_outlier)
-    return X, yv2, feature_names, ids_keep, info
+def make_features_with_ids(
+    metrics: List[RecordMetrics],
+    *,
+    mode: str = "drop",
+    max_abs_amp: float = 10.0,
+) -> Tuple[np.ndarray, np.ndarray, List[str], List[str], MLBuildInfo]:
+    """build_feature_matrix() over a list of RecordMetrics. Returns X, y, feature_names, ids_used, info."""
+    fm = build_feature_matrix(pack_rows(metrics, RecordMetrics), mode=mode, max_abs_amp=max_abs_amp)
+    return fm.X, fm.y, fm.feature_names, [s.decode("utf-8") for s in fm.ids.tolist()], fm.info
 
 
 def _train_test_split_mask(n: int, test_frac: float, seed: int) -> np.ndarray:
@@ -801,116 +2036,312 @@ def make_features(
     *,
     mode: str = "drop",
 ) -> Tuple[np.ndarray, np.ndarray, List[str], MLBuildInfo]:
-    """
-    Build X,y for predicting amp_range from flatfile variables.
+    """build_feature_matrix() over a list of RecordMetrics, without outlier screening. Returns X, y, feature_names, info."""
+    fm = build_feature_matrix(pack_rows(metrics, RecordMetrics), mode=mode)
+    return fm.X, fm.y, fm.feature_names, fm.info
 
-    mode:
-      - "drop": drop any row with any missing feature after transforms
-      - "impute": median-impute missing features + add missing-indicator columns
 
-    Features are defined by FEATURE_KEYS (and optional intercept USE_INTERCEPT).
-    Optional log-transform controlled by LOG_KEYS.
+# ---------------------------
+# ML fit: on rank 0 or distributed
+# ---------------------------
+# --ml-fit gather   : rank 0 builds X from the gathered metrics table and fits it (fit_linear_model).
+# --ml-fit allreduce: every rank builds X for its own records; only sufficient statistics travel
+#                     (X^T X, X^T y, counts, residual sums) and rank 0 solves the normal equations.
+# Both use the same train/test split: positions in the RSN-sorted row order are recovered from an
+# Allgatherv of the used RSNs (8 bytes per row). Impute medians are exact in both modes
+# (distributed_feature_medians: bisection on order-preserving float64 bit patterns).
+
+class MLFit(NamedTuple):
+    feature_names: List[str]
+    coef: np.ndarray
+    model: Any                     # sklearn estimator (gather mode only) or None
+    report: Dict[str, Any]
+    info: MLBuildInfo
+    preds: Optional[np.ndarray]    # rec_id, split, y, yhat, resid (RSN order) if requested
+
+
+def _ml_report(info: MLBuildInfo, *, mode: str, max_abs_amp: float, test_frac: float, seed: int) -> Dict[str, Any]:
+    return {
+        "r2_train": np.nan,
+        "r2_test": np.nan,
+        "n_candidates": int(info.candidates),
+        "n_used": int(info.used),
+        "dropped_missing": int(info.dropped_missing),
+        "dropped_outlier": int(info.dropped_outlier),
+        "mode": str(mode),
+        "max_abs_amp": float(max_abs_amp),
+        "test_frac": float(test_frac),
+        "seed": int(seed),
+    }
 
-    Returns: (X, y, feature_names, info)
-    """
-    if mode not in {"drop", "impute"}:
-        raise ValueError(f"Unknown mode: {mode}")
 
-    # 1) collect candidate rows (must have finite target)
-    rows_raw: List[Dict[str, float]] = []
-    y: List[float] = []
+def _preds_table(fm: FeatureMatrix, coef: np.ndarray, test_mask: np.ndarray) -> np.ndarray:
+    dtype = np.dtype([("rec_id", fm.ids.dtype), ("split", "S5"), ("y", "<f8"), ("yhat", "<f8"), ("resid", "<f8")])
+    out = np.empty(fm.y.size, dtype=dtype)
+    out["rec_id"] = fm.ids
+    out["split"] = np.where(test_mask, b"test", b"train")
+    out["y"] = fm.y
+    out["yhat"] = fm.X @ coef
+    out["resid"] = fm.y - out["yhat"]
+    return out
 
-    for m in metrics:
-        if m.ok != 1 or not np.isfinite(m.amp_range):
-            continue
-        rows_raw.append(dict(m.flat or {}))
-        y.append(float(m.amp_range))
-
-    candidates = len(y)
-    if candidates == 0:
-        feature_names: List[str] = []
-        if USE_INTERCEPT:
-            feature_names.append("bias")
-        feature_names.extend(FEATURE_KEYS)
-        return np.zeros((0, len(feature_names))), np.zeros((0,)), feature_names, MLBuildInfo(0, 0, 0)
-
-    yv = np.asarray(y, dtype=float)
-
-    # 2) build raw feature matrix (float), applying log transform -> may create NaNs
-    #    We do transforms first, then missing handling.
-    F = len(FEATURE_KEYS)
-    X0 = np.full((candidates, F), np.nan, dtype=float)
-
-    for i, fv in enumerate(rows_raw):
-        for j, k in enumerate(FEATURE_KEYS):
-            v = fv.get(k, np.nan)
-            v = float(v) if v is not None else np.nan
-            if k in LOG_KEYS:
-                if np.isfinite(v) and v > 0:
-                    v = math.log(v)
-                else:
-                    v = np.nan
-            X0[i, j] = v
 
-    # 3) missing handling
-    if mode == "drop":
-        keep = np.isfinite(X0).all(axis=1) & np.isfinite(yv)
-        Xkeep = X0[keep]
-        ykeep = yv[keep]
-
-        # add intercept if needed
-        if USE_INTERCEPT:
-            X = np.column_stack([np.ones((Xkeep.shape[0], 1)), Xkeep])
-            feature_names = ["bias"] + list(FEATURE_KEYS)
-        else:
-            X = Xkeep
-            feature_names = list(FEATURE_KEYS)
-
-        info = MLBuildInfo(candidates=candidates, used=int(X.shape[0]), dropped=int(candidates - X.shape[0]))
-        return X, ykeep, feature_names, info
-
-    # mode == "impute"
-    # Missing indicator computed on transformed space (after log rules).
-    miss = ~np.isfinite(X0)
-
-    # Median impute (per feature) using available values
-    Ximp = X0.copy()
-    for j in range(F):
-        col = Ximp[:, j]
-        good = np.isfinite(col)
-        if np.any(good):
-            med = float(np.nanmedian(col[good]))
-        else:
-            # feature entirely missing across all candidates -> impute 0.0
-            # (indicator will carry the info)
-            med = 0.0
-        col[~good] = med
-        Ximp[:, j] = col
+# --- cross-validation from per-fold sufficient statistics (--cv k --cv-repeats r) ---
+# Every (repeat, fold) gets [X^T X, X^T y, n, sum y, sum y^2] in one pass over X; a fold's training
+# statistics are the repeat total minus the fold, and both R^2 values follow from the quadratic
+# form y'y - 2 b'X'y + b'X'X b, so no fold ever touches X again.
+
+def cv_fold_ids(N: int, k: int, repeat: int, seed: int) -> np.ndarray:
+    """Fold (0..k-1) of each row in RSN order for one repeat: shuffled, then k near-equal chunks."""
+    perm = np.random.default_rng([int(seed), int(repeat)]).permutation(N)
+    fold = np.empty(N, dtype=np.int64)
+    fold[perm] = (np.arange(N, dtype=np.int64) * k) // max(N, 1)
+    return fold
+
+
+def cv_fold_stats(X: np.ndarray, y: np.ndarray, pos: np.ndarray, N: int, *,
+                  k: int, repeats: int, seed: int) -> np.ndarray:
+    """(repeats, k, p*p + p + 3) statistics of the rows held here; pos = their global RSN-order index."""
+    p = X.shape[1]
+    out = np.zeros((repeats, k, p * p + p + 3), dtype=float)
+    for r in range(repeats):
+        fold = cv_fold_ids(N, k, r, seed)[pos]
+        for f in range(k):
+            m = fold == f
+            Xf, yf = X[m], y[m]
+            out[r, f, :p * p] = (Xf.T @ Xf).ravel()
+            out[r, f, p * p:p * p + p] = Xf.T @ yf
+            out[r, f, -3:] = (yf.size, yf.sum(), yf @ yf)
+    return out
 
-    # Build final X:
-    # [bias?] + features + missing_indicators
-    parts = []
-    feature_names = []
 
-    if USE_INTERCEPT:
-        parts.append(np.ones((candidates, 1), dtype=float))
-        feature_names.append("bias")
+def _r2_from_stats(XtX: np.ndarray, Xty: np.ndarray, n: float, sy: float, syy: float, coef: np.ndarray) -> float:
+    if n < 3:
+        return np.nan
+    ss_tot = syy - sy * sy / n
+    ss_res = syy - 2.0 * float(coef @ Xty) + float(coef @ XtX @ coef)
+    return 1.0 - ss_res / ss_tot if ss_tot > 0 else np.nan
 
-    parts.append(Ximp)
-    feature_names.extend(list(FEATURE_KEYS))
 
-    # Add missing indicators (0/1) for each feature key
-    M = miss.astype(float)
-    parts.append(M)
-    feature_names.extend([f"miss_{k}" for k in FEATURE_KEYS])
+def cv_solve_folds(stats: np.ndarray, jobs: Sequence[Tuple[int, int]]) -> List[Dict[str, Any]]:
+    """Fit and score the given (repeat, fold) jobs from cv_fold_stats() totals."""
+    m = stats.shape[-1]
+    p = int(round((-1 + math.sqrt(1 + 4 * (m - 3))) / 2))
+    out = []
+    for r, f in jobs:
+        te = stats[r, f]
+        tr = stats[r].sum(axis=0) - te
+        XtX_tr, Xty_tr = tr[:p * p].reshape(p, p), tr[p * p:p * p + p]
+        row = {"repeat": int(r), "fold": int(f), "n_train": int(tr[-3]), "n_test": int(te[-3]),
+               "r2_train": np.nan, "r2_test": np.nan}
+        if tr[-3] >= p + 2:
+            coef = np.linalg.lstsq(XtX_tr, Xty_tr, rcond=None)[0]
+            row["r2_train"] = float(_r2_from_stats(XtX_tr, Xty_tr, *tr[-3:], coef))
+            row["r2_test"] = float(_r2_from_stats(te[:p * p].reshape(p, p), te[p * p:p * p + p], *te[-3:], coef))
+        out.append(row)
+    return out
+
+
+def cv_summary(folds: List[Dict[str, Any]], *, k: int, repeats: int) -> Dict[str, Any]:
+    """Report entries: fold rows (repeat/fold order) + mean/std/min/max of R^2 over finite folds."""
+    folds = sorted(folds, key=lambda d: (d["repeat"], d["fold"]))
+    out: Dict[str, Any] = {"cv_k": int(k), "cv_repeats": int(repeats), "cv_folds": folds}
+    for name in ("r2_train", "r2_test"):
+        v = np.array([d[name] for d in folds], dtype=float)
+        v = v[np.isfinite(v)]
+        out[f"cv_{name}_n"] = int(v.size)
+        out[f"cv_{name}_mean"] = float(v.mean()) if v.size else np.nan
+        out[f"cv_{name}_std"] = float(v.std(ddof=1)) if v.size > 1 else np.nan
+        out[f"cv_{name}_min"] = float(v.min()) if v.size else np.nan
+        out[f"cv_{name}_max"] = float(v.max()) if v.size else np.nan
+    return out
+
+
+def fit_ml_gathered(
+    table: np.ndarray,
+    *,
+    mode: str,
+    max_abs_amp: float,
+    test_frac: float,
+    seed: int,
+    want_preds: bool = False,
+    cv: int = 0,
+    cv_repeats: int = 1,
+) -> MLFit:
+    """Fit on one process from a full (RSN-sorted) metrics table; cv > 1 adds k-fold CV to the report."""
+    fm = build_feature_matrix(table, mode=mode, max_abs_amp=max_abs_amp)
+    X, y = fm.X, fm.y
+    test_mask = _train_test_split_mask(X.shape[0], test_frac=test_frac, seed=seed)
+    train_mask = ~test_mask
+    report = _ml_report(fm.info, mode=mode, max_abs_amp=max_abs_amp, test_frac=test_frac, seed=seed)
+
+    model_obj = None
+    if X.shape[0] >= (X.shape[1] + 2) and np.sum(train_mask) >= (X.shape[1] + 2):
+        Xtr, ytr = X[train_mask], y[train_mask]
+        Xte, yte = X[test_mask], y[test_mask]
+
+        model_obj, coef = fit_linear_model(Xtr, ytr)
+        yhat_tr = Xtr @ coef
+        yhat_te = Xte @ coef if Xte.size else np.array([], dtype=float)
+
+        report["r2_train"] = float(r2_score(ytr, yhat_tr))
+        report["r2_test"] = float(r2_score(yte, yhat_te)) if Xte.size else np.nan
+    else:
+        # not enough rows to fit
+        coef = np.full((X.shape[1],), np.nan, dtype=float)
+
+    if cv > 1:
+        N = X.shape[0]
+        stats = cv_fold_stats(X, y, np.arange(N), N, k=cv, repeats=cv_repeats, seed=seed)
+        jobs = [(r, f) for r in range(cv_repeats) for f in range(cv)]
+        report.update(cv_summary(cv_solve_folds(stats, jobs), k=cv, repeats=cv_repeats))
+
+    preds = None
+    if want_preds and X.shape[0] > 0 and np.all(np.isfinite(coef)):
+        preds = _preds_table(fm, coef, test_mask)
+    return MLFit(fm.feature_names, coef, model_obj, report, fm.info, preds)
+
 
-    X = np.column_stack(parts)
-    keep = np.isfinite(yv)  # should already be true; keep for safety
-    X = X[keep]
-    yv2 = yv[keep]
+def _float_keys(a: np.ndarray) -> np.ndarray:
+    """Map float64 -> int64 so that integer order == float order."""
+    b = np.ascontiguousarray(a, dtype=np.float64).view(np.int64)
+    return np.where(b < 0, b ^ np.int64(0x7FFFFFFFFFFFFFFF), b)
 
-    info = MLBuildInfo(candidates=candidates, used=int(X.shape[0]), dropped=int(candidates - X.shape[0]))
-    return X, yv2, feature_names, info
+
+def _keys_float(k: np.ndarray) -> np.ndarray:
+    """Inverse of _float_keys()."""
+    k = np.asarray(k, dtype=np.int64)
+    return np.where(k < 0, k ^ np.int64(0x7FFFFFFFFFFFFFFF), k).view(np.float64)
+
+
+def distributed_feature_medians(comm: MPI.Comm, X0: np.ndarray) -> np.ndarray:
+    """
+    Collective feature_medians() over the row blocks held by all ranks (same result as the median
+    of the concatenated block): per column, bisect on the int64 keys of the order statistics
+    (n-1)//2 and n//2, one Allreduce of the counts per step (<= 64 steps).
+    """
+    F = X0.shape[1]
+    good = ~np.isnan(X0)
+    n = np.empty(F, dtype=np.int64)
+    comm.Allreduce(np.count_nonzero(good, axis=0).astype(np.int64), n, op=MPI.SUM)
+
+    big = np.iinfo(np.int64).max
+    keys = np.where(good, _float_keys(np.where(good, X0, 0.0)), big)
+    lo_local = np.where(good, keys, big).min(axis=0, initial=big)
+    hi_local = np.where(good, keys, -big).max(axis=0, initial=-big)
+    lo1, hi1 = np.empty(F, np.int64), np.empty(F, np.int64)
+    comm.Allreduce(lo_local, lo1, op=MPI.MIN)
+    comm.Allreduce(hi_local, hi1, op=MPI.MAX)
+
+    # rank (0-based) of the two middle order statistics; columns with n == 0 settle immediately
+    kth = np.stack([(n - 1) // 2, n // 2]) + 1
+    lo = np.stack([lo1, lo1])
+    hi = np.stack([hi1, hi1])
+    lo[:, n == 0] = hi[:, n == 0] = 0
+    while np.any(lo < hi):
+        mid = (lo >> 1) + (hi >> 1) + (lo & hi & 1)  # floor((lo + hi) / 2) without overflow
+        local = (keys[None, :, :] <= mid[:, None, :]).sum(axis=1).astype(np.int64)
+        cnt = np.empty_like(local)
+        comm.Allreduce(local, cnt, op=MPI.SUM)
+        enough = cnt >= kth
+        hi = np.where(enough, mid, hi)
+        lo = np.where(enough, lo, mid + 1)
+
+    a, b = _keys_float(lo)
+    med = np.where(n % 2 == 1, a, (a + b) / 2.0)
+    med[n == 0] = 0.0
+    return med
+
+
+def fit_ml_allreduce(
+    comm: MPI.Comm,
+    table: np.ndarray,
+    *,
+    mode: str,
+    max_abs_amp: float,
+    test_frac: float,
+    seed: int,
+    want_preds: bool = False,
+    cv: int = 0,
+    cv_repeats: int = 1,
+) -> Optional[MLFit]:
+    """
+    Collective fit over the metrics rows each rank holds (table = this rank's part, any order).
+    With cv > 1 the fold statistics are Allreduced and the (repeat, fold) solves are dealt
+    round-robin over ranks. Returns the MLFit on rank 0 (model is None) and None elsewhere.
+    """
+    rank = comm.Get_rank()
+    fm = build_feature_matrix(table, mode=mode, max_abs_amp=max_abs_amp,
+                              medians=lambda X0: distributed_feature_medians(comm, X0))
+    X, y = fm.X, fm.y
+    p = X.shape[1]
+
+    counts = np.array(fm.info, dtype=np.int64)
+    comm.Allreduce(MPI.IN_PLACE, counts, op=MPI.SUM)
+    info = MLBuildInfo(*(int(c) for c in counts))
+
+    # Global split: where each local row sits in the RSN-sorted order rank 0 would have built
+    rsn_local = fm.ids.astype(np.int64)
+    sizes = comm.allgather(int(rsn_local.size))
+    rsn_all = np.empty(int(sum(sizes)), dtype=np.int64)
+    comm.Allgatherv(rsn_local, [rsn_all, (sizes, np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(int).tolist())])
+    rsn_all.sort(kind="stable")
+    N = int(rsn_all.size)
+    pos = np.searchsorted(rsn_all, rsn_local)
+    test_mask = _train_test_split_mask(N, test_frac=test_frac, seed=seed)[pos]
+    train_mask = ~test_mask
+    del rsn_all
+
+    # Pass 1: normal equations + per-split [n, sum y]
+    Xtr, ytr = X[train_mask], y[train_mask]
+    local = np.concatenate([(Xtr.T @ Xtr).ravel(), Xtr.T @ ytr,
+                            [ytr.size, ytr.sum(), np.count_nonzero(test_mask), y[test_mask].sum()]])
+    tot = np.empty_like(local)
+    comm.Reduce(local, tot, op=MPI.SUM, root=0)
+
+    coef = np.full((p,), np.nan, dtype=float)
+    if rank == 0:
+        XtX, Xty = tot[:p * p].reshape(p, p), tot[p * p:p * p + p]
+        if N >= p + 2 and tot[-4] >= p + 2:
+            coef = np.asarray(np.linalg.lstsq(XtX, Xty, rcond=None)[0], dtype=float)
+    comm.Bcast(coef, root=0)
+    stats = comm.bcast(tot[-4:] if rank == 0 else None, root=0)
+
+    report = _ml_report(info, mode=mode, max_abs_amp=max_abs_amp, test_frac=test_frac, seed=seed)
+    fitted = bool(np.all(np.isfinite(coef)))
+
+    # Pass 2: residual / total sums of squares per split (r2_score semantics)
+    if fitted:
+        n_tr, sy_tr, n_te, sy_te = stats
+        res = np.zeros(4)
+        for j, (m, n_s, sy) in enumerate(((train_mask, n_tr, sy_tr), (test_mask, n_te, sy_te))):
+            if n_s > 0:
+                r = y[m] - X[m] @ coef
+                res[2 * j] = float(r @ r)
+                res[2 * j + 1] = float(np.sum((y[m] - sy / n_s) ** 2))
+        comm.Reduce(MPI.IN_PLACE if rank == 0 else res, res, op=MPI.SUM, root=0)
+        if rank == 0:
+            for j, (name, n_s) in enumerate((("r2_train", n_tr), ("r2_test", n_te))):
+                ss_res, ss_tot = res[2 * j], res[2 * j + 1]
+                report[name] = 1.0 - ss_res / ss_tot if n_s >= 3 and ss_tot > 0 else np.nan
+
+    preds = None
+    if want_preds and info.used > 0 and fitted:
+        preds = gatherv_table(comm, _preds_table(fm, coef, test_mask))
+        if rank == 0:
+            preds = sort_table_by_rsn(preds, "rec_id")
+
+    if cv > 1:
+        stats = cv_fold_stats(X, y, pos, N, k=cv, repeats=cv_repeats, seed=seed)
+        comm.Allreduce(MPI.IN_PLACE, stats, op=MPI.SUM)
+        jobs = [(r, f) for r in range(cv_repeats) for f in range(cv)][rank::comm.Get_size()]
+        folds = comm.gather(cv_solve_folds(stats, jobs), root=0)
+        if rank == 0:
+            report.update(cv_summary([d for part in folds for d in part], k=cv, repeats=cv_repeats))
+
+    if rank != 0:
+        return None
+    return MLFit(fm.feature_names, coef, None, report, info, preds)
 
 
 
@@ -1021,6 +2452,248 @@ def write_logs_csv(path: str, logs: List[RecordLog]) -> None:
             w.writerow({k: getattr(l, k) for k in fieldnames})
 
 
+# ---------------------------
+# Columnar result tables (structured NumPy arrays)
+# ---------------------------
+# Per-rank result lists are packed into fixed-dtype structured arrays whose field names are the
+# CSV column names (dict fields like RecordMetrics.flat expand to flat__<key>), then moved with
+# buffer-based Gatherv instead of pickling every dataclass. String widths are agreed on with an
+# Allreduce(MAX) so every rank packs with the same dtype.
+
+def _table_schema(cls) -> List[Tuple[str, str, str]]:
+    """Return (column, dataclass_field, kind) with kind in {'s','f','i'} for a row dataclass."""
+    cols: List[Tuple[str, str, str]] = []
+    for f in fields(cls):
+        t = str(f.type)
+        if t.startswith("Dict"):
+            cols.extend((f"{f.name}__{k}", f.name, "f") for k in FLAT_VAR_KEYS)
+        elif t == "str":
+            cols.append((f.name, f.name, "s"))
+        elif t == "int":
+            cols.append((f.name, f.name, "i"))
+        else:
+            cols.append((f.name, f.name, "f"))
+    return cols
+
+
+def table_dtype(cls, widths: Dict[str, int]) -> np.dtype:
+    """Structured dtype for a row dataclass; strings are fixed-width UTF-8 bytes."""
+    spec = []
+    for col, _name, kind in _table_schema(cls):
+        if kind == "s":
+            spec.append((col, f"S{max(1, int(widths.get(col, 1)))}"))
+        elif kind == "i":
+            spec.append((col, "<i8"))
+        else:
+            spec.append((col, "<f8"))
+    return np.dtype(spec)
+
+
+def _str_widths(rows: Sequence[Any], cls) -> Dict[str, int]:
+    out = {}
+    for col, name, kind in _table_schema(cls):
+        if kind == "s":
+            out[col] = max((len(str(getattr(r, name)).encode("utf-8")) for r in rows), default=1)
+    return out
+
+
+def pack_rows(rows: Sequence[Any], cls, widths: Optional[Dict[str, int]] = None) -> np.ndarray:
+    """Pack a list of row dataclasses into a structured array (see table_dtype)."""
+    schema = _table_schema(cls)
+    dtype = table_dtype(cls, widths if widths is not None else _str_widths(rows, cls))
+    recs = []
+    for r in rows:
+        vals = []
+        for col, name, kind in schema:
+            v = getattr(r, name)
+            if isinstance(v, dict):
+                vals.append(v.get(col.split("__", 1)[1], np.nan))
+            elif kind == "s":
+                vals.append(str(v).encode("utf-8"))
+            else:
+                vals.append(v)
+        recs.append(tuple(vals))
+    return np.array(recs, dtype=dtype)
+
+
+def unpack_rows(table: np.ndarray, cls) -> List[Any]:
+    """Inverse of pack_rows()."""
+    schema = _table_schema(cls)
+    out = []
+    for rec in table.tolist():
+        kw: Dict[str, Any] = {}
+        for (col, name, kind), v in zip(schema, rec):
+            if col != name:
+                kw.setdefault(name, {})[col.split("__", 1)[1]] = v
+            else:
+                kw[name] = v.decode("utf-8") if kind == "s" else v
+        out.append(cls(**kw))
+    return out
+
+
+def gatherv_table(comm: MPI.Comm, local: np.ndarray, root: int = 0) -> Optional[np.ndarray]:
+    """Gather equal-dtype structured arrays to root with one Gatherv of raw bytes."""
+    local = np.ascontiguousarray(local)
+    itemsize = local.dtype.itemsize
+    counts = comm.gather(int(local.size), root=root)
+    out = None
+    recv = None
+    if comm.Get_rank() == root:
+        out = np.empty(int(sum(counts)), dtype=local.dtype)
+        nbytes = [c * itemsize for c in counts]
+        displs = np.concatenate([[0], np.cumsum(nbytes)[:-1]]).astype(int).tolist()
+        recv = [out.view(np.uint8), (nbytes, displs), MPI.BYTE]
+    comm.Gatherv([local.view(np.uint8), MPI.BYTE], recv, root=root)
+    return out
+
+
+def pack_rows_global(comm: MPI.Comm, rows: Sequence[Any], cls) -> np.ndarray:
+    """Pack this rank's rows with string widths agreed across comm (same dtype on every rank)."""
+    local_w = _str_widths(rows, cls)
+    keys = sorted(local_w)
+    w = np.asarray([local_w[k] for k in keys], dtype=np.int64)
+    w_all = np.empty_like(w)
+    comm.Allreduce(w, w_all, op=MPI.MAX)
+    return pack_rows(rows, cls, dict(zip(keys, w_all.tolist())))
+
+
+def gather_rows_columnar(comm: MPI.Comm, rows: Sequence[Any], cls, root: int = 0) -> Optional[np.ndarray]:
+    """Pack this rank's rows with globally agreed string widths and Gatherv them to root."""
+    return gatherv_table(comm, pack_rows_global(comm, rows, cls), root=root)
+
+
+def sort_table_by_rsn(table: np.ndarray, key: str) -> np.ndarray:
+    """Stable sort by integer RSN (= flatfile RSN order) regardless of which rank produced a row."""
+    if table.size == 0:
+        return table
+    return table[np.argsort(table[key].astype(np.int64), kind="stable")]
+
+
+def write_table_csv(path: str, table: np.ndarray, header: Optional[List[str]] = None) -> None:
+    """Write a structured array as CSV (same text as the dataclass writers produce)."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(header if header is not None else list(table.dtype.names))
+        for rec in table.tolist():
+            w.writerow([v.decode("utf-8") if isinstance(v, bytes) else v for v in rec])
+
+
+def write_metrics_table_csv(path: str, table: np.ndarray) -> None:
+    """write_metrics_csv() for a packed RecordMetrics table."""
+    header = None
+    if table.size == 0:
+        # write_metrics_csv() cannot discover dict keys without rows -> plain "flat" column
+        header = [f.name for f in fields(RecordMetrics)]
+    write_table_csv(path, table, header=header)
+
+
+# ---------------------------
+# Sharded / parallel output (no rank-0 serialization)
+# ---------------------------
+# --output-format hdf5   : one shared <prefix>_results.h5 written collectively with the MPI-IO
+#                          driver (each rank writes its own row range of every table); falls back
+#                          to per-rank HDF5 shards if h5py was not built with MPI.
+# --output-format parquet: per-rank Parquet shards (needs pyarrow).
+# Either way rank 0 writes <prefix>_manifest.json listing tables, columns, files and row counts.
+# Rows are in processing order; readers sort by RSN (postprocess_nga_metrics_ml.py does).
+
+OUTPUT_FORMATS = ("csv", "hdf5", "parquet")
+MANIFEST_VERSION = 1
+
+
+def _h5py_has_mpi() -> bool:
+    try:
+        return bool(h5py.get_config().mpi)
+    except Exception:
+        return False
+
+
+def _write_tables_shared_h5(comm: MPI.Comm, path: Path, tables: Dict[str, np.ndarray]) -> List[Dict[str, Any]]:
+    """All ranks write their rows into one HDF5 file via the MPI-IO driver (collective create)."""
+    rank = comm.Get_rank()
+    files: List[Dict[str, Any]] = []
+    with h5py.File(str(path), "w", driver="mpio", comm=comm) as h5:
+        for name, local in tables.items():
+            counts = comm.allgather(int(local.size))
+            offset = int(sum(counts[:rank]))
+            ds = h5.create_dataset(name, shape=(int(sum(counts)),), dtype=local.dtype)
+            if local.size:
+                ds[offset:offset + local.size] = local
+            files.append({"table": name, "path": path.name, "dataset": name,
+                          "rank_rows": counts, "n_rows": int(sum(counts))})
+    return files
+
+
+def _write_table_shard(shard_dir: Path, rank: int, fmt: str, tables: Dict[str, np.ndarray]) -> List[Dict[str, Any]]:
+    """Write this rank's tables into its own shard file(s); returns manifest entries."""
+    shard_dir.mkdir(parents=True, exist_ok=True)
+    files: List[Dict[str, Any]] = []
+    if fmt == "hdf5":
+        fpath = shard_dir / f"rank{rank:05d}.h5"
+        with h5py.File(str(fpath), "w") as h5:
+            for name, local in tables.items():
+                h5.create_dataset(name, data=local)
+                files.append({"table": name, "path": f"{shard_dir.name}/{fpath.name}", "dataset": name,
+                              "rank": rank, "n_rows": int(local.size)})
+        return files
+
+    import pyarrow as pa  # type: ignore
+    import pyarrow.parquet as pq  # type: ignore
+    for name, local in tables.items():
+        fpath = shard_dir / f"rank{rank:05d}_{name}.parquet"
+        cols = {}
+        for col in local.dtype.names:
+            v = local[col]
+            cols[col] = [x.decode("utf-8") for x in v.tolist()] if v.dtype.kind == "S" else v
+        pq.write_table(pa.table(cols), str(fpath))
+        files.append({"table": name, "path": f"{shard_dir.name}/{fpath.name}", "rank": rank,
+                      "n_rows": int(local.size)})
+    return files
+
+
+def write_result_shards(
+    comm: MPI.Comm,
+    tables: Dict[str, np.ndarray],
+    *,
+    fmt: str,
+    outdir: Path,
+    prefix: str,
+) -> Optional[Path]:
+    """
+    Write packed per-rank tables without gathering them. Collective.
+    Returns the manifest path on rank 0 (None elsewhere).
+    """
+    rank = comm.Get_rank()
+    layout = fmt
+    if fmt == "hdf5" and _h5py_has_mpi():
+        layout = "hdf5-mpio"
+        files = _write_tables_shared_h5(comm, outpath(outdir, prefix, "results", ".h5"), tables)
+        all_files = [files] if rank == 0 else None
+    else:
+        if fmt == "hdf5":
+            layout = "hdf5-shards"
+        files = _write_table_shard(Path(outdir) / f"{prefix}_shards", rank, fmt, tables)
+        all_files = comm.gather(files, root=0)
+
+    if rank != 0:
+        return None
+
+    manifest: Dict[str, Any] = {"version": MANIFEST_VERSION, "format": layout, "prefix": prefix, "tables": {}}
+    for name, local in tables.items():
+        manifest["tables"][name] = {"columns": list(local.dtype.names), "files": [], "n_rows": 0}
+    for sub in all_files:
+        for entry in sub:
+            t = manifest["tables"][entry["table"]]
+            t["files"].append({k: v for k, v in entry.items() if k != "table"})
+            t["n_rows"] += int(entry["n_rows"])
+
+    mpath = outpath(outdir, prefix, "manifest", ".json")
+    with open(mpath, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    return mpath
+
+
 def write_report_txt(
     path: str,
     attempted_units: int,
@@ -1053,6 +2726,1007 @@ def write_report_txt(
             if k.startswith("coef_"):
                 f.write(f"{k}: {v:.3g}\n")
 
+        if report.get("cv_folds"):
+            f.write(f"\nCross-validation: {report['cv_k']}-fold x {report['cv_repeats']} repeat(s)\n")
+            for name, label in (("r2_train", "R^2 train"), ("r2_test", "R^2 test ")):
+                f.write(f"CV {label}: mean={report[f'cv_{name}_mean']:.3g} std={report[f'cv_{name}_std']:.3g} "
+                        f"min={report[f'cv_{name}_min']:.3g} max={report[f'cv_{name}_max']:.3g} "
+                        f"(n={report[f'cv_{name}_n']})\n")
+            f.write("repeat,fold,n_train,n_test,r2_train,r2_test\n")
+            for d in report["cv_folds"]:
+                f.write(f"{d['repeat']},{d['fold']},{d['n_train']},{d['n_test']},"
+                        f"{d['r2_train']:.6g},{d['r2_test']:.6g}\n")
+
+
+
+# ---------------------------
+# Per-RSN processing
+# ---------------------------
+# Split in two so the HDF5 half can run on a reader thread (RecordReader, --read-ahead):
+#   load_rsn_pair()      : resolve dataset paths, dt, read H1/H2 (HDF5 only)
+#   process_loaded_rsn() : metrics, logs, RotD (no HDF5)
+# process_rsn() runs both back to back.
+
+@dataclass
+class RecordLoad:
+    """HDF5 side of one RSN: resolved dataset paths, dt, and the H1/H2 arrays or their read errors."""
+    rsn: str
+    pair: Optional[Tuple[str, str]]
+    dspath_h1: Optional[str] = None
+    dspath_h2: Optional[str] = None
+    dt: float = np.nan
+    a1: Optional[np.ndarray] = None
+    a2: Optional[np.ndarray] = None
+    err1: Optional[BaseException] = None
+    err2: Optional[BaseException] = None
+    slot: Optional[int] = None   # RecordReader ring slot when a1/a2 are views into its buffers
+    ref1: Optional[np.ndarray] = None   # float64 reads for --dtype-check when a1/a2 are not float64
+    ref2: Optional[np.ndarray] = None
+
+
+COMPUTE_DTYPES = ("float64", "native", "float32")
+
+
+def record_dtype(stored: np.dtype, mode: str = "float64") -> np.dtype:
+    """
+    dtype a record is loaded (and RotD rotated) in for --compute-dtype:
+    float64 = always upcast (original behaviour), float32 = always float32,
+    native = keep float32/float64 as stored, upcast anything else.
+    """
+    if mode == "float32":
+        return np.dtype(np.float32)
+    if mode == "native" and stored.kind == "f" and stored.itemsize in (4, 8):
+        return np.dtype(stored)
+    return np.dtype(np.float64)
+
+
+def _read_flat_float(
+    ds: h5py.Dataset,
+    bufs: Optional[List[np.ndarray]],
+    j: int,
+    compute_dtype: str = "float64",
+) -> np.ndarray:
+    """
+    Read ds as a flat array of record_dtype(ds.dtype, compute_dtype). HDF5 converts during the
+    read (no intermediate copy). With bufs, read_direct() into bufs[j] (reallocated if too small
+    or of another dtype) and return a view of it instead of allocating.
+    """
+    dtype = record_dtype(ds.dtype, compute_dtype)
+    n = int(ds.size)
+    if bufs is None:
+        if ds.dtype == dtype:
+            return np.asarray(ds[()]).ravel()
+        out = np.empty(n, dtype=dtype)
+    else:
+        if bufs[j].size < n or bufs[j].dtype != dtype:
+            bufs[j] = np.empty(max(n, 2 * bufs[j].size if bufs[j].dtype == dtype else n), dtype=dtype)
+        out = bufs[j][:n]
+    if n:
+        ds.read_direct(out.reshape(ds.shape))
+    return out
+
+
+def load_rsn_pair(
+    h5: h5py.File,
+    rsn: str,
+    pair: Optional[Tuple[str, str]],
+    *,
+    rsn_index: Optional[RSNIndex] = None,
+    bufs: Optional[List[np.ndarray]] = None,
+    compute_dtype: str = "float64",
+    ref_float64: bool = False,
+) -> RecordLoad:
+    """
+    Resolve and read both components of one RSN. Arrays are only read when BOTH datasets exist.
+    If rsn_index is given, dataset paths and dt come from it instead of HDF5 probes.
+    compute_dtype picks the array dtype (see record_dtype()); ref_float64 also reads float64
+    copies into load.ref1/ref2 whenever that dtype is not float64 (for --dtype-check).
+    """
+    load = RecordLoad(rsn=rsn, pair=pair)
+    if pair is None:
+        return load
+    mapped_h1, mapped_h2 = pair
+
+    # Find datasets for BOTH. If either missing, skip RSN (both comps)
+    known1 = known2 = False
+    dt1 = dt2 = np.nan
+    if rsn_index is not None:
+        known1, load.dspath_h1, dt1 = rsn_index.resolve(rsn, "H1", mapped_h1)
+        known2, load.dspath_h2, dt2 = rsn_index.resolve(rsn, "H2", mapped_h2)
+        if rsn_index.verify:
+            # may be stale: only trust paths that still exist
+            known1 = known1 and load.dspath_h1 is not None and load.dspath_h1 in h5
+            known2 = known2 and load.dspath_h2 is not None and load.dspath_h2 in h5
+    if not known1:
+        load.dspath_h1 = _find_dataset_path(h5, rsn, mapped_h1)
+    if not known2:
+        load.dspath_h2 = _find_dataset_path(h5, rsn, mapped_h2)
+    if load.dspath_h1 is None or load.dspath_h2 is None:
+        return load
+
+    # If we get here: BOTH datasets exist -> read both
+    ds1 = h5[load.dspath_h1]
+    ds2 = h5[load.dspath_h2]
+
+    # Prefer dtHeader from H1; fallback to H2
+    if not known1:
+        dt1 = _get_dt_from_dataset(ds1)
+    if not known2:
+        dt2 = _get_dt_from_dataset(ds2)
+
+    dt_use = dt1
+    if not (np.isfinite(dt_use) and dt_use > 0):
+        dt_use = dt2
+    # no flatfile DT fallback
+    if not (np.isfinite(dt_use) and dt_use > 0):
+        dt_use = np.nan
+    load.dt = dt_use
+
+    try:
+        load.a1 = _read_flat_float(ds1, bufs, 0, compute_dtype)
+        if ref_float64 and load.a1.dtype != np.float64:
+            load.ref1 = _read_flat_float(ds1, None, 0, "float64")
+    except Exception as e:
+        load.err1 = e
+    try:
+        load.a2 = _read_flat_float(ds2, bufs, 1, compute_dtype)
+        if ref_float64 and load.a2.dtype != np.float64:
+            load.ref2 = _read_flat_float(ds2, None, 1, "float64")
+    except Exception as e:
+        load.err2 = e
+    return load
+
+
+def process_loaded_rsn(
+    load: RecordLoad,
+    flat_vars: Dict[str, float],
+    *,
+    hdf5_label: str,
+    compute_rotd: bool,
+    angles_deg: np.ndarray,
+    rotd_mem_mb: float = ROTD_MEM_MB_DEFAULT,
+    rotd_method: str = "brute",
+    rotd_check: Optional[Dict[str, int]] = None,
+    rotd_batcher: Optional[RotDBatcher] = None,
+    dtype_check: Optional[Dict[str, Any]] = None,
+    psa: Optional[PSASettings] = None,
+    psa_rows: Optional[List[PSARow]] = None,
+    my_metrics: Dict[str, List[RecordMetrics]],
+    my_logs: Dict[str, List[RecordLog]],
+    rotd_rows: List[RotDRow],
+) -> None:
+    """
+    Compute metrics/logs/RotD for a load_rsn_pair() result and append them to the per-rank lists.
+    If dtype_check is a dict (new_dtype_check()) and the arrays are not float64, the metrics and
+    RotD are also computed from float64 data (load.ref1/ref2, else upcast copies) and the
+    differences are folded into it.
+    If psa is given, the H1/H2/RotD50 response spectra are appended to psa_rows.
+    """
+    rsn = load.rsn
+    if load.pair is None:
+        # Log skip for both
+        for comp in ("H1", "H2"):
+            my_logs[comp].append(
+                RecordLog(rsn=rsn, component=comp, mapped_name="", h5_dataset="",
+                          status="skipped", reason="missing_h1h2_mapping_for_rsn")
+            )
+        return
+
+    mapped_h1, mapped_h2 = load.pair
+    dspath_h1, dspath_h2 = load.dspath_h1, load.dspath_h2
+
+    if dspath_h1 is None or dspath_h2 is None:
+        # Log separately with precise reason
+        if dspath_h1 is None:
+            my_logs["H1"].append(
+                RecordLog(rsn=rsn, component="H1", mapped_name=mapped_h1, h5_dataset="",
+                          status="skipped", reason="h1_dataset_not_found_in_hdf5")
+            )
+        else:
+            my_logs["H1"].append(
+                RecordLog(rsn=rsn, component="H1", mapped_name=mapped_h1, h5_dataset=dspath_h1,
+                          status="skipped", reason="skipped_because_h2_missing")
+            )
+
+        if dspath_h2 is None:
+            my_logs["H2"].append(
+                RecordLog(rsn=rsn, component="H2", mapped_name=mapped_h2, h5_dataset="",
+                          status="skipped", reason="h2_dataset_not_found_in_hdf5")
+            )
+        else:
+            my_logs["H2"].append(
+                RecordLog(rsn=rsn, component="H2", mapped_name=mapped_h2, h5_dataset=dspath_h2,
+                          status="skipped", reason="skipped_because_h1_missing")
+            )
+        return
+
+    a1, a2, dt_use = load.a1, load.a2, load.dt
+    ok_a1 = ok_a2 = False
+
+    # H1
+    try:
+        if a1 is None:
+            raise load.err1
+        ok_a1 = True
+        h5_ref1 = f"{hdf5_label}:{dspath_h1}"
+        m1 = _metrics_from_array(rsn, "H1", h5_ref1, a1, dt_use, flat_vars)
+        if dtype_check is not None and a1.dtype != np.float64:
+            ref1 = load.ref1 if load.ref1 is not None else a1.astype(float)
+            record_metrics_dtype_diff(
+                dtype_check, _metrics_from_array(rsn, "H1", h5_ref1, ref1, dt_use, flat_vars), m1)
+        my_metrics["H1"].append(m1)
+        my_logs["H1"].append(
+            RecordLog(rsn=rsn, component="H1", mapped_name=mapped_h1, h5_dataset=dspath_h1,
+                      status="processed", reason="")
+        )
+    except Exception as e:
+        my_logs["H1"].append(
+            RecordLog(rsn=rsn, component="H1", mapped_name=mapped_h1, h5_dataset=dspath_h1,
+                      status="skipped", reason=f"h1_read_or_compute_error:{e}")
+        )
+
+    # H2
+    try:
+        if a2 is None:
+            raise load.err2
+        ok_a2 = True
+        h5_ref2 = f"{hdf5_label}:{dspath_h2}"
+        m2 = _metrics_from_array(rsn, "H2", h5_ref2, a2, dt_use, flat_vars)
+        if dtype_check is not None and a2.dtype != np.float64:
+            ref2 = load.ref2 if load.ref2 is not None else a2.astype(float)
+            record_metrics_dtype_diff(
+                dtype_check, _metrics_from_array(rsn, "H2", h5_ref2, ref2, dt_use, flat_vars), m2)
+        my_metrics["H2"].append(m2)
+        my_logs["H2"].append(
+            RecordLog(rsn=rsn, component="H2", mapped_name=mapped_h2, h5_dataset=dspath_h2,
+                      status="processed", reason="")
+        )
+    except Exception as e:
+        my_logs["H2"].append(
+            RecordLog(rsn=rsn, component="H2", mapped_name=mapped_h2, h5_dataset=dspath_h2,
+                      status="skipped", reason=f"h2_read_or_compute_error:{e}")
+        )
+
+    # PSA (only if BOTH arrays exist)
+    if psa is not None and psa_rows is not None and ok_a1 and ok_a2:
+        psa_rows.extend(psa.rows(rsn, a1, a2, dt_use))
+
+    # RotD (only if BOTH arrays exist)
+    if compute_rotd and ok_a1 and ok_a2 and dtype_check is not None and a1.dtype != np.float64:
+        record_rotd_dtype_diff(
+            dtype_check,
+            compute_rotd_summaries(load.ref1 if load.ref1 is not None else a1.astype(float),
+                                   load.ref2 if load.ref2 is not None else a2.astype(float),
+                                   dt_use, angles_deg, mem_budget_mb=rotd_mem_mb),
+            compute_rotd_summaries(a1, a2, dt_use, angles_deg, mem_budget_mb=rotd_mem_mb),
+        )
+    if compute_rotd and ok_a1 and ok_a2 and rotd_batcher is not None:
+        if load.slot is not None:
+            # the batcher keeps the arrays past this call; ring buffers get reused
+            a1, a2 = a1.copy(), a2.copy()
+        rotd_batcher.add(rsn, a1, a2, dt_use)
+    elif compute_rotd and ok_a1 and ok_a2:
+        rr = compute_rotd_summaries(a1, a2, dt_use, angles_deg, mem_budget_mb=rotd_mem_mb, method=rotd_method)
+        if rotd_check is not None:
+            ref = compute_rotd_summaries(a1, a2, dt_use, angles_deg, mem_budget_mb=rotd_mem_mb)
+            diffs = compare_rotd_rows(ref, rr)
+            rotd_check["checked"] += 1
+            if diffs:
+                rotd_check["mismatch"] += 1
+                print(f"[rotd-validate] RSN {rsn}: {rotd_method} differs from brute in {diffs}")
+        for row in rr:
+            row.rsn = rsn
+            rotd_rows.append(row)
+
+
+def process_rsn(
+    h5: h5py.File,
+    rsn: str,
+    flat_vars: Dict[str, float],
+    pair: Optional[Tuple[str, str]],
+    *,
+    hdf5_label: str,
+    compute_rotd: bool,
+    angles_deg: np.ndarray,
+    rotd_mem_mb: float = ROTD_MEM_MB_DEFAULT,
+    rotd_method: str = "brute",
+    rotd_check: Optional[Dict[str, int]] = None,
+    rotd_batcher: Optional[RotDBatcher] = None,
+    rsn_index: Optional[RSNIndex] = None,
+    io_stats: Optional[Dict[str, float]] = None,
+    compute_dtype: str = "float64",
+    dtype_check: Optional[Dict[str, Any]] = None,
+    psa: Optional[PSASettings] = None,
+    psa_rows: Optional[List[PSARow]] = None,
+    my_metrics: Dict[str, List[RecordMetrics]],
+    my_logs: Dict[str, List[RecordLog]],
+    rotd_rows: List[RotDRow],
+) -> None:
+    """
+    Process one RSN (H1 + H2 + optional RotD / PSA) and append results to the per-rank lists.
+
+    Rule: only skip RSN if H1 or H2 are missing (or missing in mapping).
+    If rotd_check is a dict, every RotD result is also computed with method="brute" and
+    rotd_check["checked"] / rotd_check["mismatch"] are incremented.
+    If rotd_batcher is given, the RotD pair is queued there instead of computed here.
+    If rsn_index is given, dataset paths and dt come from it instead of HDF5 probes.
+    If io_stats is a dict, time spent in HDF5 lookups/reads is added to io_stats["io_s"].
+    compute_dtype / dtype_check / psa: see record_dtype() and process_loaded_rsn().
+    """
+    t_io = time.perf_counter()
+    load = load_rsn_pair(h5, rsn, pair, rsn_index=rsn_index, compute_dtype=compute_dtype,
+                         ref_float64=dtype_check is not None)
+    if io_stats is not None:
+        io_stats["io_s"] += time.perf_counter() - t_io
+
+    process_loaded_rsn(
+        load, flat_vars,
+        hdf5_label=hdf5_label,
+        compute_rotd=compute_rotd,
+        angles_deg=angles_deg,
+        rotd_mem_mb=rotd_mem_mb,
+        rotd_method=rotd_method,
+        rotd_check=rotd_check,
+        rotd_batcher=rotd_batcher,
+        dtype_check=dtype_check,
+        psa=psa,
+        psa_rows=psa_rows,
+        my_metrics=my_metrics,
+        my_logs=my_logs,
+        rotd_rows=rotd_rows,
+    )
+
+
+class RecordReader:
+    """
+    Background thread running load_rsn_pair() for submitted RSNs ahead of the compute loop.
+    Arrays are read into a ring of depth + 1 reusable buffer pairs; the thread blocks
+    while every slot is held, so at most depth records are read ahead. Only this thread reads
+    the HDF5 file (h5py serializes HDF5 calls and drops the GIL while reading). With the sec2
+    driver MPI stays on the main thread; with --io-mode mpio the reads are MPI-IO calls that can
+    overlap the main thread's MPI calls, so main() only enables read-ahead there under
+    MPI.THREAD_MULTIPLE. Call release() once a record has been processed, close() at the end.
+    """
+
+    def __init__(self, h5: h5py.File, *, depth: int, rsn_index: Optional[RSNIndex] = None,
+                 compute_dtype: str = "float64", ref_float64: bool = False):
+        self.h5 = h5
+        self.rsn_index = rsn_index
+        self.ref_float64 = ref_float64
+        self.compute_dtype = compute_dtype
+        self._bufs = [[np.empty(0), np.empty(0)] for _ in range(max(1, int(depth)) + 1)]
+        self._free: "queue.Queue[int]" = queue.Queue()
+        for i in range(len(self._bufs)):
+            self._free.put(i)
+        self._requests: "queue.Queue[Optional[Tuple[str, Optional[Tuple[str, str]]]]]" = queue.Queue()
+        self._done: Dict[str, Any] = {}
+        self._submitted: set = set()
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="nga-record-reader", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            req = self._requests.get()
+            if req is None:
+                return
+            rsn, pair = req
+            slot = self._free.get()
+            try:
+                load: Any = load_rsn_pair(self.h5, rsn, pair, rsn_index=self.rsn_index, bufs=self._bufs[slot],
+                                         compute_dtype=self.compute_dtype, ref_float64=self.ref_float64)
+                if load.a1 is None and load.a2 is None:
+                    self._free.put(slot)
+                else:
+                    load.slot = slot
+            except BaseException as e:  # re-raised on the main thread by get()
+                self._free.put(slot)
+                load = e
+            with self._cond:
+                self._done[rsn] = load
+                self._cond.notify_all()
+
+    def is_submitted(self, rsn: str) -> bool:
+        return rsn in self._submitted
+
+    def submit(self, rsn: str, pair: Optional[Tuple[str, str]]) -> None:
+        if rsn not in self._submitted:
+            self._submitted.add(rsn)
+            self._requests.put((rsn, pair))
+
+    def get(self, rsn: str, pair: Optional[Tuple[str, str]]) -> RecordLoad:
+        self.submit(rsn, pair)
+        with self._cond:
+            while rsn not in self._done:
+                self._cond.wait()
+            load = self._done.pop(rsn)
+        self._submitted.discard(rsn)
+        if isinstance(load, BaseException):
+            raise load
+        return load
+
+    def release(self, load: RecordLoad) -> None:
+        if load.slot is not None:
+            self._free.put(load.slot)
+            load.slot = None
+
+    def close(self) -> None:
+        self._requests.put(None)
+        self._thread.join()
+
+
+# ---------------------------
+# Per-RSN result cache (--cache-dir)
+# ---------------------------
+# One JSON entry per RSN holding everything process_rsn() produced for it (H1/H2 metrics + logs, the
+# RotD and PSA rows). Key = sha256 of (HDF5 realpath, size, mtime_ns, RSN, mapped H1/H2 names, HDF5 label,
+# RotD angles, --compute-dtype, PSA settings, RESULT_CACHE_VERSION), so it is computed without touching the HDF5 file; an ML-only
+# rerun with a warm cache never opens it. Flatfile variables are not part of the key: they are
+# re-attached from the current flatfile on every hit. Entries live in <cache-dir>/<key[:2]>/<key>.json
+# (atomic replace); hits refresh the mtime and rank 0 evicts least-recently-used entries above
+# --cache-max-mb at the end of the run. Misses are queued until their RotD rows exist and written every
+# `flush_every` misses (the --checkpoint-every cadence when set), so a killed run keeps most of its work
+# and the queue stays bounded. RSNs skipped on a read/compute error are never cached (a missing dataset
+# is). Bump RESULT_CACHE_VERSION when a metric definition changes.
+
+RESULT_CACHE_VERSION = 1
+RESULT_CACHE_FLUSH_EVERY = 64
+
+
+def rsn_cache_key(
+    file_id: Tuple[str, int, int],
+    rsn: str,
+    pair: Optional[Tuple[str, str]],
+    *,
+    hdf5_label: str,
+    compute_rotd: bool,
+    angles_deg: np.ndarray,
+    compute_dtype: str = "float64",
+    psa: Optional[PSASettings] = None,
+) -> str:
+    payload = {
+        "version": RESULT_CACHE_VERSION,
+        "hdf5": list(file_id),
+        "rsn": rsn,
+        "pair": list(pair) if pair is not None else None,
+        "hdf5_label": hdf5_label,
+        "rotd_angles": [float(a) for a in angles_deg] if compute_rotd else None,
+        "compute_dtype": compute_dtype,
+    }
+    if psa is not None:
+        payload["psa"] = psa.signature()
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """Content-addressed per-RSN cache of process_rsn() output (see section comment)."""
+
+    def __init__(self, cache_dir: PathLike, *, rank: int = 0, flush_every: int = RESULT_CACHE_FLUSH_EVERY):
+        self.root = Path(cache_dir)
+        self.rank = rank
+        self.flush_every = max(1, int(flush_every))
+        self.hits = 0
+        self.misses = 0
+        self._pending: List[Tuple[str, str, Dict[str, Any]]] = []
+        self._rotd_mark = 0
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}.json"
+
+    def contains(self, key: str) -> bool:
+        return self._path(key).exists()
+
+    def apply(
+        self,
+        key: str,
+        flat_vars: Dict[str, float],
+        my_metrics: Dict[str, List[RecordMetrics]],
+        my_logs: Dict[str, List[RecordLog]],
+        rotd_rows: List[RotDRow],
+        psa_rows: Optional[List[PSARow]] = None,
+    ) -> bool:
+        """On a hit, append the cached rows to the per-rank lists and return True."""
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return False
+
+        for comp in ("H1", "H2"):
+            for d in entry["metrics"][comp]:
+                d["flat"] = dict(flat_vars)
+                my_metrics[comp].append(RecordMetrics(**d))
+            my_logs[comp].extend(RecordLog(**d) for d in entry["logs"][comp])
+        rotd_rows.extend(RotDRow(**d) for d in entry["rotd"])
+        if psa_rows is not None:
+            psa_rows.extend(PSARow(**d) for d in entry.get("psa", []))
+        try:
+            os.utime(path)  # LRU clock
+        except OSError:
+            pass
+        self.hits += 1
+        return True
+
+    def remember(
+        self,
+        key: str,
+        rsn: str,
+        my_metrics: Dict[str, List[RecordMetrics]],
+        my_logs: Dict[str, List[RecordLog]],
+        marks: Dict[str, int],
+        psa_rows: Optional[List[PSARow]] = None,
+    ) -> None:
+        """Queue the rows process_rsn() just appended (after `marks`) for storing; RotD rows come later.
+
+        RSNs skipped on a read/compute error are not queued, so a transient failure is retried next run.
+        """
+        self.misses += 1
+        logs = {c: my_logs[c][marks[f"logs_{c}"]:] for c in ("H1", "H2")}
+        if any("_read_or_compute_error" in r.reason for c in ("H1", "H2") for r in logs[c]):
+            return
+        entry = {
+            "metrics": {c: [asdict(m) for m in my_metrics[c][marks[f"metrics_{c}"]:]] for c in ("H1", "H2")},
+            "logs": {c: [asdict(r) for r in logs[c]] for c in ("H1", "H2")},
+        }
+        if psa_rows is not None:
+            entry["psa"] = [asdict(r) for r in psa_rows[marks["psa"]:]]
+        for c in ("H1", "H2"):
+            for d in entry["metrics"][c]:
+                d.pop("flat", None)
+        self._pending.append((key, rsn, entry))
+
+    @property
+    def full(self) -> bool:
+        """True once flush_every entries are queued; flush deferred RotD rows, then store_pending()."""
+        return len(self._pending) >= self.flush_every
+
+    def store_pending(self, rotd_rows: List[RotDRow]) -> None:
+        """Write queued entries (call once any deferred RotD rows have been produced)."""
+        if not self._pending:
+            return
+        by_rsn: Dict[str, List[Dict[str, Any]]] = {}
+        want = {rsn for _, rsn, _ in self._pending}
+        # rows of queued RSNs are all appended after the previous store
+        for r in rotd_rows[self._rotd_mark:]:
+            if r.rsn in want:
+                by_rsn.setdefault(r.rsn, []).append(asdict(r))
+
+        for key, rsn, entry in self._pending:
+            entry["rotd"] = by_rsn.get(rsn, [])
+            path = self._path(key)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(f"{path.name}.{self.rank}.tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(entry, f)
+            os.replace(tmp, path)
+        self._pending = []
+        self._rotd_mark = len(rotd_rows)
+
+
+def evict_result_cache(cache_dir: PathLike, max_mb: float) -> Tuple[int, int]:
+    """Delete least-recently-used entries until the cache fits in max_mb. Returns (n_removed, bytes_left)."""
+    entries = []
+    total = 0
+    for p in Path(cache_dir).glob("*/*.json"):
+        try:
+            st = p.stat()
+        except OSError:
+            continue
+        entries.append((st.st_mtime_ns, st.st_size, p))
+        total += st.st_size
+
+    budget = int(max_mb * 1024 * 1024)
+    removed = 0
+    if max_mb > 0 and total > budget:
+        for _, sz, p in sorted(entries, key=lambda t: t[0]):
+            if total <= budget:
+                break
+            try:
+                p.unlink()
+            except OSError:
+                continue
+            total -= sz
+            removed += 1
+    return removed, total
+
+
+# ---------------------------
+# Work scheduling (static split or dynamic shared counter)
+# ---------------------------
+# static : np.array_split of the RSN indices, one contiguous chunk per rank (original behavior).
+# dynamic: every rank (rank 0 included) grabs the next batch of RSN indices on demand from a
+#          global counter that lives in an MPI RMA window on rank 0 (MPI_Fetch_and_op).
+#          Ranks that draw short/skipped records simply come back for more, so a few long
+#          records no longer stall the whole job.
+
+class SharedCounter:
+    """
+    Global int64 counter hosted on rank 0, advanced atomically with MPI_Fetch_and_op.
+
+    Collective to create and to free.
+    """
+
+    def __init__(self, comm: MPI.Comm):
+        itemsize = MPI.INT64_T.Get_size()
+        self.comm = comm
+        self.win = MPI.Win.Allocate(itemsize if comm.Get_rank() == 0 else 0, itemsize, comm=comm)
+        if comm.Get_rank() == 0:
+            self.win.Lock(0, MPI.LOCK_EXCLUSIVE)
+            self.win.Put(np.zeros(1, dtype=np.int64), 0)
+            self.win.Unlock(0)
+        comm.Barrier()
+
+    def fetch_add(self, n: int) -> int:
+        """Add n to the counter and return its previous value."""
+        inc = np.array([int(n)], dtype=np.int64)
+        old = np.zeros(1, dtype=np.int64)
+        self.win.Lock(0, MPI.LOCK_SHARED)
+        self.win.Fetch_and_op(inc, old, 0, 0, MPI.SUM)
+        self.win.Unlock(0)
+        return int(old[0])
+
+    def free(self) -> None:
+        self.win.Free()
+
+
+def iter_static_indices(
+    comm: MPI.Comm,
+    n_total: int,
+    costs: Optional[np.ndarray] = None,
+    timing: Optional[Dict[str, float]] = None,
+):
+    """
+    Yield this rank's share of range(n_total).
+
+    costs=None -> contiguous np.array_split by record count (original behavior).
+    costs given (rank 0 only) -> cost-balanced partition_by_cost(); the estimated
+    load of this rank's share is stored in timing["est_cost"].
+    """
+    rank = comm.Get_rank()
+    size = comm.Get_size()
+    if rank == 0:
+        if costs is None:
+            indices = np.arange(n_total, dtype=int)
+            chunks = np.array_split(indices, size)
+            chunks_list = [c.tolist() for c in chunks]
+        else:
+            chunks_list = partition_by_cost(costs, size)
+        est = [float(np.sum(costs[c])) if costs is not None else float(len(c)) for c in chunks_list]
+        send = list(zip(chunks_list, est))
+    else:
+        send = None
+
+    my_idx, my_est = comm.scatter(send, root=0)
+    if timing is not None:
+        timing["est_cost"] = my_est
+    yield from my_idx
+
+
+# ---------------------------
+# Length-aware partitioning (static schedule)
+# ---------------------------
+# count     : every RSN costs 1 (np.array_split, the original behavior)
+# npts      : total sample count = npts x 2 components (x number of RotD angles with --compute-rotd)
+# cost-model: affine model = per-record overhead + per-sample read/metrics + per-rotated-sample RotD
+# The shapes come from the HDF5 object headers only (no data is read).
+
+COST_RECORD_OVERHEAD = 2000.0    # lookups, attrs, logging, in "sample" units
+COST_PER_SAMPLE = 4.0            # read + max/min/argmax/argmin per sample
+COST_PER_ROTATED_SAMPLE = 6.0    # rotate (u, v) + abs/max/min/argmax/argmin per angle-sample
+
+
+def read_rsn_npts(
+    h5: h5py.File,
+    rsn_list: Sequence[str],
+    rsn_to_h1h2: Dict[str, Tuple[str, str]],
+) -> np.ndarray:
+    """
+    Return npts per RSN (max of H1/H2 dataset lengths) from dataset shapes only.
+    RSNs that will be skipped (no mapping / dataset not found) get 0.
+    """
+    npts = np.zeros(len(rsn_list), dtype=np.int64)
+    for i, rsn in enumerate(rsn_list):
+        pair = rsn_to_h1h2.get(rsn)
+        if pair is None:
+            continue
+        paths = [_find_dataset_path(h5, rsn, name) for name in pair]
+        if any(p is None for p in paths):
+            continue
+        npts[i] = max(int(np.prod(h5[p].shape)) for p in paths)
+    return npts
+
+
+def estimate_rsn_costs(npts: np.ndarray, *, mode: str, n_angles: int) -> np.ndarray:
+    """Relative processing cost per RSN for the --partition modes."""
+    npts = np.asarray(npts, dtype=float)
+    if mode == "count":
+        return np.ones_like(npts)
+    if mode == "npts":
+        return 2.0 * npts * max(1, int(n_angles))
+    if mode == "cost-model":
+        return (COST_RECORD_OVERHEAD
+                + COST_PER_SAMPLE * 2.0 * npts
+                + COST_PER_ROTATED_SAMPLE * 2.0 * npts * int(n_angles))
+    raise ValueError(f"Unknown partition mode: {mode}")
+
+
+def partition_by_cost(costs: np.ndarray, nparts: int) -> List[List[int]]:
+    """
+    Deterministic greedy LPT partition: largest cost first, each to the least-loaded part.
+    Ties break on index/part number; each part is returned in ascending index order.
+    """
+    costs = np.asarray(costs, dtype=float)
+    order = np.argsort(-costs, kind="stable")
+    heap = [(0.0, p) for p in range(int(nparts))]
+    parts: List[List[int]] = [[] for _ in range(int(nparts))]
+    for i in order.tolist():
+        load, p = heapq.heappop(heap)
+        parts[p].append(i)
+        heapq.heappush(heap, (load + float(costs[i]), p))
+    return [sorted(p) for p in parts]
+
+
+def iter_dynamic_indices(counter: SharedCounter, n_total: int, batch_size: int, timing: Dict[str, float]):
+    """
+    Yield RSN indices handed out in batches of batch_size by the shared counter.
+    Time spent waiting on the counter is accumulated in timing["sched_s"].
+    """
+    batch_size = max(1, int(batch_size))
+    while True:
+        t0 = time.perf_counter()
+        start = counter.fetch_add(batch_size)
+        timing["sched_s"] += time.perf_counter() - t0
+        if start >= n_total:
+            return
+        yield from range(start, min(start + batch_size, n_total))
+
+
+def write_rank_timing_csv(path: str, rows: List[Dict[str, Any]]) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    fieldnames = ["rank", "n_rsn", "est_cost", "busy_s", "sched_s", "idle_s", "wall_s", "busy_frac",
+                  "io_s", "io_frac"]
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        w = csv.DictWriter(f, fieldnames=fieldnames)
+        w.writeheader()
+        for r in rows:
+            w.writerow({k: r.get(k, "") for k in fieldnames})
+
+
+def report_rank_timing(rows: List[Dict[str, Any]], schedule: str) -> None:
+    """Print per-rank busy/idle time plus a one-line load-balance summary (rank 0)."""
+    for r in rows:
+        print(
+            f"[rank 0] timing rank={r['rank']} n_rsn={r['n_rsn']} busy={r['busy_s']:.3f}s "
+            f"sched={r['sched_s']:.3f}s idle={r['idle_s']:.3f}s busy_frac={r['busy_frac']:.3f} "
+            f"io={r.get('io_s', np.nan):.3f}s io_frac={r.get('io_frac', np.nan):.3f}"
+        )
+    busy = np.asarray([r["busy_s"] for r in rows], dtype=float)
+    if busy.size and np.mean(busy) > 0:
+        print(
+            f"[rank 0] load balance ({schedule}): max/mean busy = {np.max(busy) / np.mean(busy):.3f}, "
+            f"wall = {max(r['wall_s'] for r in rows):.3f}s"
+        )
+    est = np.asarray([r.get("est_cost", np.nan) for r in rows], dtype=float)
+    if est.size and np.all(np.isfinite(est)) and np.mean(est) > 0:
+        print(f"[rank 0] predicted ({schedule}): max/mean est_cost = {np.max(est) / np.mean(est):.3f}")
+
+
+
+# ---------------------------
+# Checkpoint ledger (--checkpoint-every / --resume)
+# ---------------------------
+# Every rank periodically appends the RSNs it has finished, plus their packed result rows, to its own
+# <outdir>/<prefix>_ckpt/r<rank>_<run>_<seq>.npz (written to a temp file, then os.replace'd, so a
+# killed job never leaves a half-written chunk). --resume loads all chunks on rank 0, drops the RSNs
+# already processed from the work list, and folds the old rows back into the final outputs. RSNs whose
+# last attempt was skipped (missing dataset, read error, ...) are attempted again.
+# Reuse is decided per record, not per file: the ledger signature only holds the settings, and each
+# kept RSN's recorded mapped H1/H2 names, dataset paths, lengths and dt (read back from its log and
+# metrics rows) are compared with the current mapping CSV + HDF5 (revalidate_checkpoints()). RSNs that
+# are new, or whose entry changed, are processed; RSNs dropped from the flatfile are dropped from the
+# outputs; flatfile variables are re-attached from the current flatfile. So finished runs can leave
+# their ledger in place and a later --resume after adding RSNs to the flatfile/mapping/HDF5 only
+# processes the new ones. A record rewritten in place with the same name, length and dt is not detected.
+
+CKPT_TABLES = (
+    ("metrics_H1", RecordMetrics),
+    ("metrics_H2", RecordMetrics),
+    ("logs_H1", RecordLog),
+    ("logs_H2", RecordLog),
+    ("rotd", RotDRow),
+    ("psa", PSARow),
+)
+
+
+def checkpoint_dir(outdir: PathLike, prefix: str) -> Path:
+    return Path(outdir) / f"{prefix}_ckpt"
+
+
+def checkpoint_signature(args: argparse.Namespace, angles_deg: np.ndarray,
+                         psa: Optional[PSASettings] = None) -> Dict[str, Any]:
+    """Settings that must match for checkpointed rows to be reusable (inputs are checked per RSN)."""
+    sig = {
+        "compute_rotd": bool(args.compute_rotd),
+        "rotd_angles": [float(a) for a in angles_deg] if args.compute_rotd else [],
+        "compute_dtype": args.compute_dtype,
+    }
+    if psa is not None:
+        sig["psa"] = psa.signature()
+    return sig
+
+
+def prepare_checkpoint_dir(ckpt_dir: Path, signature: Dict[str, Any], *, resume: bool) -> None:
+    """Rank 0: create the ledger dir; wipe it for a fresh run, validate it for --resume."""
+    ckpt_dir.mkdir(parents=True, exist_ok=True)
+    sig_path = ckpt_dir / "ledger.json"
+    if resume and sig_path.exists():
+        old = json.loads(sig_path.read_text(encoding="utf-8"))
+        if old != signature:
+            raise RuntimeError(
+                f"--resume: checkpoint in {ckpt_dir} was written with different settings "
+                f"({old} vs {signature}); rerun without --resume to start over."
+            )
+        return
+    if not resume:
+        for p in ckpt_dir.glob("r*.npz"):
+            p.unlink()
+    with open(sig_path, "w", encoding="utf-8") as f:
+        json.dump(signature, f, indent=2)
+
+
+def _ckpt_record_keys(rows: Dict[str, List[Any]]) -> Dict[str, Tuple[Any, ...]]:
+    """rsn -> (mapped_h1, path_h1, npts_h1, mapped_h2, path_h2, npts_h2, dt) as recorded in ledger rows."""
+    logs = {(r.rsn, r.component): r for name in ("logs_H1", "logs_H2") for r in rows[name]}
+    mets = {(m.rec_id, m.component): m for name in ("metrics_H1", "metrics_H2") for m in rows[name]}
+    out: Dict[str, Tuple[Any, ...]] = {}
+    for rsn in {r for r, _ in logs}:
+        key: List[Any] = []
+        for comp in ("H1", "H2"):
+            lg, m = logs.get((rsn, comp)), mets.get((rsn, comp))
+            if lg is None or m is None:
+                break
+            key += [lg.mapped_name, lg.h5_dataset, int(m.npts)]
+        else:
+            out[rsn] = (*key, repr(float(m.dt)))
+    return out
+
+
+def revalidate_checkpoints(
+    h5: h5py.File,
+    done: set,
+    rows: Dict[str, List[Any]],
+    rsn_to_h1h2: Dict[str, Tuple[str, str]],
+    flat_meta: Dict[str, Dict[str, float]],
+    hdf5_label: str,
+) -> Tuple[set, Dict[str, List[Any]]]:
+    """
+    Rank 0, --resume: keep only finished RSNs that are still in the flatfile and whose mapped names,
+    dataset paths, lengths and dt (load_rsn_pair()'s H1-then-H2 choice) match the current
+    mapping CSV + HDF5. Kept metrics get the current flatfile variables and HDF5 label.
+    Returns (still-valid RSNs, their rows).
+    """
+    recorded = _ckpt_record_keys(rows)
+    cand = {r: rsn_to_h1h2[r] for r in done if r in flat_meta and r in rsn_to_h1h2 and r in recorded}
+    table = build_rsn_index(h5, cand)
+    valid = set()
+    for row in table.tolist():
+        rsn = str(row[0])
+        dt = row[4] if np.isfinite(row[4]) and row[4] > 0 else row[8]
+        dt = dt if np.isfinite(dt) and dt > 0 else np.nan
+        now = (row[1].decode("utf-8"), row[2].decode("utf-8"), int(row[3]),
+               row[5].decode("utf-8"), row[6].decode("utf-8"), int(row[7]), repr(float(dt)))
+        if now == recorded[rsn]:
+            valid.add(rsn)
+
+    def rsn_of(r: Any) -> str:
+        return r.rec_id if isinstance(r, RecordMetrics) else r.rsn
+
+    kept = {name: [r for r in lst if rsn_of(r) in valid] for name, lst in rows.items()}
+    paths = {(r.rsn, r.component): r.h5_dataset for name in ("logs_H1", "logs_H2") for r in kept[name]}
+    for name in ("metrics_H1", "metrics_H2"):
+        for m in kept[name]:
+            m.flat = dict(flat_meta[m.rec_id])
+            m.h5_ref = f"{hdf5_label}:{paths[(m.rec_id, m.component)]}"
+    return valid, kept
+
+
+def _ckpt_chunk_order(p: Path) -> Tuple[str, int, str]:
+    """r<rank>_<run>_<seq>.npz -> (run, seq, rank): chunks of later runs come last."""
+    rank, run, seq = p.stem.split("_")
+    return run, int(seq), rank
+
+
+def load_checkpoints(ckpt_dir: Path) -> Tuple[set, Dict[str, List[Any]]]:
+    """
+    Rank 0: read every ledger chunk -> (finished RSNs, previously computed rows per table).
+    Only the latest attempt of an RSN counts; RSNs whose latest attempt logged a skip are left
+    out of both, so --resume tries them again.
+    """
+    latest: Dict[str, int] = {}
+    tagged: Dict[str, List[Tuple[int, Any]]] = {name: [] for name, _ in CKPT_TABLES}
+    for k, p in enumerate(sorted(ckpt_dir.glob("r*.npz"), key=_ckpt_chunk_order)):
+        with np.load(p, allow_pickle=False) as z:
+            new = [str(r) for r in z["rsn_done"].tolist()]
+            if not new:
+                continue
+            latest.update(dict.fromkeys(new, k))
+            for name, cls in CKPT_TABLES:
+                if name in z.files:
+                    tagged[name].extend((k, row) for row in unpack_rows(z[name], cls))
+
+    def rsn_of(row: Any) -> str:
+        return row.rec_id if isinstance(row, RecordMetrics) else row.rsn
+
+    rows = {name: [row for k, row in lst if latest.get(rsn_of(row)) == k] for name, lst in tagged.items()}
+    retry = {r.rsn for name in ("logs_H1", "logs_H2") for r in rows[name] if r.status != "processed"}
+    rows = {name: [row for row in lst if rsn_of(row) not in retry] for name, lst in rows.items()}
+    return set(latest) - retry, rows
+
+
+class CheckpointLedger:
+    """
+    Per-rank append-only ledger. Call mark_done(rsn) after each RSN; every `every` RSNs the rows
+    produced since the previous flush are written as one npz chunk. every <= 0 disables it.
+    """
+
+    def __init__(
+        self,
+        ckpt_dir: Optional[Path],
+        *,
+        rank: int,
+        run_tag: str,
+        every: int,
+        my_metrics: Dict[str, list],
+        my_logs: Dict[str, list],
+        rotd_rows: List[RotDRow],
+        rotd_batcher: Optional[RotDBatcher] = None,
+        psa_rows: Optional[List[PSARow]] = None,
+    ):
+        self.ckpt_dir = ckpt_dir if every > 0 else None
+        self.rank = rank
+        self.run_tag = run_tag
+        self.every = int(every)
+        self.lists = {
+            "metrics_H1": my_metrics["H1"],
+            "metrics_H2": my_metrics["H2"],
+            "logs_H1": my_logs["H1"],
+            "logs_H2": my_logs["H2"],
+            "rotd": rotd_rows,
+            "psa": psa_rows if psa_rows is not None else [],
+        }
+        self.rotd_batcher = rotd_batcher
+        self.marks = {k: 0 for k in self.lists}
+        self.pending: List[str] = []
+        self.seq = 0
+
+    def mark_done(self, rsn: str) -> None:
+        if self.ckpt_dir is None:
+            return
+        self.pending.append(rsn)
+        if len(self.pending) >= self.every:
+            self.flush()
+
+    def flush(self) -> None:
+        if self.ckpt_dir is None or not self.pending:
+            return
+        # Deferred RotD rows must land in the same chunk as their RSN
+        if self.rotd_batcher is not None:
+            self.rotd_batcher.flush()
+
+        arrays: Dict[str, np.ndarray] = {"rsn_done": np.asarray(self.pending, dtype=np.int64)}
+        for name, cls in CKPT_TABLES:
+            lst = self.lists[name]
+            arrays[name] = pack_rows(lst[self.marks[name]:], cls)
+            self.marks[name] = len(lst)
+
+        final = self.ckpt_dir / f"r{self.rank:05d}_{self.run_tag}_{self.seq:05d}.npz"
+        tmp = final.with_suffix(".npz.tmp")
+        with open(tmp, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp, final)
+        self.seq += 1
+        self.pending = []
 
 
 # ---------------------------
@@ -1063,6 +3737,9 @@ def main() -> int:
     ap = argparse.ArgumentParser()
     ap.add_argument("--flatfile-xlsx", required=True, help="Flatfile .xlsx (filenames ignored).")
     ap.add_argument("--flatfile-sheet", default="", help="Optional sheet name (default: first sheet).")
+    ap.add_argument("--flatfile-cache", default="auto",
+                    help="Columnar cache of the parsed flatfile: 'auto' (<outdir>/<xlsx name>.flatcache.npz, "
+                         "rebuilt when the xlsx changes), 'off', or an explicit .npz path.")
     ap.add_argument("--filenames-csv", required=True, help="Filename-mapping CSV (use NGAFilename_H1/H2).")
     ap.add_argument("--hdf5", required=True, help="Merged TimeSeries HDF5 file")
 
@@ -1071,6 +3748,26 @@ def main() -> int:
 
     ap.add_argument("--compute-rotd", action="store_true", help="Compute RotD0/50/100 using H1+H2 rotations")
     ap.add_argument("--rotd-angle-step", type=float, default=1.0, help="Angle step in degrees (default 1 deg)")
+    ap.add_argument("--rotd-method", choices=list(ROTD_METHODS), default="brute",
+                    help="RotD engine: 'brute' rotates every sample; 'hull' rotates only samples on the "
+                         "convex hull of the (H1, H2) trajectory (much faster at fine angle steps).")
+    ap.add_argument("--rotd-validate", action="store_true",
+                    help="Also run the brute-force RotD for every record and report mismatches.")
+    ap.add_argument("--rotd-batch", type=int, default=32,
+                    help="Records per batched RotD pass for --rotd-method brute, grouped by length "
+                         "(default 32; 1 = one record at a time). Helps most for records of a few "
+                         f"thousand samples; records over {_ROTD_BATCH_MAX_NPTS} samples are never batched "
+                         f"and a batch is capped at {_ROTD_BATCH_MB:g} MB of stacked input.")
+    ap.add_argument("--rotd-mem-mb", type=float, default=ROTD_MEM_MB_DEFAULT,
+                    help=f"Scratch memory budget (MB) per RotD evaluation; rotations are blocked to fit "
+                         f"(default {ROTD_MEM_MB_DEFAULT:g}).")
+
+    ap.add_argument("--compute-psa", action="store_true",
+                    help="Compute pseudo-spectral acceleration for H1, H2 and RotD50 (angles from --rotd-angle-step).")
+    ap.add_argument("--periods", default="",
+                    help="Comma-separated PSA periods in seconds (default: 21 periods from 0.01 to 10 s).")
+    ap.add_argument("--psa-damping", type=float, default=PSA_DAMPING_DEFAULT,
+                    help=f"Oscillator damping ratio for --compute-psa (default {PSA_DAMPING_DEFAULT:g}).")
 
     ap.add_argument("--outdir", default=".", help="Directory to write all outputs (default: current dir)")
 
@@ -1100,10 +3797,99 @@ def main() -> int:
     ap.add_argument("--model-path", default="",
                     help="Optional output path for model artifact. If empty, uses <outdir>/<prefix>_model_<comp>.(json|joblib).")
 
-    
+    ap.add_argument("--ml-fit", choices=["gather", "allreduce"], default="gather",
+                    help="Where the ML regression is fit: 'gather' builds X on rank 0 from the gathered metrics "
+                         "(default); 'allreduce' has every rank build X for its own records and combines "
+                         "X^T X / X^T y with MPI reductions (coefficients match to round-off; no joblib model).")
+
+    ap.add_argument("--cv", type=int, default=0,
+                    help="k-fold cross-validation of the ML regression (k >= 2; default 0 = off). Fold and "
+                         "aggregate R^2 go to the report; the single --test-frac split is still fit/saved.")
+    ap.add_argument("--cv-repeats", type=int, default=1,
+                    help="Repeat --cv with this many different shuffles (default 1).")
+
+    ap.add_argument("--io-mode", choices=list(H5_IO_MODES), default="default",
+                    help="How ranks open the HDF5: 'default' (plain h5py), 'tuned' (bigger chunk cache + page "
+                         "buffer for paged files), 'mpio' (tuned + MPI-IO driver; needs MPI-enabled h5py).")
+    ap.add_argument("--h5-rdcc-mb", type=float, default=64.0,
+                    help="Raw-data chunk cache per open file for --io-mode tuned/mpio (default 64 MB).")
+    ap.add_argument("--h5-page-buf-mb", type=float, default=0.0,
+                    help="HDF5 page buffer for --io-mode tuned/mpio; only for files written with a paged "
+                         "file-space strategy (default 0 = off).")
+    ap.add_argument("--prefetch", type=int, default=0,
+                    help="Hint the OS to read ahead the next N records' datasets (posix_fadvise; default 0 = off).")
+
+    ap.add_argument("--compute-dtype", choices=list(COMPUTE_DTYPES), default="float64",
+                    help="Array dtype for loads and RotD: 'float64' upcasts every record (default), 'native' "
+                         "keeps float32/float64 as stored, 'float32' always uses float32. With 'native' the "
+                         "per-component metrics are unchanged; float32 RotD rotations round differently "
+                         "(see --dtype-check).")
+    ap.add_argument("--dtype-check", action="store_true",
+                    help="With a non-float64 --compute-dtype, also read every record in float64, recompute "
+                         "the per-component metrics (and RotD) and report the max relative difference per column.")
+
+    ap.add_argument("--read-ahead", type=int, default=0,
+                    help="Read the next N records on a background thread into reusable buffers while the "
+                         "current one is computed (default 0 = read inline). With --io-mode mpio this needs "
+                         "MPI_THREAD_MULTIPLE and is disabled otherwise.")
+
+    ap.add_argument("--rsn-index", default="",
+                    help="Use a precomputed RSN->dataset index instead of probing the HDF5 per record: "
+                         "'auto' (sidecar <hdf5>.rsnindex.npz), 'embedded' (/_rsn_index inside the HDF5) "
+                         "or an explicit .npz path. Empty disables. An embedded index is checked per record "
+                         "(stale entries are re-probed); writing it changes the HDF5 size/mtime, which "
+                         "invalidates --cache-dir entries and --resume checkpoints for that file.")
+    ap.add_argument("--build-rsn-index", action="store_true",
+                    help="Build the --rsn-index (default 'auto') from the mapping CSV + HDF5, write it, and exit.")
+
+    ap.add_argument("--cache-dir", default="",
+                    help="Persistent per-RSN result cache (metrics + RotD rows). Reruns that only change "
+                         "ML options reuse it and skip the HDF5 pass. Empty disables.")
+    ap.add_argument("--cache-max-mb", type=float, default=1024.0,
+                    help="Evict least-recently-used cache entries above this size (default 1024; 0 = unbounded).")
+
+    ap.add_argument("--meta-share", choices=["node", "bcast"], default="node",
+                    help="Flatfile/mapping tables after rank 0 loads them: 'node' keeps one read-only copy per "
+                         "node in MPI shared memory (default); 'bcast' gives every rank its own copy.")
+
+    ap.add_argument("--checkpoint-every", type=int, default=0,
+                    help="Each rank flushes finished RSNs + their rows to <outdir>/<prefix>_ckpt every N RSNs "
+                         "(default 0 = off). Needed for --resume.")
+    ap.add_argument("--resume", action="store_true",
+                    help="Skip RSNs already processed in <prefix>_ckpt and merge their rows into the outputs. "
+                         "Checked per RSN: RSNs that are new in the flatfile/mapping/HDF5, whose mapped names or "
+                         "datasets (path, length, dt) changed, or that were skipped last time are processed.")
+
+    ap.add_argument("--output-format", choices=list(OUTPUT_FORMATS), default="csv",
+                    help="'csv' gathers everything to rank 0 (default); 'hdf5' writes one shared HDF5 "
+                         "file with MPI-IO (or per-rank HDF5 shards if h5py lacks MPI); 'parquet' writes "
+                         "per-rank Parquet shards (needs pyarrow). Non-csv formats add <prefix>_manifest.json.")
+
+    ap.add_argument("--schedule", choices=["static", "dynamic"], default="static",
+                    help="RSN work distribution: 'static' pre-splits indices evenly across ranks; "
+                         "'dynamic' hands out batches on demand from a shared MPI RMA counter.")
+    ap.add_argument("--batch-size", type=int, default=8,
+                    help="RSNs per request for --schedule dynamic (default 8).")
+    ap.add_argument("--partition", choices=["count", "npts", "cost-model"], default="count",
+                    help="How --schedule static balances ranks: 'count' splits RSNs evenly (np.array_split); "
+                         "'npts' balances total samples (npts x 2 x RotD angles); "
+                         "'cost-model' adds per-record overhead. Shapes are read from HDF5 metadata only.")
+
+
     args = ap.parse_args()
+    if args.cv == 1 or args.cv < 0 or args.cv_repeats < 1:
+        ap.error("--cv must be 0 (off) or >= 2, and --cv-repeats >= 1")
 
     angles_deg = np.arange(0.0, 180.0, args.rotd_angle_step, dtype=float)
+    psa = None
+    if args.compute_psa:
+        if not 0.0 < args.psa_damping < 1.0:
+            ap.error("--psa-damping must be in (0, 1)")
+        try:
+            periods = parse_periods(args.periods)
+        except ValueError as e:
+            ap.error(f"--periods: {e}")
+        psa = PSASettings(periods, angles_deg, damping=args.psa_damping, mem_budget_mb=args.rotd_mem_mb)
 
     # print('args.flatfile_xlsx',args.flatfile_xlsx)
     # print('args.filenames_csv',args.filenames_csv)
@@ -1116,181 +3902,357 @@ def main() -> int:
     rank = comm.Get_rank()
     size = comm.Get_size()
 
+    if args.output_format == "parquet":
+        try:
+            import pyarrow.parquet  # type: ignore  # noqa: F401
+        except Exception as e:
+            raise RuntimeError(f"--output-format parquet needs pyarrow: {e}")
 
     outdir = None
     if rank == 0:
         outdir = Path(args.outdir).expanduser().resolve()
         outdir.mkdir(parents=True, exist_ok=True)
     outdir = comm.bcast(outdir, root=0)
-    
+
+    ckpt_dir = checkpoint_dir(outdir, args.out_prefix)
+    run_tag = None
+    ckpt_err = None
+    if rank == 0:
+        if (args.checkpoint_every > 0 or args.resume) and not args.build_rsn_index:
+            try:
+                prepare_checkpoint_dir(ckpt_dir, checkpoint_signature(args, angles_deg, psa), resume=args.resume)
+            except Exception as e:
+                ckpt_err = str(e)
+        run_tag = time.strftime("%Y%m%dT%H%M%S")
+    run_tag, ckpt_err = comm.bcast((run_tag, ckpt_err), root=0)
+    if ckpt_err is not None:
+        # raise on every rank, not just rank 0, so the others do not wait in the next collective
+        raise RuntimeError(ckpt_err)
 
     if rank == 0:
-        flat_rows = load_flatfile_xlsx_rows(args.flatfile_xlsx, sheet=(args.flatfile_sheet or None))
-        flat_meta = build_flat_metadata_map(flat_rows)  # rsn -> dict of flatfile variables (no DT)
+        # rsn -> dict of flatfile variables (no DT)
+        flat_meta = load_flat_metadata(args.flatfile_xlsx, sheet=(args.flatfile_sheet or None),
+                                       cache=args.flatfile_cache, outdir=outdir)
 
 
         rsn_to_h1h2 = load_rsn_to_h1h2_dataset_names(args.filenames_csv)
 
+        index_table = None
+        if args.build_rsn_index:
+            with h5py.File(args.hdf5, "r") as h5:
+                index_table = build_rsn_index(h5, rsn_to_h1h2)
+            where = write_rsn_index(index_table, args.hdf5, args.rsn_index or "auto")
+            print(f"[rank 0] wrote RSN index ({index_table.size} RSNs): {where}")
+            if args.rsn_index == "embedded":
+                print("[rank 0] note: embedding changed the HDF5 size/mtime; existing --cache-dir entries "
+                      "and --resume checkpoints for it will not be reused")
+        elif args.rsn_index:
+            index_table = load_rsn_index(args.hdf5, args.rsn_index)
+
         # Attempt RSNs from flatfile (so we have Mw/Vs30/Dist)
         rsn_list = sorted(flat_meta.keys(), key=lambda s: int(s))
         if args.limit > 0:
             rsn_list = rsn_list[: args.limit]
 
+        prior_rows = None
+        if args.resume:
+            done, prior_rows = load_checkpoints(ckpt_dir)
+            n_ledger = len(done)
+            with h5py.File(args.hdf5, "r") as h5:
+                done, prior_rows = revalidate_checkpoints(h5, done & set(rsn_list), prior_rows, rsn_to_h1h2,
+                                                          flat_meta, args.hdf5)
+            n_before = len(rsn_list)
+            rsn_list = [r for r in rsn_list if r not in done]
+            print(f"[rank 0] resume: {len(done)} of {n_ledger} RSNs in {ckpt_dir.name} still valid, "
+                  f"{len(rsn_list)} of {n_before} to process (new, changed or skipped earlier)")
+
         n_total = len(rsn_list)
     else:
+        prior_rows = None
+        index_table = None
         flat_meta = None
         rsn_to_h1h2 = None
         rsn_list = None
         n_total = None
 
     n_total = comm.bcast(n_total, root=0)
-    flat_meta = comm.bcast(flat_meta, root=0)
-    rsn_to_h1h2 = comm.bcast(rsn_to_h1h2, root=0)
-    rsn_list = comm.bcast(rsn_list, root=0)
-
-    if rank == 0:
-        indices = np.arange(n_total, dtype=int)
-        chunks = np.array_split(indices, size)
-        chunks_list = [c.tolist() for c in chunks]
-    else:
-        chunks_list = None
-
-    my_idx: List[int] = comm.scatter(chunks_list, root=0)
+    sharer = NodeShared(comm) if args.meta_share == "node" else None
+    flat_meta = FlatMetaTable.bcast(comm, FlatMetaTable.from_dict(flat_meta) if rank == 0 else None, share=sharer)
+    rsn_to_h1h2 = H1H2Table.bcast(comm, H1H2Table.from_dict(rsn_to_h1h2) if rank == 0 else None, share=sharer)
+    rsn_send = _rsn_ints(rsn_list) if rank == 0 else None
+    rsn_list = RSNStrings(sharer.share(rsn_send) if sharer is not None else bcast_array(comm, rsn_send))
+
+    if args.build_rsn_index:
+        if sharer is not None:
+            sharer.free()
+        return 0
+    index_table = sharer.share(index_table) if sharer is not None else bcast_array(comm, index_table)
+    rsn_index = RSNIndex(index_table, verify=args.rsn_index == "embedded") if index_table is not None else None
 
     # We output separate metrics/logs for H1 and H2
     my_metrics = {"H1": [], "H2": []}   # type: ignore[var-annotated]
     my_logs = {"H1": [], "H2": []}      # type: ignore[var-annotated]
 
     rotd_rows_local: List[RotDRow] = []
-
-
-    with h5py.File(args.hdf5, "r") as h5:
-        for ii in my_idx:
+    psa_rows_local: List[PSARow] = []
+
+    timing = {"busy_s": 0.0, "sched_s": 0.0, "idle_s": 0.0, "wall_s": 0.0, "io_s": 0.0}
+    rotd_check = {"checked": 0, "mismatch": 0} if (args.compute_rotd and args.rotd_validate) else None
+    dtype_check = new_dtype_check() if args.dtype_check else None
+    rotd_batcher = None
+    if args.compute_rotd and args.rotd_method == "brute" and args.rotd_batch > 1:
+        rotd_batcher = RotDBatcher(rotd_rows_local, angles_deg, batch=args.rotd_batch,
+                                   mem_budget_mb=args.rotd_mem_mb)
+    ledger = CheckpointLedger(ckpt_dir, rank=rank, run_tag=run_tag, every=args.checkpoint_every,
+                              my_metrics=my_metrics, my_logs=my_logs, rotd_rows=rotd_rows_local,
+                              rotd_batcher=rotd_batcher, psa_rows=psa_rows_local)
+    n_done = 0
+
+    cache = None
+    h5_id = None
+    if args.cache_dir:
+        cache = ResultCache(Path(args.cache_dir).expanduser(), rank=rank,
+                            flush_every=args.checkpoint_every or RESULT_CACHE_FLUSH_EVERY)
+        h5_id = hdf5_file_identity(args.hdf5)
+
+    costs = None
+    if args.schedule == "static" and args.partition != "count" and rank == 0:
+        npts = rsn_index.npts(rsn_list, rsn_to_h1h2) if rsn_index is not None else None
+        if npts is None:
+            with h5py.File(args.hdf5, "r") as h5:
+                npts = read_rsn_npts(h5, rsn_list, rsn_to_h1h2)
+        costs = estimate_rsn_costs(npts, mode=args.partition,
+                                   n_angles=len(angles_deg) if args.compute_rotd else 0)
+
+    counter = None
+    if args.schedule == "dynamic":
+        counter = SharedCounter(comm)
+        work = iter_dynamic_indices(counter, n_total, args.batch_size, timing)
+    else:
+        work = iter_static_indices(comm, n_total, costs, timing)
+
+    def _open_h5() -> h5py.File:
+        return open_records_h5(args.hdf5, io_mode=args.io_mode, comm=comm,
+                               rdcc_mb=args.h5_rdcc_mb, page_buf_mb=args.h5_page_buf_mb)
+
+    def _pair(r: str) -> Optional[Tuple[str, str]]:
+        return (rsn_to_h1h2 or {}).get(r, None)  # type: ignore[union-attr]
+
+    def _key(r: str) -> Optional[str]:
+        if cache is None:
+            return None
+        return rsn_cache_key(h5_id, r, _pair(r), hdf5_label=args.hdf5, compute_rotd=args.compute_rotd,
+                             angles_deg=angles_deg, compute_dtype=args.compute_dtype, psa=psa)
+
+    read_ahead = args.read_ahead
+    # mpio reads are MPI calls made on the reader thread, concurrently with the main thread's
+    need = MPI.THREAD_MULTIPLE if args.io_mode == "mpio" else MPI.THREAD_FUNNELED
+    if read_ahead > 0 and MPI.Query_thread() < need:
+        if rank == 0:
+            level = "MPI_THREAD_MULTIPLE" if need == MPI.THREAD_MULTIPLE else "thread support"
+            print(f"[rank 0] WARNING: MPI was initialized without {level}; --read-ahead disabled")
+        read_ahead = 0
+
+    t_start = time.perf_counter()
+    h5 = None  # opened on the first cache miss only (collectively up front for mpio)
+    prefetcher = None
+    reader = None
+    if args.io_mode == "mpio":
+        h5 = _open_h5()
+    try:
+        for ii, upcoming in iter_lookahead(work, max(args.prefetch, read_ahead)):
+            t0 = time.perf_counter()
             rsn = rsn_list[ii]
-            flat_vars = flat_meta[rsn]  # dict of variables from flatfile
-
-            # Rule: only skip RSN if H1 or H2 are missing (or missing in mapping)
-            pair = (rsn_to_h1h2 or {}).get(rsn, None)  # type: ignore[union-attr]
-            if pair is None:
-                # Log skip for both
-                for comp in ("H1", "H2"):
-                    my_logs[comp].append(
-                        RecordLog(rsn=rsn, component=comp, mapped_name="", h5_dataset="",
-                                  status="skipped", reason="missing_h1h2_mapping_for_rsn")
-                    )
-                continue
-
-            mapped_h1, mapped_h2 = pair
-
-            # Find datasets for BOTH. If either missing, skip RSN (both comps)
-            dspath_h1 = _find_dataset_path(h5, rsn, mapped_h1)
-            dspath_h2 = _find_dataset_path(h5, rsn, mapped_h2)
-
-            if dspath_h1 is None or dspath_h2 is None:
-                # Log separately with precise reason
-                if dspath_h1 is None:
-                    my_logs["H1"].append(
-                        RecordLog(rsn=rsn, component="H1", mapped_name=mapped_h1, h5_dataset="",
-                                  status="skipped", reason="h1_dataset_not_found_in_hdf5")
-                    )
-                else:
-                    my_logs["H1"].append(
-                        RecordLog(rsn=rsn, component="H1", mapped_name=mapped_h1, h5_dataset=dspath_h1,
-                                  status="skipped", reason="skipped_because_h2_missing")
-                    )
-
-                if dspath_h2 is None:
-                    my_logs["H2"].append(
-                        RecordLog(rsn=rsn, component="H2", mapped_name=mapped_h2, h5_dataset="",
-                                  status="skipped", reason="h2_dataset_not_found_in_hdf5")
-                    )
-                else:
-                    my_logs["H2"].append(
-                        RecordLog(rsn=rsn, component="H2", mapped_name=mapped_h2, h5_dataset=dspath_h2,
-                                  status="skipped", reason="skipped_because_h1_missing")
-                    )
-                continue
-
-            # If we get here: BOTH datasets exist -> process both
-            
-            ds1 = h5[dspath_h1]
-            ds2 = h5[dspath_h2]
-            
-            # Prefer dtHeader from H1; fallback to H2; fallback to flatfile dt
-            dt1 = _get_dt_from_dataset(ds1)
-            dt2 = _get_dt_from_dataset(ds2)
-            
-            dt_use = dt1
-            if not (np.isfinite(dt_use) and dt_use > 0):
-                dt_use = dt2
-            # no flatfile DT fallback
-            if not (np.isfinite(dt_use) and dt_use > 0):
-                dt_use = np.nan
-
-
-            
-            a1 = a2 = None
-            ok_a1 = ok_a2 = False
-            
-            # H1
-            try:
-                a1 = np.asarray(ds1, dtype=float).ravel()
-                ok_a1 = True
-                h5_ref1 = f"{args.hdf5}:{dspath_h1}"
-                m1 = _metrics_from_array(rsn, "H1", h5_ref1, a1, dt_use, flat_vars)
-                my_metrics["H1"].append(m1)
-                my_logs["H1"].append(
-                    RecordLog(rsn=rsn, component="H1", mapped_name=mapped_h1, h5_dataset=dspath_h1,
-                              status="processed", reason="")
-                )
-            except Exception as e:
-                my_logs["H1"].append(
-                    RecordLog(rsn=rsn, component="H1", mapped_name=mapped_h1, h5_dataset=dspath_h1,
-                              status="skipped", reason=f"h1_read_or_compute_error:{e}")
+            pair = _pair(rsn)
+            key = _key(rsn)
+            hit = False
+            if key is not None and not (reader is not None and reader.is_submitted(rsn)):
+                hit = cache.apply(key, flat_meta[rsn], my_metrics, my_logs, rotd_rows_local,
+                                  psa_rows_local if psa is not None else None)
+            if not hit:
+                if h5 is None:
+                    h5 = _open_h5()
+                if prefetcher is None and h5 is not None:
+                    prefetcher = RecordPrefetcher(h5, depth=args.prefetch, rsn_index=rsn_index)
+                    if read_ahead > 0:
+                        reader = RecordReader(h5, depth=read_ahead, rsn_index=rsn_index,
+                                              compute_dtype=args.compute_dtype,
+                                              ref_float64=dtype_check is not None)
+
+                # Queue the next records on the reader thread before computing this one
+                t_io = time.perf_counter()
+                for jj in upcoming[:args.prefetch]:
+                    prefetcher.advise(rsn_list[jj], _pair(rsn_list[jj]))
+                if reader is not None:
+                    reader.submit(rsn, pair)  # no-op unless this is the first record (or a cache-skip gap)
+                    for jj in upcoming[:read_ahead]:
+                        kj = _key(rsn_list[jj])
+                        if kj is None or not cache.contains(kj):
+                            reader.submit(rsn_list[jj], _pair(rsn_list[jj]))
+                timing["io_s"] += time.perf_counter() - t_io
+
+                marks = {f"{t}_{c}": len(d[c]) for t, d in (("metrics", my_metrics), ("logs", my_logs))
+                         for c in ("H1", "H2")}
+                marks["psa"] = len(psa_rows_local)
+                rotd_kw = dict(
+                    hdf5_label=args.hdf5,
+                    compute_rotd=args.compute_rotd,
+                    angles_deg=angles_deg,
+                    rotd_mem_mb=args.rotd_mem_mb,
+                    rotd_method=args.rotd_method,
+                    rotd_check=rotd_check,
+                    rotd_batcher=rotd_batcher,
+                    dtype_check=dtype_check,
+                    psa=psa,
+                    psa_rows=psa_rows_local,
+                    my_metrics=my_metrics,
+                    my_logs=my_logs,
+                    rotd_rows=rotd_rows_local,
                 )
-            
-            # H2
-            try:
-                a2 = np.asarray(ds2, dtype=float).ravel()
-                ok_a2 = True
-                h5_ref2 = f"{args.hdf5}:{dspath_h2}"
-                m2 = _metrics_from_array(rsn, "H2", h5_ref2, a2, dt_use, flat_vars)
-                my_metrics["H2"].append(m2)
-                my_logs["H2"].append(
-                    RecordLog(rsn=rsn, component="H2", mapped_name=mapped_h2, h5_dataset=dspath_h2,
-                              status="processed", reason="")
-                )
-            except Exception as e:
-                my_logs["H2"].append(
-                    RecordLog(rsn=rsn, component="H2", mapped_name=mapped_h2, h5_dataset=dspath_h2,
-                              status="skipped", reason=f"h2_read_or_compute_error:{e}")
-                )
-            
-            # RotD (only if BOTH arrays exist)
-            if args.compute_rotd and ok_a1 and ok_a2:
-                rr = compute_rotd_summaries(a1, a2, dt_use, angles_deg)
-                for row in rr:
-                    row.rsn = rsn
-                    rotd_rows_local.append(row)
-
-
-
-
-    # Gather
-    all_metrics_h1 = comm.gather(my_metrics["H1"], root=0)
-    all_metrics_h2 = comm.gather(my_metrics["H2"], root=0)
-    all_logs_h1 = comm.gather(my_logs["H1"], root=0)
-    all_logs_h2 = comm.gather(my_logs["H2"], root=0)
-    all_rotd = comm.gather(rotd_rows_local, root=0)
+                if reader is not None:
+                    t_io = time.perf_counter()
+                    load = reader.get(rsn, pair)
+                    timing["io_s"] += time.perf_counter() - t_io
+                    try:
+                        process_loaded_rsn(load, flat_meta[rsn], **rotd_kw)  # type: ignore[index]
+                    finally:
+                        reader.release(load)
+                else:
+                    process_rsn(h5, rsn, flat_meta[rsn], pair, rsn_index=rsn_index,  # type: ignore[index]
+                                io_stats=timing, compute_dtype=args.compute_dtype, **rotd_kw)
+                if key is not None:
+                    cache.remember(key, rsn, my_metrics, my_logs, marks,
+                                   psa_rows_local if psa is not None else None)
+                    if cache.full:
+                        if rotd_batcher is not None:
+                            rotd_batcher.flush()
+                        cache.store_pending(rotd_rows_local)
+            ledger.mark_done(rsn)
+            timing["busy_s"] += time.perf_counter() - t0
+            n_done += 1
+
+        t0 = time.perf_counter()
+        if rotd_batcher is not None:
+            rotd_batcher.flush()
+        ledger.flush()
+        if cache is not None:
+            cache.store_pending(rotd_rows_local)
+        timing["busy_s"] += time.perf_counter() - t0
+    finally:
+        if reader is not None:
+            reader.close()
+        if h5 is not None:
+            h5.close()
+
+    # Time spent waiting for the slowest rank counts as idle
+    t0 = time.perf_counter()
+    comm.Barrier()
+    timing["wall_s"] = time.perf_counter() - t_start
+    timing["idle_s"] = timing["sched_s"] + (time.perf_counter() - t0)
+    if counter is not None:
+        counter.free()
+    if sharer is not None:
+        # nothing below reads the shared metadata; drop the views before the windows go away
+        del flat_meta, rsn_to_h1h2, rsn_list, rsn_index, prefetcher, reader
+        sharer.free()
+
+    timing_row = dict(timing, rank=rank, n_rsn=n_done,
+                      busy_frac=(timing["busy_s"] / timing["wall_s"]) if timing["wall_s"] > 0 else np.nan,
+                      io_frac=(timing["io_s"] / timing["wall_s"]) if timing["wall_s"] > 0 else np.nan)
+    all_timing = comm.gather(timing_row, root=0)
+
+    if cache is not None:
+        n_hits = comm.reduce(cache.hits, op=MPI.SUM, root=0)
+        n_misses = comm.reduce(cache.misses, op=MPI.SUM, root=0)
+        if rank == 0:
+            n_evicted, left = evict_result_cache(cache.root, args.cache_max_mb)
+            print(f"[rank 0] cache {cache.root}: hits={n_hits} misses={n_misses} "
+                  f"evicted={n_evicted} size={left / 1e6:.1f} MB")
+
+    if dtype_check is not None:
+        all_checks = comm.gather(dtype_check, root=0)
+        if rank == 0:
+            d = merge_dtype_checks(all_checks)
+            rel = " ".join(f"{f}={d['metric_' + f]:.3g}" for f in METRIC_VALUE_FIELDS)
+            print(f"[rank 0] dtype-check ({args.compute_dtype} vs float64 metrics): components={d['components']} "
+                  f"max_rel {rel} peaks_moved={d['peak_moved']}")
+            if args.compute_rotd:
+                rel = " ".join(f"{f}={d[f]:.3g}" for f in ROTD_VALUE_FIELDS)
+                print(f"[rank 0] dtype-check ({args.compute_dtype} vs float64 RotD): records={d['records']} "
+                      f"max_rel {rel} rows_with_angle_changed={d['angle_changed']}")
+
+    if rotd_check is not None:
+        n_checked = comm.reduce(rotd_check["checked"], op=MPI.SUM, root=0)
+        n_mismatch = comm.reduce(rotd_check["mismatch"], op=MPI.SUM, root=0)
+        if rank == 0:
+            print(f"[rank 0] rotd-validate ({args.rotd_method} vs brute): "
+                  f"checked={n_checked} mismatched={n_mismatch}")
+
+    # Rows finished by earlier (checkpointed) runs re-enter the outputs through rank 0
+    if prior_rows is not None:
+        my_metrics["H1"].extend(prior_rows["metrics_H1"])
+        my_metrics["H2"].extend(prior_rows["metrics_H2"])
+        my_logs["H1"].extend(prior_rows["logs_H1"])
+        my_logs["H2"].extend(prior_rows["logs_H2"])
+        rotd_rows_local.extend(prior_rows["rotd"])
+        psa_rows_local.extend(prior_rows["psa"])
+        del prior_rows
+
+    # Pack results into columnar tables (same dtype on every rank)
+    packed = {
+        "metrics_H1": pack_rows_global(comm, my_metrics["H1"], RecordMetrics),
+        "metrics_H2": pack_rows_global(comm, my_metrics["H2"], RecordMetrics),
+        "logs_H1": pack_rows_global(comm, my_logs["H1"], RecordLog),
+        "logs_H2": pack_rows_global(comm, my_logs["H2"], RecordLog),
+    }
+    if args.compute_rotd:
+        packed["rotd"] = pack_rows_global(comm, rotd_rows_local, RotDRow)
+    if psa is not None:
+        packed["psa"] = pack_rows_global(comm, psa_rows_local, PSARow)
+    del my_metrics, my_logs, rotd_rows_local, psa_rows_local
+
+    # Attempted/processed accounting per component (no need to gather the logs for this)
+    log_counts = {}
+    for comp in ("H1", "H2"):
+        lt = packed[f"logs_{comp}"]
+        local = np.array([lt.size, np.count_nonzero(lt["status"] == b"processed")], dtype=np.int64)
+        total = np.zeros_like(local)
+        comm.Reduce(local, total, op=MPI.SUM, root=0)
+        log_counts[comp] = total
+
+    ml_kw = dict(mode=args.ml_missing, max_abs_amp=float(args.max_abs_amp), test_frac=float(args.test_frac),
+                 seed=int(args.seed), want_preds=bool(args.write_preds),
+                 cv=int(args.cv), cv_repeats=int(args.cv_repeats))
+    ml_fits: Dict[str, Optional[MLFit]] = {}
+    if args.ml_fit == "allreduce":
+        # Collective: each rank contributes sufficient statistics of its own rows
+        for comp in ("H1", "H2"):
+            ml_fits[comp] = fit_ml_allreduce(comm, packed[f"metrics_{comp}"], **ml_kw)
+
+    if args.output_format == "csv":
+        # Gather (columnar: fixed-dtype structured arrays + Gatherv, no per-object pickling)
+        tables = {name: gatherv_table(comm, t) for name, t in packed.items()}
+        manifest_path = None
+    else:
+        # Every rank writes its own rows; rank 0 only gathers what a gather-mode ML fit needs
+        manifest_path = write_result_shards(comm, packed, fmt=args.output_format,
+                                            outdir=Path(outdir), prefix=args.out_prefix)
+        tables = {}
+        if args.ml_fit == "gather":
+            tables = {name: gatherv_table(comm, packed[name]) for name in ("metrics_H1", "metrics_H2")}
+    del packed
 
 
     if rank == 0:
-        for comp, gathered_metrics, gathered_logs in [
-            ("H1", all_metrics_h1, all_logs_h1),
-            ("H2", all_metrics_h2, all_logs_h2),
-        ]:
-            metrics = [m for sub in gathered_metrics for m in sub]
-            logs = [l for sub in gathered_logs for l in sub]
+        report_rank_timing(all_timing, args.schedule if args.schedule == "dynamic" else f"static/{args.partition}")
+        out_timing = outpath(resolve_outdir(args.outdir), args.out_prefix, "rank_timing", ".csv")
+        write_rank_timing_csv(str(out_timing), all_timing)
+        print(f"[rank 0] wrote: {out_timing}")
+
+        for comp in ("H1", "H2"):
+            # Restore flatfile RSN order regardless of which rank processed what
+            if f"metrics_{comp}" in tables:
+                metrics_tab = sort_table_by_rsn(tables[f"metrics_{comp}"], "rec_id")
 
 
             # rank 0
@@ -1304,68 +4266,25 @@ def main() -> int:
             
 
 
-            write_metrics_csv(str(out_metrics), metrics)
-            write_logs_csv(str(out_processed), [l for l in logs if l.status == "processed"])
-            write_logs_csv(str(out_skipped), [l for l in logs if l.status == "skipped"])
-            
-
+            if manifest_path is None:
+                logs_tab = sort_table_by_rsn(tables[f"logs_{comp}"], "rsn")
+                is_processed = logs_tab["status"] == b"processed"
+                write_metrics_table_csv(str(out_metrics), metrics_tab)
+                write_table_csv(str(out_processed), logs_tab[is_processed])
+                write_table_csv(str(out_skipped), logs_tab[~is_processed])
 
             # train/test + save-model + write-preds block
             # --- ML build (screen outliers ONLY for ML) ---
-            X, y, feat_names, ids_used, info = make_features_with_ids(
-                metrics,
-                mode=args.ml_missing,
-                max_abs_amp=float(args.max_abs_amp),
-            )
-
-            # ML split
-            test_mask = _train_test_split_mask(X.shape[0], test_frac=float(args.test_frac), seed=int(args.seed))
-            train_mask = ~test_mask
-
-            report = {
-                "r2_train": np.nan,
-                "r2_test": np.nan,
-                "n_candidates": int(info.candidates),
-                "n_used": int(info.used),
-                "dropped_missing": int(info.dropped_missing),
-                "dropped_outlier": int(info.dropped_outlier),
-                "mode": str(args.ml_missing),
-                "max_abs_amp": float(args.max_abs_amp),
-                "test_frac": float(args.test_frac),
-                "seed": int(args.seed),
-            }
-
-            model_obj = None
-            coef = None
-
-            if X.shape[0] >= (X.shape[1] + 2) and np.sum(train_mask) >= (X.shape[1] + 2):
-                Xtr, ytr = X[train_mask], y[train_mask]
-                Xte, yte = X[test_mask], y[test_mask]
-
-                model_obj, coef = fit_linear_model(Xtr, ytr)
-                yhat_tr = Xtr @ coef
-                yhat_te = Xte @ coef if Xte.size else np.array([], dtype=float)
-
-                report["r2_train"] = float(r2_score(ytr, yhat_tr))
-                report["r2_test"] = float(r2_score(yte, yhat_te)) if Xte.size else np.nan
-            else:
-                # not enough rows to fit
-                coef = np.full((X.shape[1],), np.nan, dtype=float)
+            fit = ml_fits.get(comp) or fit_ml_gathered(metrics_tab, **ml_kw)
+            feat_names, coef, model_obj, report, info = fit.feature_names, fit.coef, fit.model, fit.report, fit.info
 
             # --- optional: write predictions ---
-            if args.write_preds and X.shape[0] > 0 and coef is not None and np.all(np.isfinite(coef)):
-                yhat_all = X @ coef
-                rows_out: List[Dict[str, Any]] = []
-                for i in range(X.shape[0]):
-                    split = "test" if bool(test_mask[i]) else "train"
-                    rows_out.append({
-                        "rec_id": ids_used[i],
-                        "component": comp,
-                        "split": split,
-                        "y": float(y[i]),
-                        "yhat": float(yhat_all[i]),
-                        "resid": float(y[i] - yhat_all[i]),
-                    })
+            if fit.preds is not None:
+                rows_out: List[Dict[str, Any]] = [
+                    {"rec_id": rid.decode("utf-8"), "component": comp, "split": sp.decode("utf-8"),
+                     "y": yv, "yhat": yh, "resid": rs}
+                    for rid, sp, yv, yh, rs in fit.preds.tolist()
+                ]
                 out_preds = outpath(outdir, args.out_prefix, f"ml_preds_{comp}", ".csv")
                 write_preds_csv(str(out_preds), rows_out)
                 print(f"[rank 0] wrote: {out_preds}")
@@ -1396,7 +4315,8 @@ def main() -> int:
                     print(f"[rank 0] wrote model: {model_path}")
                 elif args.save_model == "joblib":
                     if model_obj is None:
-                        raise RuntimeError("Requested joblib model save, but sklearn model object not available (fallback lstsq used). Use --save-model json.")
+                        raise RuntimeError("Requested joblib model save, but sklearn model object not available "
+                                           "(fallback lstsq or --ml-fit allreduce used). Use --save-model json.")
                     save_model_joblib(model_path, model_obj, meta=meta)
                     print(f"[rank 0] wrote model: {model_path}")
 
@@ -1417,37 +4337,43 @@ def main() -> int:
 
 
 
-            attempted = len(logs)
-            processed = len([l for l in logs if l.status == "processed"])
+            attempted = int(log_counts[comp][0])
+            processed = int(log_counts[comp][1])
             skipped = attempted - processed
-            
-            attempted_rsn = len(set(l.rsn for l in logs))
-            processed_rsn = len(set(l.rsn for l in logs if l.status == "processed"))
-            skipped_rsn = attempted_rsn - processed_rsn
 
             # write_report_txt(out_report, attempted, processed, skipped, X.shape[0], report)
-            write_report_txt(str(out_report), attempted, processed, skipped, X.shape[0], report, unit_label="component-rows")
+            write_report_txt(str(out_report), attempted, processed, skipped, info.used, report, unit_label="component-rows")
 
             print(
                 f"[rank 0] {comp}: attempted={attempted} processed={processed} skipped={skipped} "
-                f"train_rows={X.shape[0]} R2_train={report.get('r2_train', np.nan):.3g} "
+                f"train_rows={info.used} R2_train={report.get('r2_train', np.nan):.3g} "
                 f"R2_test={report.get('r2_test', np.nan):.3g}"
             )
+            if "cv_k" in report:
+                print(f"[rank 0] {comp}: CV {report['cv_k']}-fold x {report['cv_repeats']}: "
+                      f"R2_test mean={report['cv_r2_test_mean']:.3g} std={report['cv_r2_test_std']:.3g}")
 
             # print(
             #     f"[rank 0] {comp}: attempted={attempted} processed={processed} "
             #     f"skipped={skipped} train_rows={X.shape[0]} R2={report.get('r2', np.nan):.3g}"
             # )
-            print(f"[rank 0] wrote: {out_metrics}")
-            print(f"[rank 0] wrote: {out_processed}")
-            print(f"[rank 0] wrote: {out_skipped}")
+            if manifest_path is None:
+                print(f"[rank 0] wrote: {out_metrics}")
+                print(f"[rank 0] wrote: {out_processed}")
+                print(f"[rank 0] wrote: {out_skipped}")
             print(f"[rank 0] wrote: {out_report}")
 
-        if args.compute_rotd:
-            rotd_rows = [r for sub in all_rotd for r in sub]
-            out_rotd = outpath(outdir, args.out_prefix, "metrics_RotD", ".csv")
-            write_rotd_csv(str(out_rotd), rotd_rows)
-            print(f"[rank 0] wrote: {out_rotd}")
+        if manifest_path is not None:
+            print(f"[rank 0] wrote: {manifest_path}")
+        else:
+            if args.compute_rotd:
+                out_rotd = outpath(outdir, args.out_prefix, "metrics_RotD", ".csv")
+                write_table_csv(str(out_rotd), sort_table_by_rsn(tables["rotd"], "rsn"))
+                print(f"[rank 0] wrote: {out_rotd}")
+            if psa is not None:
+                out_psa = outpath(outdir, args.out_prefix, "metrics_PSA", ".csv")
+                write_table_csv(str(out_psa), sort_table_by_rsn(tables["psa"], "rsn"))
+                print(f"[rank 0] wrote: {out_psa}")
 
 
 
@@ -1459,6 +4385,7 @@ if __name__ == "__main__":
 
 
 # NOTE: This is a time-domain RotD analog (based on max-abs acceleration and other time-domain scalars). It’s conceptually aligned with RotD, but it’s not the same as NGA’s RotD of response spectra unless you compute PSA for each rotation/period.
+# --compute-psa does that: PSA for H1, H2 and RotD50 over --periods (<prefix>_metrics_PSA.csv).
 
 # ### How to run
 
@@ -6,6 +6,8 @@ What it does
 ------------
 1) Merge H1/H2 metrics into a single table (wide columns).
 2) Merge optional RotD metrics (pivoted wide).
+   Inputs are the per-table CSVs, or the sharded HDF5/Parquet results listed in
+   <prefix>_manifest.json (nga_mpi_ml_example.py --output-format hdf5|parquet).
 3) Write:
    - <prefix>_metrics_combined.csv
    - <prefix>_summary_plots.pdf
@@ -175,6 +177,59 @@ def _read_csv(path: Path) -> pd.DataFrame:
     return pd.read_csv(path)
 
 
+def _load_manifest(prefix: str, workdir: Path) -> Optional[Dict[str, object]]:
+    """<prefix>_manifest.json written by nga_mpi_ml_example.py --output-format hdf5|parquet (None if absent)."""
+    path = workdir / f"{prefix}_manifest.json"
+    if not path.exists():
+        return None
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def _read_manifest_table(manifest: Dict[str, object], workdir: Path, name: str) -> Optional[pd.DataFrame]:
+    """Concatenate all shards/slices of one result table listed in the manifest (None if not listed)."""
+    spec = manifest.get("tables", {}).get(name)
+    if spec is None:
+        return None
+
+    parts: List[pd.DataFrame] = []
+    fmt = str(manifest.get("format", ""))
+    for entry in spec["files"]:
+        path = workdir / entry["path"]
+        if fmt.startswith("hdf5"):
+            import h5py  # optional: only needed for HDF5 results
+            with h5py.File(path, "r") as h5:
+                arr = h5[entry["dataset"]][()]
+            df = pd.DataFrame({c: arr[c] for c in arr.dtype.names})
+            for c in arr.dtype.names:
+                if arr.dtype[c].kind == "S":
+                    df[c] = df[c].str.decode("utf-8")
+        elif fmt == "parquet":
+            df = pd.read_parquet(path)
+        else:
+            raise ValueError(f"Unknown manifest format: {fmt!r}")
+        parts.append(df)
+
+    if not parts:
+        return pd.DataFrame(columns=spec["columns"])
+    return pd.concat(parts, ignore_index=True)[spec["columns"]]
+
+
+def _read_result_table(prefix: str, workdir: Path, name: str, csv_stem: str) -> Optional[pd.DataFrame]:
+    """
+    Read one result table from the manifest (sharded outputs) if present, else from
+    <prefix>_<csv_stem>.csv. Returns None if neither exists.
+    """
+    manifest = _load_manifest(prefix, workdir)
+    if manifest is not None:
+        df = _read_manifest_table(manifest, workdir, name)
+        if df is not None:
+            return df
+    path = workdir / f"{prefix}_{csv_stem}.csv"
+    if not path.exists():
+        return None
+    return _read_csv(path)
+
+
 def _parse_kv_report(path: Path) -> Dict[str, object]:
     """Parse a simple key:value report (like the ML report txt)."""
     out: Dict[str, object] = {}
@@ -434,12 +489,11 @@ def _binned_percentiles(
 # -----------------------------------------------------------------------------
 
 def load_and_merge(prefix: str, workdir: Path) -> pd.DataFrame:
-    h1_path = workdir / f"{prefix}_metrics_H1.csv"
-    h2_path = workdir / f"{prefix}_metrics_H2.csv"
-    rotd_path = workdir / f"{prefix}_metrics_RotD.csv"
-
-    h1 = _read_csv(h1_path)
-    h2 = _read_csv(h2_path)
+    h1 = _read_result_table(prefix, workdir, "metrics_H1", "metrics_H1")
+    h2 = _read_result_table(prefix, workdir, "metrics_H2", "metrics_H2")
+    if h1 is None or h2 is None:
+        raise FileNotFoundError(f"Missing: {workdir / f'{prefix}_metrics_H1.csv'} / _H2.csv (or {prefix}_manifest.json)")
+    rotd = _read_result_table(prefix, workdir, "rotd", "metrics_RotD")
 
     if "rec_id" not in h1.columns or "rec_id" not in h2.columns:
         raise ValueError("Expected 'rec_id' column in metrics files.")
@@ -471,8 +525,7 @@ def load_and_merge(prefix: str, workdir: Path) -> pd.DataFrame:
         df["amp_range_geom_mean"] = np.nan
 
     # Optional RotD merge (pivot wide)
-    if rotd_path.exists():
-        rotd = pd.read_csv(rotd_path)
+    if rotd is not None:
         if {"rsn", "rotd"}.issubset(set(rotd.columns)):
             rotd = rotd.copy()
             rotd["rsn"] = pd.to_numeric(rotd["rsn"], errors="coerce")
@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""
+Repack a (merged) HDF5 file for whole-dataset reads.
+
+nga_mpi_ml_example.py reads every time series in one go, so the best layout is one piece per
+dataset: contiguous, or a single chunk when a filter is used. merge_hdf5_files keeps whatever
+layout each source file had (and its link modes leave the data in the sources); repack_hdf5
+rewrites everything into one self-contained file:
+
+- layout: contiguous | single chunk (auto: contiguous unless compressed)
+- compression: none | lzf | gzip-N, optionally with shuffle ("shuffle+gzip-4"); "auto" picks the
+  candidate with the lowest estimated read time from benchmark_h5_compression on a sample
+- paged aggregation (fs_strategy="page"): metadata and small raw data are packed into
+  fs_page_size pages, so opening the file and walking its groups costs a few large reads; open
+  it with a page buffer to keep those pages cached (nga_mpi_ml_example.py --io-mode tuned
+  --h5-page-buf-mb N; the flag is ignored with the default --io-mode)
+- external links and virtual datasets are materialized; soft links are kept
+- before/after read benchmark (benchmark_h5_read) in the returned report
+"""
+
+from __future__ import annotations
+
+import os
+import tempfile
+import time
+from typing import Optional
+
+import numpy as np
+import h5py
+
+COMPRESSION_CANDIDATES = ("none", "lzf", "gzip-1", "gzip-4", "shuffle+gzip-4", "gzip-9")
+_MAX_CHUNK_BYTES = (1 << 32) - 1  # HDF5 limit per chunk
+
+
+def _filter_kwargs(spec: str) -> dict:
+    """'none' | 'lzf' | 'gzip-N' | 'shuffle+<spec>' -> create_dataset kwargs."""
+    kw: dict = {}
+    if spec.startswith("shuffle+"):
+        kw["shuffle"] = True
+        spec = spec[len("shuffle+"):]
+    if spec == "none":
+        if kw:
+            raise ValueError("shuffle needs a compression filter")
+        return kw
+    if spec == "lzf":
+        kw["compression"] = "lzf"
+    elif spec.startswith("gzip-") and spec[5:].isdigit() and 0 <= int(spec[5:]) <= 9:
+        kw.update(compression="gzip", compression_opts=int(spec[5:]))
+    else:
+        raise ValueError(f"unknown compression {spec!r} (use none, lzf, gzip-0..9, shuffle+...)")
+    return kw
+
+
+def _single_chunk(shape: tuple, itemsize: int) -> tuple:
+    """Whole dataset as one chunk (leading dims halved if it would exceed the 4 GiB chunk limit)."""
+    chunk = [max(1, int(n)) for n in shape]
+    i = 0
+    while int(np.prod(chunk)) * itemsize > _MAX_CHUNK_BYTES and i < len(chunk):
+        if chunk[i] > 1:
+            chunk[i] = (chunk[i] + 1) // 2
+        else:
+            i += 1
+    return tuple(chunk)
+
+
+def _dataset_kwargs(ds_shape: tuple, dtype: np.dtype, layout: str, compression: str) -> dict:
+    """create_dataset layout/filter kwargs for one dataset; scalars, empty and non-numeric data stay plain."""
+    numeric = dtype.kind in "biufc"
+    size = int(np.prod(ds_shape)) if ds_shape else 1
+    if not ds_shape or size == 0:
+        return {}
+    filt = _filter_kwargs(compression) if numeric else {}
+    if layout == "auto":
+        layout = "chunked" if filt else "contiguous"
+    if layout == "contiguous":
+        if filt:
+            raise ValueError("filters need a chunked layout (layout='chunked' or 'auto')")
+        return {}
+    return {"chunks": _single_chunk(ds_shape, dtype.itemsize), **filt}
+
+
+def _walk(h5: h5py.File) -> tuple[list[str], list[str], list[tuple[str, str]]]:
+    """(groups, datasets, soft links) below the root; external links are followed."""
+    groups: list[str] = []
+    datasets: list[str] = []
+    soft: list[tuple[str, str]] = []
+    stack = ["/"]
+    while stack:
+        base = stack.pop()
+        g = h5[base]  # through an external link g.name is the path in the other file
+        for name in g.keys():
+            p = base.rstrip("/") + "/" + name
+            link = g.get(name, getlink=True)
+            if isinstance(link, h5py.SoftLink):
+                soft.append((p, link.path))
+                continue
+            if g.get(name, getclass=True) is h5py.Group:
+                groups.append(p)
+                stack.append(p)
+            else:
+                datasets.append(p)
+    groups.sort(key=lambda p: (p.count("/"), p))
+    datasets.sort()
+    return groups, datasets, soft
+
+
+def _sample(items: list[str], n: int, seed: int) -> list[str]:
+    if n <= 0 or len(items) <= n:
+        return list(items)
+    rng = np.random.default_rng(seed)
+    return sorted(items[i] for i in rng.choice(len(items), size=n, replace=False))
+
+
+def benchmark_h5_read(
+    path: str,
+    datasets: Optional[list[str]] = None,
+    *,
+    max_datasets: int = 200,
+    repeat: int = 3,
+    page_buf_mb: float = 0.0,
+    seed: int = 0,
+) -> dict:
+    """
+    Whole-dataset read throughput, the nga_mpi_ml_example.py access pattern: open the file, then
+    read_direct() each dataset into a reused float64 buffer. Best of `repeat` (file reopened
+    each time). Returns datasets, bytes, seconds, datasets_per_s, mb_per_s.
+    """
+    kw = {"page_buf_size": int(page_buf_mb * 1024 * 1024)} if page_buf_mb > 0 else {}
+    if datasets is None:
+        with h5py.File(path, "r") as h5:
+            datasets = _sample(_walk(h5)[1], max_datasets, seed)
+    best = float("inf")
+    nbytes = 0
+    buf = np.empty(0)
+    for _ in range(max(1, repeat)):
+        t0 = time.perf_counter()
+        nbytes = 0
+        with h5py.File(path, "r", **kw) as h5:
+            for p in datasets:
+                ds = h5[p]
+                if ds.dtype.kind not in "biuf" or ds.size == 0:
+                    # scalar strings come back as bytes/str; vlen data counts its element pointers
+                    nbytes += np.asarray(ds[()]).nbytes if ds.size else 0
+                    continue
+                if buf.size < ds.size:
+                    buf = np.empty(ds.size)
+                out = buf[:ds.size].reshape(ds.shape)
+                ds.read_direct(out)
+                nbytes += ds.size * ds.dtype.itemsize
+        best = min(best, time.perf_counter() - t0)
+    return {
+        "datasets": len(datasets),
+        "bytes": nbytes,
+        "seconds": best,
+        "datasets_per_s": len(datasets) / best if best > 0 else float("nan"),
+        "mb_per_s": nbytes / 1e6 / best if best > 0 else float("nan"),
+    }
+
+
+def benchmark_h5_compression(
+    path: str,
+    candidates: tuple = COMPRESSION_CANDIDATES,
+    *,
+    sample: int = 50,
+    io_mbps: float = 500.0,
+    repeat: int = 3,
+    workdir: Optional[str] = None,
+    seed: int = 0,
+) -> list[dict]:
+    """
+    Write a sample of datasets with each candidate (single chunk) and time reading them back.
+
+    The read is warm, so it measures decompression; est_read_s adds stored_bytes / io_mbps for
+    the storage side (set io_mbps to what one reader gets from your filesystem). Rows are
+    sorted by est_read_s: compression, ratio, stored_bytes, write_s, read_s, est_read_s.
+    """
+    with h5py.File(path, "r") as src:
+        names = [p for p in _sample(_walk(src)[1], sample, seed)
+                 if src[p].dtype.kind in "biufc" and src[p].shape and src[p].size > 0]
+        data = {p: src[p][()] for p in names}
+    raw = sum(a.nbytes for a in data.values())
+    rows = []
+    for spec in candidates:
+        fd, tmp = tempfile.mkstemp(suffix=".h5", dir=workdir)
+        os.close(fd)
+        try:
+            t0 = time.perf_counter()
+            with h5py.File(tmp, "w") as f:
+                for i, (p, a) in enumerate(data.items()):
+                    f.create_dataset(f"d{i}", data=a, **_dataset_kwargs(a.shape, a.dtype, "auto", spec))
+            write_s = time.perf_counter() - t0
+            with h5py.File(tmp, "r") as f:
+                stored = sum(f[k].id.get_storage_size() for k in f)
+            read_s = benchmark_h5_read(tmp, [f"d{i}" for i in range(len(data))], repeat=repeat)["seconds"]
+        finally:
+            os.remove(tmp)
+        rows.append({
+            "compression": spec,
+            "ratio": raw / stored if stored else float("nan"),
+            "stored_bytes": stored,
+            "write_s": write_s,
+            "read_s": read_s,
+            "est_read_s": read_s + stored / 1e6 / io_mbps,
+        })
+    rows.sort(key=lambda r: r["est_read_s"])
+    return rows
+
+
+def repack_hdf5(
+    input: str,
+    output: str,
+    layout: str = "auto",                  # "auto"|"contiguous"|"chunked" (single chunk)
+    compression: str = "auto",             # "auto"|"none"|"lzf"|"gzip-N"|"shuffle+..."
+    candidates: tuple = COMPRESSION_CANDIDATES,
+    io_mbps: float = 500.0,                # storage read bandwidth used by compression="auto"
+    paged: bool = True,                    # fs_strategy="page" (paged aggregation)
+    fs_page_size: int = 64 * 1024,
+    meta_block_size: int = 1024 * 1024,    # metadata aggregation block when paged=False
+    benchmark: bool = True,                # before/after benchmark_h5_read
+    max_datasets: int = 200,               # datasets sampled by the benchmarks
+    page_buf_mb: float = 0.0,              # page buffer for the "after" read benchmark of a paged file
+    verbose: bool = False,
+) -> dict:
+    """
+    Rewrite every dataset of `input` into `output` with the chosen layout/compression and file
+    space strategy; groups, attributes and soft links are kept, external links and virtual
+    datasets are read and stored for real.
+
+    Returns a report: compression (chosen), compression_benchmark (rows, if "auto"), datasets,
+    bytes_in/bytes_out (file sizes), repack_s, read_before/read_after (benchmark_h5_read).
+    """
+    if layout not in {"auto", "contiguous", "chunked"}:
+        raise ValueError("layout must be one of: auto, contiguous, chunked")
+    in_abs, out_abs = os.path.abspath(input), os.path.abspath(output)
+    if in_abs == out_abs:
+        raise RuntimeError("Output file is the input file.")
+    if not os.path.exists(in_abs):
+        raise FileNotFoundError(input)
+    os.makedirs(os.path.dirname(out_abs) or ".", exist_ok=True)
+    report: dict = {"input": input, "output": output, "layout": layout}
+
+    with h5py.File(in_abs, "r") as src:
+        _, all_ds, _ = _walk(src)
+    bench_ds = _sample(all_ds, max_datasets, 0)
+    if benchmark:
+        report["read_before"] = benchmark_h5_read(in_abs, bench_ds)
+        if verbose:
+            r = report["read_before"]
+            print(f"[before] {r['datasets']} datasets: {r['datasets_per_s']:.0f} datasets/s, {r['mb_per_s']:.1f} MB/s")
+
+    if compression == "auto":
+        if layout == "contiguous":
+            compression = "none"
+        else:
+            rows = benchmark_h5_compression(in_abs, candidates, io_mbps=io_mbps,
+                                            workdir=os.path.dirname(out_abs))
+            report["compression_benchmark"] = rows
+            compression = rows[0]["compression"]
+            if verbose:
+                for r in rows:
+                    print(f"[compression] {r['compression']:<16s} ratio {r['ratio']:5.2f}  "
+                          f"read {r['read_s'] * 1e3:8.2f} ms  est {r['est_read_s'] * 1e3:8.2f} ms")
+    _filter_kwargs(compression)  # validate before creating the output
+    report["compression"] = compression
+
+    fkw = ({"fs_strategy": "page", "fs_page_size": int(fs_page_size), "fs_persist": True}
+           if paged else {"meta_block_size": int(meta_block_size)})
+    t0 = time.perf_counter()
+    with h5py.File(in_abs, "r") as src, h5py.File(out_abs, "w", **fkw) as dst:
+        groups, datasets, soft = _walk(src)
+        for k, v in src.attrs.items():
+            dst.attrs[k] = v
+        for p in groups:
+            g = dst.require_group(p)
+            for k, v in src[p].attrs.items():
+                g.attrs[k] = v
+        for p in datasets:
+            ds = src[p]
+            kw = _dataset_kwargs(ds.shape, ds.dtype, layout, compression)
+            # h5py cannot round-trip a fill value for string/vlen types; leave those at the default
+            if h5py.check_string_dtype(ds.dtype) is None and h5py.check_vlen_dtype(ds.dtype) is None:
+                kw["fillvalue"] = ds.fillvalue
+            out = dst.create_dataset(p, data=ds[()], dtype=ds.dtype, **kw)
+            for k, v in ds.attrs.items():
+                out.attrs[k] = v
+        for p, target in soft:
+            dst[p] = h5py.SoftLink(target)
+    report["repack_s"] = time.perf_counter() - t0
+    report["datasets"] = len(datasets)
+    report["bytes_in"] = os.path.getsize(in_abs)
+    report["bytes_out"] = os.path.getsize(out_abs)
+
+    if benchmark:
+        report["read_after"] = benchmark_h5_read(out_abs, bench_ds, page_buf_mb=page_buf_mb if paged else 0.0)
+    if verbose:
+        print(f"Repacked {len(datasets)} datasets ({compression}, {layout}) in {report['repack_s']:.2f} s: "
+              f"{report['bytes_in'] / 1e6:.1f} MB -> {report['bytes_out'] / 1e6:.1f} MB")
+        if benchmark:
+            r = report["read_after"]
+            speedup = report["read_before"]["seconds"] / r["seconds"] if r["seconds"] > 0 else float("nan")
+            print(f"[after] {r['datasets']} datasets: {r['datasets_per_s']:.0f} datasets/s, "
+                  f"{r['mb_per_s']:.1f} MB/s ({speedup:.2f}x)")
+    return report
@@ -6,18 +6,241 @@ Merge multiple HDF5 files into one output HDF5.
 - Preserves dataset layout (compression/chunks) via HDF5 copy
 - Conflict policies: skip | overwrite | error
 - Optional prefixing: put each input under /<prefixN>/... to avoid collisions
+- Optional parallel pre-scan (workers=N): inputs are listed by worker processes, a copy plan
+  (including every collision) is resolved up front, then a single writer does the copies
+- Throughput report (files/s, MB/s) in the returned stats and, with verbose, on stdout
+- link_mode="external"|"virtual": no data is copied; groups are created in the output and each
+  dataset becomes an external link / virtual dataset pointing at its source file
+- append=True: merge only new or changed inputs into an existing output, using the per-input
+  fingerprints (path, size, mtime, optional sha256) kept in the <output>_inputs.csv sidecar
+  (written only by append runs or when inputs_csv is given)
 
 Author: Silvia Mazzoni (silviamazzoni@yahoo.com)
 """
 
 from __future__ import annotations
 
+import contextlib
+import hashlib
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor
 from typing import Iterable, Optional
 
 import h5py
 import csv
 
+
+def _safe_group_name(s: str) -> str:
+    base = os.path.basename(s)
+    stem = os.path.splitext(base)[0]
+    return "".join(ch if ch.isalnum() or ch in ("_", "-") else "_" for ch in stem)
+
+
+def _should_exclude(path: str, exclude_prefixes: list[str]) -> bool:
+    return any(path.startswith(x.rstrip("/") + "/") or path == x.rstrip("/") for x in exclude_prefixes)
+
+
+def _ancestors(path: str) -> Iterable[str]:
+    """'/a/b/c' -> '/a/b', '/a' (not '/')."""
+    p = os.path.dirname(path)
+    while p not in ("", "/"):
+        yield p
+        p = os.path.dirname(p)
+
+
+_FINGERPRINT_FIELDS = ["path", "size", "mtime_ns", "sha256", "prefix", "link_mode"]
+
+
+def _file_sha256(path: str, chunk: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _read_fingerprints(path: str) -> dict:
+    """Sidecar rows keyed by absolute input path ({} if there is no sidecar)."""
+    if not os.path.exists(path):
+        return {}
+    with open(path, newline="", encoding="utf-8") as f:
+        return {row["path"]: row for row in csv.DictReader(f)}
+
+
+def _input_unchanged(old: Optional[dict], fp: dict, link_mode: str, hash_inputs: bool) -> bool:
+    """True if fp (size/mtime of an input, sha256 filled in on demand) matches its recorded row."""
+    if old is None or old.get("link_mode", "copy") != link_mode or int(old["size"]) != fp["size"]:
+        return False
+    if int(old["mtime_ns"]) == fp["mtime_ns"]:
+        fp["sha256"] = old.get("sha256", "")
+        return True
+    # touched (or copied) but maybe not modified: only a hash can tell
+    if hash_inputs and old.get("sha256"):
+        fp["sha256"] = _file_sha256(fp["path"])
+        return fp["sha256"] == old["sha256"]
+    return False
+
+
+def _existing_paths(h5: h5py.File) -> list[str]:
+    """Every link path in an existing output; groups behind external links are not entered."""
+    out: list[str] = []
+    stack = ["/"]
+    while stack:
+        g = h5[stack.pop()]
+        for name in g.keys():
+            p = g.name.rstrip("/") + "/" + name
+            out.append(p)
+            if isinstance(g.get(name, getlink=True), h5py.HardLink) and g.get(name, getclass=True) is h5py.Group:
+                stack.append(p)
+    return out
+
+
+def _link_virtual(dst: h5py.File, dp: str, src_file: str, sp: str, meta: dict) -> None:
+    """Virtual dataset at dp mapping all of src_file:sp 1:1 (meta from _scan_input); attributes are copied."""
+    dtype = meta["dtype"]
+    layout = h5py.VirtualLayout(shape=meta["shape"], dtype=dtype)
+    layout[...] = h5py.VirtualSource(src_file, sp, shape=meta["shape"], dtype=dtype)
+    # h5py writes a bogus fill value into the DCPL for string/vlen types; leave those at the default
+    variable = h5py.check_string_dtype(dtype) is not None or h5py.check_vlen_dtype(dtype) is not None
+    fill = {} if variable else {"fillvalue": meta["fillvalue"]}
+    vds = dst.create_virtual_dataset(dp, layout, **fill)
+    for k, v in meta["attrs"].items():
+        vds.attrs[k] = v
+
+
+def _scan_input(in_path: str, include_paths: list[str], exclude_prefixes: list[str], link_mode: str = "copy") -> dict:
+    """
+    Read-only listing of one input (runs in a worker process with workers > 1).
+
+    Returns {"objs": {path: (is_group, stored_bytes)}, "includes": [[path, ...] per include],
+    "has_excluded": [group paths with an excluded object below them], "meta": {path: {...}}}.
+    Include lists follow the serial visit order: parents first, then by name. In link modes
+    "meta" holds what the writer would otherwise reopen the input for: group attributes, and
+    for "virtual" also dataset attributes, shape, dtype and fillvalue.
+    """
+    objs: dict = {}
+    metas: dict = {}
+    with h5py.File(in_path, "r") as src:
+        def visitor(name: str, obj):
+            is_group = isinstance(obj, h5py.Group)
+            objs["/" + name] = (is_group, 0 if is_group else int(obj.id.get_storage_size()))
+            if is_group and link_mode != "copy":
+                metas["/" + name] = {"attrs": dict(obj.attrs)}
+            elif link_mode == "virtual":
+                metas["/" + name] = {"attrs": dict(obj.attrs), "shape": obj.shape, "dtype": obj.dtype,
+                                     "fillvalue": obj.fillvalue}
+
+        src.visititems(visitor)
+
+        includes = []
+        for inc in include_paths:
+            inc = inc.rstrip("/") or "/"
+            if inc != "/" and inc not in src:
+                includes.append([])
+                continue
+            if inc == "/":
+                paths = list(objs)
+            else:
+                paths = [p for p in objs if p.startswith(inc + "/")]
+                if inc not in objs:  # e.g. reached through a soft link
+                    obj = src[inc]
+                    is_group = isinstance(obj, h5py.Group)
+                    objs[inc] = (is_group, 0 if is_group else int(obj.id.get_storage_size()))
+            paths.sort(key=lambda p: (p.count("/"), p))
+            # If include root itself is a dataset/group it is copied too
+            if inc != "/" and not _should_exclude(inc, exclude_prefixes):
+                paths = [inc] + paths
+            includes.append([p for p in paths if not _should_exclude(p, exclude_prefixes)])
+
+    has_excluded = set()
+    for p in objs:
+        if _should_exclude(p, exclude_prefixes):
+            has_excluded.update(_ancestors(p))
+    return {"objs": objs, "includes": includes, "has_excluded": sorted(has_excluded), "meta": metas}
+
+
+class _MergePlan:
+    """
+    Destination tree as it will look after each planned step (paths only, no data).
+
+    A group is copied recursively as one unit unless something below it is excluded (or groups
+    are not copied at all: link modes); then it is created empty (attributes copied) and its
+    members are planned one by one. Paths under a unit already copied from the same input are
+    not collisions.
+    """
+
+    def __init__(self, conflict: str, copy_groups: bool = True, existing: Iterable[str] = ()):
+        self.conflict = conflict
+        self.copy_groups = copy_groups
+        self.kids: dict = {"/": set()}
+        self.collisions: list[dict] = []
+        self.objects = 0
+        self.nbytes = 0
+        for p in existing:  # append: what the output already holds
+            self._add(p)
+
+    def _add(self, path: str) -> None:
+        parent = os.path.dirname(path) or "/"
+        if parent not in self.kids:
+            self._add(parent)
+        self.kids[parent].add(path)
+        self.kids.setdefault(path, set())
+
+    def _remove(self, path: str) -> None:
+        for k in list(self.kids.get(path, ())):
+            self._remove(k)
+        self.kids.pop(path, None)
+        self.kids[os.path.dirname(path) or "/"].discard(path)
+
+    def plan_input(self, in_path: str, prefix: str, scan: dict, verbose: bool = False) -> list[tuple]:
+        """Ordered writer steps (op, src_path, dst_path, delete_first) for one input; op is copy|group."""
+        objs = scan["objs"]
+        has_excluded = set(scan["has_excluded"])
+        src_kids: dict = {}
+        for p in objs:
+            src_kids.setdefault(os.path.dirname(p) or "/", []).append(p)
+
+        if prefix:
+            self._add(prefix)
+        steps: list[tuple] = []
+        copied: set = set()  # units copied from this input
+        for paths in scan["includes"]:
+            for sp in paths:
+                dp = prefix + sp
+                if sp in copied or any(a in copied for a in _ancestors(sp)):
+                    continue
+                delete_first = False
+                if dp in self.kids:
+                    self.collisions.append({"path": dp, "source_file": in_path, "action": self.conflict})
+                    if self.conflict == "skip":
+                        if verbose: print(f"[skip] {dp} from {in_path}")
+                        continue
+                    if self.conflict == "error":
+                        raise RuntimeError(f"Conflict at destination path: {dp}")
+                    if verbose: print(f"[overwrite] {dp} from {in_path}")
+                    self._remove(dp)
+                    delete_first = True
+
+                is_group = objs[sp][0]
+                if is_group and (sp in has_excluded or not self.copy_groups):
+                    steps.append(("group", sp, dp, delete_first))
+                    self._add(dp)
+                    self.objects += 1
+                    continue
+
+                steps.append(("copy", sp, dp, delete_first))
+                copied.add(sp)
+                stack = [sp]
+                while stack:
+                    s = stack.pop()
+                    self._add(prefix + s)
+                    self.objects += 1
+                    self.nbytes += objs.get(s, (False, 0))[1]
+                    stack.extend(src_kids.get(s, ()))
+        return steps
+
+
 def merge_hdf5_files(
     inputs: list[str],
     output: str,
@@ -28,21 +251,52 @@ def merge_hdf5_files(
     exclude_prefixes: Optional[list[str]] = None,
     copy_root_attrs: bool = False,
     verbose: bool = False,
-) -> None:
+    workers: int = 1,                        # >1: pre-scan inputs in this many processes; 0: os.cpu_count()
+    link_mode: str = "copy",                 # "copy"|"external"|"virtual"
+    append: bool = False,                    # True: add only new/changed inputs to an existing output
+    inputs_csv: str = "",                    # fingerprint sidecar (default with append: <output>_inputs.csv)
+    hash_inputs: bool = False,               # also record sha256; a touched-but-identical input is not re-merged
+) -> dict:
     """
     Merge multiple HDF5 files into a single output.
 
     - Preserves dataset layout (chunks/compression/filters) via HDF5 copy.
     - Optionally merges only selected subtrees (include_paths).
     - Optional prefixing avoids collisions by placing each input under a group.
+    - workers > 1 lists the inputs in parallel; the copy plan and all conflicts are resolved
+      before the output is opened, and one writer does the copies (HDF5 writes are serialized
+      anyway).
+    - link_mode="external" writes each dataset as an HDF5 external link and "virtual" as a
+      virtual dataset (dataset attributes copied) pointing at the source; groups and their
+      attributes are created for real, so conflicts, prefixes and collisions_csv behave as in
+      "copy". Source paths are stored relative to the output directory: keep the inputs next to
+      the merged file (or move them together) and do not modify them afterwards.
+    - With append=True or an explicit inputs_csv, the run records one fingerprint row per input
+      (absolute path, size, mtime_ns, sha256 if hash_inputs, prefix, link_mode) in inputs_csv
+      (default <output>_inputs.csv); a plain merge writes no sidecar, so build an output that will
+      be appended to later with append=True from the start. With append=True and an existing output,
+      inputs whose size and mtime (or, with hash_inputs, content) match their row are skipped;
+      new and changed inputs are merged into the file as it is, so paths they bring again go
+      through the conflict policy ("overwrite" to replace, "skip" to keep the old data; a changed
+      input that loses paths to "skip" keeps its old fingerprint row and a warning is printed).
+      prefix_mode="index" keeps the recorded prefix of known inputs and numbers new ones after
+      them. Inputs dropped from the list stay in the output. Replaced data is not reclaimed
+      from the file (see h5_repack).
+
+    Returns throughput stats: files (merged in this run), unchanged (skipped by append), stale
+    (changed inputs whose fingerprint was kept because "skip" kept old data), objects,
+    bytes (stored size of the copied or linked datasets), collisions, scan_s, write_s, total_s,
+    files_per_s, mb_per_s.
 
     Author: Silvia Mazzoni (silviamazzoni@yahoo.com)
     """
-    collisions = []  # list of dicts
+    t0 = time.perf_counter()
     if conflict not in {"skip", "overwrite", "error"}:
         raise ValueError("conflict must be one of: skip, overwrite, error")
     if prefix_mode not in {"none", "filename", "index"}:
         raise ValueError("prefix_mode must be one of: none, filename, index")
+    if link_mode not in {"copy", "external", "virtual"}:
+        raise ValueError("link_mode must be one of: copy, external, virtual")
 
     out_abs = os.path.abspath(output)
     in_abs = [os.path.abspath(p) for p in inputs]
@@ -57,51 +311,86 @@ def merge_hdf5_files(
 
     include_paths = include_paths or ["/"]  # default: whole file
     exclude_prefixes = exclude_prefixes or []
+    workers = int(workers) if workers else (os.cpu_count() or 1)
 
-    def _safe_group_name(s: str) -> str:
-        base = os.path.basename(s)
-        stem = os.path.splitext(base)[0]
-        return "".join(ch if ch.isalnum() or ch in ("_", "-") else "_" for ch in stem)
-
-    def _should_exclude(path: str) -> bool:
-        return any(path.startswith(x.rstrip("/") + "/") or path == x.rstrip("/") for x in exclude_prefixes)
+    # 0) fingerprints: which inputs does this run have to merge?
+    write_fingerprints = append or len(inputs_csv) > 0
+    if len(inputs_csv) == 0:
+        inputs_csv = f"{output}_inputs.csv"
+    appending = append and os.path.exists(out_abs)
+    prev = _read_fingerprints(inputs_csv) if appending else {}
+    fingerprints = {}
+    merge_idx = []
+    for idx, p in enumerate(in_abs):
+        st = os.stat(p)
+        fp = {"path": p, "size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": "",
+              "prefix": "", "link_mode": link_mode}
+        if _input_unchanged(prev.get(p), fp, link_mode, hash_inputs):
+            fp["prefix"] = prev[p]["prefix"]
+            if verbose: print(f"[unchanged] {inputs[idx]}")
+        else:
+            merge_idx.append(idx)
+        if hash_inputs and not fp["sha256"]:
+            fp["sha256"] = _file_sha256(p)
+        fingerprints[p] = fp
+    n_unchanged = len(inputs) - len(merge_idx)
+    all_inputs, all_abs = inputs, in_abs
+    inputs = [all_inputs[i] for i in merge_idx]
+    in_abs = [all_abs[i] for i in merge_idx]
 
-    def _iter_paths_under(src: h5py.File, root: str) -> list[str]:
-        """Return all group/dataset paths under root (excluding root itself)."""
-        out: list[str] = []
-        root = root.rstrip("/")
-        if root == "":
-            root = "/"
-        if root != "/" and root not in src:
-            return out
+    # 1) scan: read-only, one task per input
+    if workers > 1 and len(inputs) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(inputs))) as ex:
+            scans = list(ex.map(_scan_input, inputs, [include_paths] * len(inputs),
+                                [exclude_prefixes] * len(inputs), [link_mode] * len(inputs),
+                                chunksize=max(1, len(inputs) // (4 * workers))))
+    else:
+        scans = [_scan_input(p, include_paths, exclude_prefixes, link_mode) for p in inputs]
+    t_scan = time.perf_counter()
 
-        def visitor(name: str, obj):
-            p = "/" + name
-            if root == "/":
-                out.append(p)
+    # 2) plan: destination paths and collisions, in input order
+    existing: list[str] = []
+    if appending:
+        with h5py.File(out_abs, "r") as h5:
+            existing = _existing_paths(h5)
+    plan = _MergePlan(conflict, copy_groups=(link_mode == "copy"), existing=existing)
+    next_index = max([int(r["prefix"][6:]) for r in prev.values()
+                      if r.get("prefix", "").startswith("/file_") and r["prefix"][6:].isdigit()] + [0])
+    prefixes, steps = [], []
+    for idx, in_path in enumerate(inputs):
+        if prefix_mode == "none":
+            prefix = ""
+        elif prefix_mode == "index":
+            if appending:
+                old_prefix = prev.get(in_abs[idx], {}).get("prefix", "")
+                if not old_prefix.startswith("/file_"):
+                    next_index += 1
+                    old_prefix = f"/file_{next_index}"
+                prefix = old_prefix
             else:
-                if p.startswith(root + "/") and p != root:
-                    out.append(p)
+                prefix = f"/file_{merge_idx[idx]+1}"
+        else:  # filename
+            prefix = "/" + _safe_group_name(in_path)
+        prefixes.append(prefix)
+        fingerprints[in_abs[idx]]["prefix"] = prefix
+        steps.append(plan.plan_input(in_path, prefix, scans[idx], verbose=verbose))
+    collisions = plan.collisions
 
-        src.visititems(visitor)
-        # parents first
-        out.sort(key=lambda p: (p.count("/"), p))
-        # exclude the include root if it shows up (it can)
-        out = [p for p in out if p != root]
-        return out
-
-    with h5py.File(out_abs, "w") as dst:
-        for idx, in_path in enumerate(inputs):
-            if prefix_mode == "none":
-                prefix = ""
-            elif prefix_mode == "index":
-                prefix = f"/file_{idx+1}"
-                dst.require_group(prefix)
-            else:  # filename
-                prefix = "/" + _safe_group_name(in_path)
+    # 3) write: single writer, one bulk copy (or link) per planned unit.
+    # Link modes only reopen an input for copy_root_attrs; everything else came from the scan.
+    t_write0 = time.perf_counter()
+    with h5py.File(out_abs, "a" if appending else "w") as dst:
+        made = {"/"}  # groups known to exist in dst (saves a require_group per step)
+        for in_path, src_abs, prefix, in_steps, scan in zip(inputs, in_abs, prefixes, steps, scans):
+            src_ref = os.path.relpath(src_abs, os.path.dirname(out_abs))
+            if prefix:
                 dst.require_group(prefix)
+                made.add(prefix)
+            if not in_steps and not copy_root_attrs:
+                continue
 
-            with h5py.File(in_path, "r") as src:
+            need_src = copy_root_attrs or link_mode == "copy"
+            with (h5py.File(in_path, "r") if need_src else contextlib.nullcontext()) as src:
                 # Optionally copy root attrs into the destination root (or prefix group)
                 if copy_root_attrs:
                     target = dst[prefix] if prefix else dst["/"]
@@ -115,43 +404,53 @@ def merge_hdf5_files(
                         except Exception:
                             pass
 
-                for inc in include_paths:
-                    inc = inc.rstrip("/") or "/"
-                    paths = _iter_paths_under(src, inc)
-
-                    # If include root itself is a dataset/group and you want it copied too:
-                    if inc != "/" and inc in src and not _should_exclude(inc):
-                        paths = [inc] + paths
-
-                    for sp in paths:
-                        if _should_exclude(sp):
-                            continue
-                        # destination path mirrors source path, with optional prefix
-                        dp = prefix + sp
-
-                        if dp in dst:
-                            collisions.append({"path": dp, "source_file": in_path, "action": conflict})
-                            if conflict == "skip":
-                                if verbose: print(f"[skip] {dp} from {in_path}")
-                                continue
-                            if conflict == "overwrite":
-                                if verbose: print(f"[overwrite] {dp} from {in_path}")
-                                del dst[dp]
-                            if conflict == "error":
-                                raise RuntimeError(f"Conflict at destination path: {dp}")
-
-                        # Copy into parent group
-                        parent = os.path.dirname(dp.rstrip("/")) or "/"
-                        name = os.path.basename(dp.rstrip("/"))
+                for op, sp, dp, delete_first in in_steps:
+                    if delete_first:
+                        del dst[dp]
+                        made = {g for g in made if g != dp and not g.startswith(dp + "/")}
+                    if op == "group":
+                        g = dst.require_group(dp)
+                        made.add(dp)
+                        attrs = scan["meta"][sp]["attrs"] if link_mode != "copy" else src[sp].attrs
+                        for k, v in attrs.items():
+                            g.attrs[k] = v
+                        continue
+                    # Copy into parent group
+                    parent = os.path.dirname(dp.rstrip("/")) or "/"
+                    name = os.path.basename(dp.rstrip("/"))
+                    if parent not in made:
                         dst.require_group(parent)
+                        made.add(parent)
+                    if link_mode == "external":
+                        dst[dp] = h5py.ExternalLink(src_ref, sp)
+                    elif link_mode == "virtual":
+                        _link_virtual(dst, dp, src_ref, sp, scan["meta"][sp])
+                    else:
                         dst[parent].copy(src[sp], name)
 
-                        if verbose:
-                            print(f"[copy] {sp} -> {dp}")
-    # after merge finishes:
+                    if verbose:
+                        print(f"[{link_mode}] {sp} -> {dp}")
+    t_end = time.perf_counter()
+
+    # after merge finishes: fingerprints (rows of inputs not listed this time are kept).
+    # A changed input that lost paths to conflict="skip" still has its old data in the output:
+    # keep its previous row so the output is not recorded as up to date with it.
+    skipped_from = {c["source_file"] for c in collisions if c["action"] == "skip"}
+    stale = [in_path for in_path, src_abs in zip(inputs, in_abs) if src_abs in prev and in_path in skipped_from]
+    for in_path in stale:
+        fingerprints[os.path.abspath(in_path)] = prev[os.path.abspath(in_path)]
+        print(f"[warning] {in_path} changed but conflict='skip' kept the old data for some of its paths; "
+              f"its fingerprint was not updated (use conflict='overwrite' to replace it)")
+    if write_fingerprints:
+        rows = {**prev, **fingerprints}
+        with open(inputs_csv, "w", newline="", encoding="utf-8") as f:
+            w = csv.DictWriter(f, fieldnames=_FINGERPRINT_FIELDS)
+            w.writeheader()
+            w.writerows(rows.values())
+
     if collisions:
         if len(collisions_csv)==0:
-            
+
             collisions_csv = f'{output}_collisions.csv'
         with open(collisions_csv, "w", newline="", encoding="utf-8") as f:
             w = csv.DictWriter(f, fieldnames=["path", "source_file", "action"])
@@ -160,5 +459,24 @@ def merge_hdf5_files(
         if verbose:
             print(f"Wrote collisions log: {collisions_csv} (n={len(collisions)})")
 
-
-
+    total_s = t_end - t0
+    stats = {
+        "files": len(inputs),
+        "unchanged": n_unchanged,
+        "stale": len(stale),
+        "link_mode": link_mode,
+        "objects": plan.objects,
+        "bytes": plan.nbytes,
+        "collisions": len(collisions),
+        "scan_s": t_scan - t0,
+        "write_s": t_end - t_write0,
+        "total_s": total_s,
+        "files_per_s": len(inputs) / total_s if total_s > 0 else float("nan"),
+        "mb_per_s": plan.nbytes / 1e6 / total_s if total_s > 0 else float("nan"),
+    }
+    if verbose:
+        kept = f", {n_unchanged} unchanged" if appending else ""
+        print(f"Merged ({link_mode}) {stats['files']} files{kept} ({stats['objects']} objects, {stats['bytes'] / 1e6:.1f} MB) "
+              f"in {total_s:.2f} s [scan {stats['scan_s']:.2f} s, {workers} worker(s); write {stats['write_s']:.2f} s]: "
+              f"{stats['files_per_s']:.1f} files/s, {stats['mb_per_s']:.1f} MB/s")
+    return stats